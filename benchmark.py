@@ -0,0 +1,1112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+sys.path.append('./language-models')
+sys.path.append('./data')
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import tempfile
+import time
+from data.dataLoader import *
+from vocabulary import Vocabulary
+from unigramModel import *
+from bigramModel import *
+from trigramModel import *
+from backoffModel import *
+from frozenModel import *
+from compressCorpus import compressDirectory
+from corpusFiles import stripCompression
+from midiText import readMappedNoteFields, readNoteFields
+
+
+# -----------------------------------------------------------------------------
+# Helpers ---------------------------------------------------------------------
+
+def timeCall(function, *args, **kwargs):
+    """
+    Calls function with the given arguments and returns a tuple of its
+    return value and the number of seconds the call took.
+    """
+    start = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - start
+
+def printTiming(label, seconds):
+    """
+    Prints one line of benchmark output.
+    """
+    print '  %-40s %9.3f s' % (label, seconds)
+
+
+# -----------------------------------------------------------------------------
+# Benchmarks ------------------------------------------------------------------
+
+def benchmarkMusicCache(platform):
+    """
+    Compares a cold start of DataLoader.loadMusic (empty cache, every file
+    is parsed and the cache is written) with a warm start (every song is
+    read back from the cache), and checks that both give exactly the same
+    songs as loading without the cache.
+    """
+    print 'Music cache for platform', platform
+    cache = MusicCache(platform)
+    if os.path.exists(cache.cacheDir):
+        shutil.rmtree(cache.cacheDir)
+
+    uncached = DataLoader()
+    _, seconds = timeCall(uncached.loadMusic, platform, useCache=False)
+    printTiming('no cache', seconds)
+
+    cold = DataLoader()
+    _, seconds = timeCall(cold.loadMusic, platform)
+    printTiming('cold cache (parse and write)', seconds)
+
+    warm = DataLoader()
+    _, seconds = timeCall(warm.loadMusic, platform)
+    printTiming('warm cache', seconds)
+
+    print '  songs identical:', uncached.songs == cold.songs == warm.songs
+
+def benchmarkParallelLoad(platform, workers):
+    """
+    Compares parsing every file of a platform serially with parsing them
+    in a pool of workers processes, and checks the songs come out in the
+    same order.
+    """
+    print 'Parallel load for platform', platform, 'with', workers, 'workers'
+    serial = DataLoader()
+    _, seconds = timeCall(serial.loadMusic, platform, useCache=False)
+    printTiming('serial', seconds)
+
+    parallel = DataLoader()
+    _, seconds = timeCall(parallel.loadMusic, platform, useCache=False,
+                          workers=workers)
+    printTiming('%d workers' % workers, seconds)
+
+    print '  songs identical:', serial.songs == parallel.songs
+
+def parseMidiFileBySplitting(dataLoader, midiFile):
+    """
+    The original track 1 note extraction loop, which splits every line of
+    the file into tokens. Kept here as the baseline for
+    benchmarkNoteLineParser.
+    """
+    F = open(midiFile, "r")
+    lines = F.readlines()
+    F.close()
+
+    song = []
+    for line in lines:
+        line = line.split()
+        if "TR" in line and line[line.index("TR") + 1] == "1" \
+                and "NT" in line:
+            noteIndex = line.index("NT")
+            pitch = dataLoader.formatPitch(line[noteIndex + 1])
+            duration = dataLoader.formatDuration(line[noteIndex + 2])
+            song.append((pitch, duration))
+
+    return song
+
+def benchmarkNoteLineParser(platform, numFiles):
+    """
+    Compares the original split-every-line loop with
+    DataLoader.parseMidiFile on the numFiles largest files of a platform,
+    checking that both extract the same notes.
+    """
+    midiDir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'data', 'midi', platform)
+    midiFiles = [os.path.join(midiDir, name) for name in os.listdir(midiDir)]
+    midiFiles.sort(key=os.path.getsize, reverse=True)
+
+    dataLoader = DataLoader()
+    for midiFile in midiFiles[:numFiles]:
+        print os.path.basename(midiFile),
+        print '(%.1f MB)' % (os.path.getsize(midiFile) / 1e6)
+        expected, seconds = timeCall(parseMidiFileBySplitting, dataLoader,
+                                     midiFile)
+        printTiming('split every line', seconds)
+        song, seconds = timeCall(dataLoader.parseMidiFile, midiFile)
+        printTiming('fixed-column parser', seconds)
+        _, seconds = timeCall(readMappedNoteFields, midiFile)
+        printTiming('  of which field extraction', seconds)
+        print '  notes identical:', song == expected
+
+def benchmarkNoteConversion(platform):
+    """
+    Compares converting every track 1 note of a platform with
+    formatPitch and formatDuration against the memoized note table that
+    DataLoader.parseMidiFile uses.
+    """
+    midiDir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'data', 'midi', platform)
+    noteFields = []
+    for name in os.listdir(midiDir):
+        F = open(os.path.join(midiDir, name), 'r')
+        noteFields.extend(readNoteFields(F))
+        F.close()
+    print 'Note conversion for', len(noteFields), 'notes of', platform
+
+    dataLoader = DataLoader()
+    formatted, seconds = timeCall(
+        lambda: [(dataLoader.formatPitch(pitch),
+                  dataLoader.formatDuration(duration))
+                 for pitch, duration in noteFields])
+    printTiming('formatPitch and formatDuration', seconds)
+
+    def convertAll():
+        noteTable = dataLoader.noteTable
+        song = []
+        for fields in noteFields:
+            pysynthTuple = noteTable.get(fields)
+            if pysynthTuple is None:
+                pysynthTuple = dataLoader.convertNote(fields)
+            song.append(pysynthTuple)
+        return song
+
+    converted, seconds = timeCall(convertAll)
+    printTiming('memoized note table', seconds)
+    print '  distinct notes:', len(dataLoader.noteTable)
+    print '  notes identical:', formatted == converted
+
+def benchmarkVocabulary(platform, numSentences):
+    """
+    Compares music models trained on PySynth tuples with models trained on
+    Vocabulary ids: memory held by the n-gram counts, and the time to
+    generate numSentences musical sentences.
+    """
+    import generate
+    print 'Tuple tokens vs vocabulary ids for platform', platform
+    dataLoader = DataLoader()
+    songs = list(dataLoader.iterMusic(platform))
+    possiblePitches = generate.KEY_SIGNATURES['c major']
+
+    tupleModels = [TrigramModel(), BigramModel(), UnigramModel()]
+    trainModelsFromStream(tupleModels, songs)
+    vocabulary = Vocabulary()
+    idModels = [TrigramModel(vocabulary), BigramModel(vocabulary),
+                UnigramModel(vocabulary)]
+    trainModelsFromStream(idModels,
+                          [vocabulary.encode(song) for song in songs])
+
+    for label, models in (('tuples', tupleModels), ('ids', idModels)):
+        size = deepSizeOf([model.nGramCounts for model in models])
+        print '  %-40s %9.1f MB' % (label + ' model memory', size / 1e6)
+        random.seed(0)
+        _, seconds = timeCall(lambda: [generate.generateMusicalSentence(
+            models, 100, possiblePitches) for i in range(numSentences)])
+        printTiming(label + ' generation', seconds)
+
+def benchmarkMidiReader(fixtureDir):
+    """
+    Compares reading the notes of every track straight from each real .mid
+    file in fixtureDir with parsing the .txt dump the repo's mid2asc
+    binary printed for it, timing both and checking they give the same
+    notes.
+    """
+    print 'Native MIDI reader vs mid2asc dumps in', fixtureDir
+    dataLoader = DataLoader()
+    midiSeconds = 0.0
+    textSeconds = 0.0
+    numFiles = 0
+    numNotes = 0
+    mismatches = []
+    for fileName in sorted(os.listdir(fixtureDir)):
+        if not fileName.endswith('.mid'):
+            continue
+        midiPath = os.path.join(fixtureDir, fileName)
+        fromMidi, seconds = timeCall(dataLoader.parseMidiFileTracks, midiPath)
+        midiSeconds += seconds
+        fromText, seconds = timeCall(dataLoader.parseMidiFileTracks,
+                                     midiPath[:-4] + '.txt')
+        textSeconds += seconds
+        numFiles += 1
+        numNotes += sum(len(notes) for notes in fromText.itervalues())
+        if fromMidi != fromText:
+            mismatches.append(fileName[:-4])
+
+    printTiming('%d .mid files' % numFiles, midiSeconds)
+    printTiming('%d .txt files' % numFiles, textSeconds)
+    print '  notes compared:', numNotes
+    print '  files with different notes:', mismatches or 'none'
+
+def benchmarkMultiTrackLoad(platform, tracks):
+    """
+    Compares reading the files of a platform once per track with
+    gathering all of the given tracks in a single pass over each file.
+    """
+    print 'Tracks', tracks, 'of platform', platform
+    dataLoader = DataLoader()
+    perTrack, seconds = timeCall(lambda: [
+        list(dataLoader.iterMusicTracks(platform, [track], useCache=False))
+        for track in tracks])
+    printTiming('one pass per track', seconds)
+
+    singlePass, seconds = timeCall(lambda: list(
+        dataLoader.iterMusicTracks(platform, tracks, useCache=False)))
+    printTiming('single pass', seconds)
+
+    same = True
+    for i in range(len(tracks)):
+        fromSinglePass = [songs[tracks[i]] for songs in singlePass
+                          if tracks[i] in songs]
+        same = same and fromSinglePass == \
+            [songs[tracks[i]] for songs in perTrack[i]]
+    print '  songs identical:', same
+
+def loadLyricsWithRegexes(dirName):
+    """
+    The original lyrics cleaning loop, which runs three regular expression
+    substitutions, lower, split and a filter over every line. Kept here as
+    the baseline for benchmarkLyricsLoad.
+    """
+    bracketRegex = re.compile("\\[.*?\\]")
+    punctuationRegex = re.compile("[,.;:!\\*?\\/()'\"\\-_]")
+    spaceRegex = re.compile("\\s+")
+    artistDir = os.path.join('data', 'lyrics', dirName)
+
+    lyrics = []
+    for song in os.listdir(artistDir):
+        songFile = open(os.path.join(artistDir, song))
+        songLines = songFile.readlines()
+        songFile.close()
+        for line in songLines:
+            line = re.sub(bracketRegex, "", line)
+            line = re.sub(punctuationRegex, "", line)
+            line = re.sub(spaceRegex, " ", line)
+            line = line.lower()
+            line = line.strip().split()
+            line = [word for word in line if word != ""]
+            if line:
+                lyrics.append(line)
+    return lyrics
+
+def benchmarkLyricsLoad(dirName):
+    """
+    Compares the original regular expression cleaning with
+    DataLoader.loadLyrics, without the cache, with a cold cache and with a
+    warm one, checking that all of them give the same lines.
+    """
+    print 'Lyrics of', dirName
+    cache = LyricsCache(dirName)
+    if os.path.exists(cache.cachePath):
+        os.remove(cache.cachePath)
+
+    expected, seconds = timeCall(loadLyricsWithRegexes, dirName)
+    printTiming('three regular expressions', seconds)
+
+    results = []
+    for label, useCache in (('single-pass cleaner', False),
+                            ('cold cache (clean and write)', True),
+                            ('warm cache', True)):
+        dataLoader = DataLoader()
+        _, seconds = timeCall(dataLoader.loadLyrics, dirName,
+                              useCache=useCache)
+        printTiming(label, seconds)
+        results.append(dataLoader.lyrics)
+
+    print '  lines identical:', all(lyrics == expected for lyrics in results)
+
+def benchmarkRefresh(dirName, numChanged):
+    """
+    Copies the lyrics of dirName to a scratch artist directory, trains
+    models on it, then adds, edits and deletes numChanged songs each. The
+    songs to add are kept in a temporary directory until then.
+    Compares retraining from scratch with DataLoader.refreshLyrics plus
+    updateModels, and checks that both end with the same counts.
+    """
+    print 'Refreshing after changing', numChanged * 3, 'songs of', dirName
+    lyricsDir = os.path.join('data', 'lyrics')
+    scratchName = '_refresh_benchmark'
+    scratchDir = os.path.join(lyricsDir, scratchName)
+    if os.path.exists(scratchDir):
+        shutil.rmtree(scratchDir)
+    shutil.copytree(os.path.join(lyricsDir, dirName), scratchDir)
+    cache = LyricsCache(scratchName)
+    stagingDir = tempfile.mkdtemp()
+
+    try:
+        songs = sorted(os.listdir(scratchDir))
+        newSongs = songs[:numChanged]
+        for song in newSongs:
+            shutil.move(os.path.join(scratchDir, song),
+                        os.path.join(stagingDir, song))
+
+        dataLoader = DataLoader()
+        dataLoader.loadLyrics(scratchName)
+        models = [TrigramModel(), BigramModel(), UnigramModel()]
+        trainModelsFromStream(models, dataLoader.lyrics)
+
+        for song in newSongs:
+            shutil.move(os.path.join(stagingDir, song),
+                        os.path.join(scratchDir, song))
+        for song in songs[numChanged:2 * numChanged]:
+            songFile = open(os.path.join(scratchDir, song), 'a')
+            songFile.write('\nan extra line for the refresh benchmark\n')
+            songFile.close()
+        for song in songs[2 * numChanged:3 * numChanged]:
+            os.remove(os.path.join(scratchDir, song))
+
+        (added, removed), seconds = timeCall(dataLoader.refreshLyrics,
+                                             scratchName)
+        _, updateSeconds = timeCall(updateModels, models, added, removed)
+        printTiming('refresh and update', seconds + updateSeconds)
+
+        def retrain():
+            fresh = DataLoader()
+            fresh.loadLyrics(scratchName, useCache=False)
+            freshModels = [TrigramModel(), BigramModel(), UnigramModel()]
+            trainModelsFromStream(freshModels, fresh.lyrics)
+            return freshModels
+        freshModels, seconds = timeCall(retrain)
+        printTiming('reload and retrain', seconds)
+
+        print '  counts identical:', all(
+            model.nGramCounts == freshModel.nGramCounts
+            for model, freshModel in zip(models, freshModels))
+    finally:
+        shutil.rmtree(scratchDir)
+        shutil.rmtree(stagingDir)
+        if os.path.exists(cache.cachePath):
+            os.remove(cache.cachePath)
+
+def measureReader(reader, midiFiles, results):
+    """
+    Runs reader on every file of midiFiles and puts the number of notes
+    found and the growth of the peak resident set size in kilobytes on
+    the results queue. Meant to run in a fresh process, so that the peak
+    belongs to this reader alone.
+    """
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    numNotes = 0
+    for midiFile in midiFiles:
+        numNotes += len(reader(midiFile))
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((numNotes, after - before))
+
+def readLinesAndSplit(midiFile):
+    """
+    The original track 1 field extraction: F.readlines() and a split of
+    every line, without the note conversion.
+    """
+    F = open(midiFile, 'r')
+    lines = F.readlines()
+    F.close()
+    fields = []
+    for line in lines:
+        line = line.split()
+        if 'TR' in line and line[line.index('TR') + 1] == '1' \
+                and 'NT' in line:
+            noteIndex = line.index('NT')
+            fields.append((line[noteIndex + 1], line[noteIndex + 2]))
+    return fields
+
+def readLineByLine(midiFile):
+    """
+    midiText.readNoteFields over the lines of an open file.
+    """
+    F = open(midiFile, 'r')
+    fields = readNoteFields(F)
+    F.close()
+    return fields
+
+def benchmarkMappedReader(platform, numFiles):
+    """
+    Compares three ways of extracting the track 1 note fields of the
+    numFiles largest files of a platform: readlines and split, iterating
+    over lines with readNoteFields, and searching a memory map with
+    readMappedNoteFields. For each, reports the time, the strings created
+    per file, and the growth of peak RSS in a fresh process.
+
+    A readlines and split creates one string per line plus one per token
+    of every line. The line iterator creates one string per line plus two
+    per note. The memory map creates none for lines that are not track 1
+    notes, and three (the slice after NT and the two fields) per note.
+    Its peak RSS growth is made of the mapped pages of the largest file,
+    which are clean page cache shared with the OS rather than
+    allocations.
+    """
+    midiDir = os.path.join('data', 'midi', platform)
+    midiFiles = [os.path.join(midiDir, name) for name in os.listdir(midiDir)]
+    midiFiles.sort(key=os.path.getsize, reverse=True)
+    midiFiles = midiFiles[:numFiles]
+
+    numLines = 0
+    numTokens = 0
+    numBytes = 0
+    for midiFile in midiFiles:
+        F = open(midiFile, 'r')
+        for line in F:
+            numLines += 1
+            numTokens += len(line.split())
+            numBytes += len(line)
+        F.close()
+    numNotes = sum(len(readNoteFields(open(midiFile, 'r')))
+                   for midiFile in midiFiles)
+    print 'Track 1 fields of the %d largest files of %s' % (numFiles,
+                                                            platform)
+    print '  (%.1f MB, %d lines, %d track 1 notes per file)' % (
+        numBytes / 1e6 / numFiles, numLines / numFiles, numNotes / numFiles)
+
+    strings = {
+        'readlines and split': numLines + numTokens,
+        'line iterator': numLines + 2 * numNotes,
+        'memory map': 3 * numNotes,
+    }
+    readers = [('readlines and split', readLinesAndSplit),
+               ('line iterator', readLineByLine),
+               ('memory map', readMappedNoteFields)]
+    expected = [readLinesAndSplit(midiFile) for midiFile in midiFiles]
+    for label, reader in readers:
+        fields, seconds = timeCall(lambda: [reader(midiFile)
+                                            for midiFile in midiFiles])
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=measureReader,
+                                          args=(reader, midiFiles, results))
+        process.start()
+        _, peakGrowth = results.get()
+        process.join()
+        print '  %-22s %7.3f s %9d strings/file %7d KB peak growth %s' % (
+            label, seconds, strings[label] / numFiles, peakGrowth,
+            'same' if fields == expected else 'DIFFERENT')
+
+def benchmarkCompressedLoad(platform, numFiles, methods):
+    """
+    Copies the first numFiles files of a platform to scratch platform
+    directories, compresses each copy with one of methods using
+    compressCorpus, and compares the size on disk and the uncached load
+    time of every copy with the original files, checking that all of them
+    give the same songs.
+    """
+    print 'Compressed copies of %d files of %s' % (numFiles, platform)
+    midiDir = os.path.join('data', 'midi')
+    fileNames = sorted(os.listdir(os.path.join(midiDir, platform)))
+    fileNames = fileNames[:numFiles]
+
+    expected = None
+    for method in ['none'] + methods:
+        scratchName = '_compressed_benchmark_' + method
+        scratchDir = os.path.join(midiDir, scratchName)
+        if os.path.exists(scratchDir):
+            shutil.rmtree(scratchDir)
+        os.mkdir(scratchDir)
+        try:
+            for fileName in fileNames:
+                shutil.copy(os.path.join(midiDir, platform, fileName),
+                            scratchDir)
+            if method != 'none':
+                compressDirectory(scratchDir, method)
+            size = sum(os.path.getsize(os.path.join(scratchDir, fileName))
+                       for fileName in os.listdir(scratchDir))
+
+            dataLoader = DataLoader()
+            _, seconds = timeCall(dataLoader.loadMusic, scratchName,
+                                  useCache=False)
+            songs = dict((stripCompression(fileName),
+                          dataLoader.parseMidiFile(
+                              os.path.join(scratchDir, fileName)))
+                         for fileName in os.listdir(scratchDir))
+            if expected is None:
+                expected = songs
+            print '  %-8s %8.1f MB on disk %9.3f s load %s' % (
+                method, size / 1e6, seconds,
+                'same songs' if songs == expected else 'DIFFERENT')
+        finally:
+            shutil.rmtree(scratchDir)
+
+def benchmarkTraining(artist, platform):
+    """
+    Compares training the three models with one trainModel call each
+    against training them together with trainModelsFromStream, which
+    counts all three orders in one pass with an NGramIndex, on the lyrics
+    of artist and the songs of platform. Checks that both give the same
+    counts and that the corpus is left untouched.
+    """
+    vocabulary = Vocabulary()
+    dataLoader = DataLoader()
+    dataLoader.loadLyrics(artist, vocabulary=vocabulary)
+    corpora = [(artist, dataLoader.lyrics),
+               (platform, list(dataLoader.iterMusic(platform,
+                                                    vocabulary=vocabulary)))]
+
+    for name, corpus in corpora:
+        print 'Training on', name
+        original = [list(sentence) for sentence in corpus]
+
+        separate = [TrigramModel(vocabulary), BigramModel(vocabulary),
+                    UnigramModel(vocabulary)]
+        _, seconds = timeCall(lambda: [model.trainModel(corpus)
+                                       for model in separate])
+        printTiming('three trainModel calls', seconds)
+
+        together = [TrigramModel(vocabulary), BigramModel(vocabulary),
+                    UnigramModel(vocabulary)]
+        _, seconds = timeCall(trainModelsFromStream, together, corpus)
+        printTiming('one NGramIndex pass', seconds)
+
+        print '  counts identical:', all(
+            first.nGramCounts == second.nGramCounts
+            for first, second in zip(separate, together))
+        print '  corpus untouched:', \
+            [list(sentence) for sentence in corpus] == original
+
+def weightedChoiceByScan(candidates):
+    """
+    The original NGramModel.weightedChoice, which rebuilds the running
+    totals and searches them with culm.index on every draw. Kept here as
+    the baseline for benchmarkSampling.
+    """
+    token = candidates.keys()
+    values = candidates.values()
+    total = 0
+    culm = []
+    for i in values:
+        total += i
+        culm.append(total)
+    randomize = random.randrange(0, max(culm))
+    for x in culm:
+        if x > randomize:
+            index = culm.index(x)
+            return token[index]
+
+def benchmarkSampling(artist, numDraws):
+    """
+    Compares numDraws draws from each of the three lyrics models of artist
+    with the original weightedChoice against draws from the models'
+    sampling tables, checking that the same random numbers give the same
+    tokens. Also times freezing every context of the models.
+    """
+    import generate
+    print 'Sampling from the models of', artist
+    models = generate.trainLyricsModels(artist, useCache=False)
+    random.seed(0)
+    lyrics = DataLoader()
+    lyrics.loadLyrics(artist, vocabulary=models[0].vocabulary)
+    sentences = models[0].prepData(lyrics.lyrics)
+    contexts = [sentence[:random.randrange(2, len(sentence))]
+                for sentence in random.sample(sentences, numDraws)]
+
+    for model in models:
+        name = model.__class__.__name__
+        random.seed(1)
+        expected, seconds = timeCall(lambda: [
+            weightedChoiceByScan(model.getCandidateDictionary(context))
+            for context in contexts])
+        printTiming('%s weightedChoice scan' % name, seconds)
+        random.seed(1)
+        drawn, seconds = timeCall(lambda: [model.getNextToken(context)
+                                           for context in contexts])
+        printTiming('%s sampling tables' % name, seconds)
+        print '  same tokens:', drawn == expected
+
+    for model in models:
+        model.clearSamplingTables()
+    _, seconds = timeCall(lambda: [model.freeze() for model in models])
+    printTiming('freezing every context', seconds)
+
+def benchmarkBackoff(platform, numContexts):
+    """
+    Compares finding the candidates for numContexts contexts of the songs
+    of platform by probing a TrigramModel, BigramModel and UnigramModel in
+    turn with selectNGramModel, against one walk down the trie of a
+    BackoffModel(3), checking both find the same candidates. Then trains
+    BackoffModels of higher orders and times the same lookups.
+    """
+    import generate
+    print 'Backoff lookups on', platform
+    vocabulary = Vocabulary()
+    songs = list(DataLoader().iterMusic(platform, vocabulary=vocabulary))
+    models = generate.makeModels(vocabulary)
+    trainModelsFromStream(models, songs)
+
+    random.seed(0)
+    sentences = models[0].prepData(songs)
+    contexts = []
+    for i in range(numContexts):
+        sentence = random.choice(sentences)
+        context = sentence[:random.randrange(2, len(sentence))]
+        if i % 3 == 0:
+            # an unseen last note makes the lookup back off
+            context.append(random.randrange(len(vocabulary)))
+        contexts.append(context)
+
+    expected, seconds = timeCall(lambda: [
+        generate.selectNGramModel(models, context)
+        .getCandidateDictionary(context) for context in contexts])
+    printTiming('probing three models', seconds)
+
+    for maxOrder in (3, 4, 5):
+        model = BackoffModel(maxOrder, vocabulary)
+        _, trainSeconds = timeCall(trainModelsFromStream, [model], songs)
+        candidates, seconds = timeCall(lambda: [
+            model.getCandidateDictionary(context) for context in contexts])
+        printTiming('BackoffModel(%d) trie walk' % maxOrder, seconds)
+        printTiming('  (training)', trainSeconds)
+        if maxOrder == 3:
+            print '  same candidates:', candidates == expected
+
+
+def benchmarkFrozen(artist, platform, numSentences):
+    """
+    Freezes the three models and a BackoffModel(4) trained on the lyrics
+    of artist and on the songs of platform, and compares the memory held
+    by their count dictionaries against the flat arrays of the frozen
+    copies. Checks that numSentences seeded sentences generated from both
+    are identical.
+    """
+    import generate
+    trainers = [
+        (artist, generate.trainLyricsModels,
+         lambda models: generate.generateSentence(models, 10)),
+        (platform, generate.trainMusicModels,
+         lambda models: generate.generateMusicalSentence(
+             models, 20, generate.KEY_SIGNATURES['c major'])),
+    ]
+    for name, train, generateSentence in trainers:
+        print 'Freezing models of', name
+        for maxOrder in (None, 4):
+            models = train(name, maxOrder, useCache=False)
+            frozen, seconds = timeCall(freezeModels, models)
+            before = sum(deepSizeOf(model.nGramCounts) for model in models)
+            after = sum(model.getMemorySize() for model in frozen)
+            label = 'three models' if maxOrder is None else \
+                'BackoffModel(%d)' % maxOrder
+            print '  %-16s %7.2f MB -> %5.2f MB (%.0fx) in %.3f s' % (
+                label, before / 1e6, after / 1e6, float(before) / after,
+                seconds)
+
+            random.seed(0)
+            expected = [generateSentence(models)
+                        for i in range(numSentences)]
+            random.seed(0)
+            sentences = [generateSentence(frozen)
+                         for i in range(numSentences)]
+            print '  same sentences:', sentences == expected
+
+
+def benchmarkStartup(artist, platform):
+    """
+    Compares the startup of generate.py, training the lyrics models of
+    artist and the music models of platform, against loading them back
+    from the model files written by the first run, as trainable models
+    and as FrozenModels, and checks that all three generate the same
+    seeded sentences.
+    """
+    import generate
+    for path in (generate.getModelPath('lyrics', artist),
+                 generate.getModelPath('music', platform)):
+        if os.path.exists(path):
+            os.remove(path)
+
+    print 'Startup with', artist, 'and', platform
+    runs = []
+    for label, frozen in (('training and saving', False),
+                          ('loading model files', False),
+                          ('loading frozen model files', True)):
+        (lyricsModels, musicModels), seconds = timeCall(lambda: (
+            generate.trainLyricsModels(artist, frozen=frozen),
+            generate.trainMusicModels(platform, frozen=frozen)))
+        printTiming(label, seconds)
+        random.seed(0)
+        runs.append(([generate.generateSentence(lyricsModels, 10)
+                      for i in range(100)],
+                     [generate.generateMusicalSentence(
+                         musicModels, 20, generate.KEY_SIGNATURES['c major'])
+                      for i in range(100)]))
+    print '  same sentences:', runs[0] == runs[1] == runs[2]
+
+
+def getNextNoteByScan(model, musicalSentence, possiblePitches):
+    """
+    The original NGramModel.getNextNote, which filters every candidate by
+    key with string splitting and list membership tests on every call.
+    """
+    secondList = {}
+    for note, count in model.getCandidateItems(musicalSentence):
+        if note == model.endSymbol:
+            secondList[note] = count
+        else:
+            justnote = model.decodeToken(note)[0]
+            list1 = justnote.split(justnote[-1])
+            if list1[0] in possiblePitches:
+                secondList[note] = count
+
+    if bool(secondList):
+        return model.weightedChoice(secondList)
+    else:
+        pitch = str(random.choice(possiblePitches)) + '4'
+        duration = random.choice(NOTE_DURATIONS)
+        return model.encodeToken((pitch, duration))
+
+def benchmarkKeyFilter(platform, numNotes):
+    """
+    Draws numNotes notes in random keys after contexts taken from the
+    songs of platform, by scanning and filtering the candidates on every
+    call against getNextNote's per-key sampling tables, first cold and
+    then with every table built. Checks both draw the same notes.
+    """
+    import generate
+    print 'Key filtering on', platform
+    models = generate.trainMusicModels(platform, useCache=False)
+    vocabulary = models[0].vocabulary
+    songs = list(DataLoader().iterMusic(platform, vocabulary=vocabulary))
+    sentences = models[0].prepData(songs)
+
+    random.seed(0)
+    draws = []
+    keys = generate.KEY_SIGNATURES.values()
+    for i in range(numNotes):
+        sentence = random.choice(sentences)
+        context = sentence[:random.randrange(2, len(sentence))]
+        draws.append((generate.selectNGramModel(models, context), context,
+                      random.choice(keys)))
+
+    random.seed(1)
+    expected, seconds = timeCall(lambda: [
+        getNextNoteByScan(model, context, pitches)
+        for model, context, pitches in draws])
+    printTiming('scanning candidates', seconds)
+    for label in ('key tables (cold)', 'key tables (warm)'):
+        random.seed(1)
+        notes, seconds = timeCall(lambda: [
+            model.getNextNote(context, pitches)
+            for model, context, pitches in draws])
+        printTiming(label, seconds)
+        print '  same notes:', notes == expected
+
+
+def benchmarkBatchGeneration(artist, platform, numSentences):
+    """
+    Compares generating numSentences lyric and musical sentences one at a
+    time against generating them as one batch, with freshly trained models
+    and with models loaded from their model files. The batch draws its
+    random numbers in another order, so the sentences differ; the average
+    sentence lengths should agree.
+    """
+    import generate
+    pitches = generate.KEY_SIGNATURES['e minor']
+    setups = [
+        ('lyrics', generate.trainLyricsModels, artist,
+         lambda models: generate.generateSentence(models, 10),
+         lambda models, count: generate.generateSentences(models, 10, count)),
+        ('music', generate.trainMusicModels, platform,
+         lambda models: generate.generateMusicalSentence(models, 20,
+                                                         pitches),
+         lambda models, count: generate.generateMusicalSentences(
+             models, 20, pitches, count)),
+    ]
+    for kind, train, name, generateOne, generateMany in setups:
+        print 'Generating %d %s sentences from %s' % (numSentences, kind,
+                                                      name)
+        for label, useCache in (('trained', False), ('loaded', True)):
+            models = train(name, useCache=useCache)
+            random.seed(0)
+            single, seconds = timeCall(lambda: [generateOne(models)
+                                                for i in range(numSentences)])
+            printTiming('%s, one at a time' % label, seconds)
+            random.seed(0)
+            batch, seconds = timeCall(generateMany, models, numSentences)
+            printTiming('%s, one batch' % label, seconds)
+            print '  average lengths: %.2f, %.2f' % (
+                float(sum(map(len, single))) / numSentences,
+                float(sum(map(len, batch))) / numSentences)
+
+
+def benchmarkOnlineUpdate(platform, numNew):
+    """
+    Takes the last numNew songs of platform as newly scraped ones, and
+    compares absorbing them into trained models with addSequences against
+    retraining and refreezing the models on the whole corpus. Reports how
+    many sampling tables survive the update and checks the counts match
+    the retrained models.
+    """
+    import generate
+    print 'Adding %d songs to models of %s' % (numNew, platform)
+    vocabulary = Vocabulary()
+    songs = list(DataLoader().iterMusic(platform, vocabulary=vocabulary))
+    old, new = songs[:-numNew], songs[-numNew:]
+
+    models = generate.makeModels(vocabulary)
+    trainModelsFromStream(models, old)
+    for model in models:
+        model.freeze()
+    before = sum(len(model.samplingTables) for model in models)
+
+    _, seconds = timeCall(lambda: [model.addSequences(new)
+                                   for model in models])
+    printTiming('addSequences', seconds)
+    after = sum(len(model.samplingTables) for model in models)
+    print '  sampling tables kept: %d of %d' % (after, before)
+
+    retrained = generate.makeModels(vocabulary)
+    def retrain():
+        trainModelsFromStream(retrained, songs)
+        for model in retrained:
+            model.freeze()
+    _, seconds = timeCall(retrain)
+    printTiming('retraining and freezing', seconds)
+    print '  same counts:', all(
+        model.nGramCounts == other.nGramCounts
+        for model, other in zip(models, retrained))
+
+
+def countModelTraffic(models, sentences):
+    """
+    Returns the list of the shares of the contexts of sentences (every
+    prefix of at least two tokens) for which selectNGramModel picks each
+    of models. Measure it on sentences the models were not trained on:
+    every context of a training sentence has its highest order n-gram.
+    """
+    import generate
+    picks = [0] * len(models)
+    for sentence in sentences:
+        for i in range(2, len(sentence)):
+            model = generate.selectNGramModel(models, sentence[:i])
+            picks[models.index(model)] += 1
+    total = float(sum(picks))
+    return [count / total for count in picks]
+
+def benchmarkPruning(platform, settings):
+    """
+    Prunes the three models trained on the training songs of platform
+    with each minCounts dictionary in settings, and reports the n-grams
+    removed and the memory pruning saved, the memory of the counts and of
+    the frozen models after it, and the shares of the held-out contexts
+    answered by the trigram, bigram and unigram models.
+    """
+    import generate
+    print 'Pruning models of', platform
+    vocabulary = Vocabulary()
+    training, heldOut = DataLoader().splitMusic(platform,
+                                                vocabulary=vocabulary)
+    sentences = generate.makeModels(vocabulary)[0].prepData(heldOut)
+
+    for minCounts in [{}] + settings:
+        models = generate.makeModels(vocabulary)
+        trainModelsFromStream(models, training)
+        results, seconds = timeCall(pruneModels, models, minCounts)
+        size = sum(model.getMemorySize() for model in models)
+        frozenSize = sum(model.getMemorySize()
+                         for model in freezeModels(models))
+        traffic = countModelTraffic(models, sentences)
+        removed, saved = [sum(column) for column in zip(*results)]
+        print '  %-16s %7d n-grams removed in %.3f s, %.2f MB saved' % (
+            minCounts or 'unpruned', removed, seconds, saved / 1e6)
+        print '    counts %6.2f MB, frozen %5.2f MB' % (size / 1e6,
+                                                       frozenSize / 1e6)
+        print '    held out: trigram %4.1f%%, bigram %4.1f%%, ' \
+            'unigram %4.1f%%' % tuple(100 * share for share in traffic)
+
+
+def benchmarkShardedTraining(platform, numShards, workers):
+    """
+    Trains the three models on the songs of platform without the cache, in
+    one process, and then in numShards shards by a pool of workers
+    processes merged with reduceModels, and checks that both give the same
+    counts. Also times the merge on its own.
+    """
+    import generate
+    print 'Sharded training on %s (%d shards, %d workers, %d cpus)' % (
+        platform, numShards, workers, multiprocessing.cpu_count())
+
+    def trainSingle():
+        vocabulary = Vocabulary()
+        models = generate.makeModels(vocabulary)
+        trainModelsFromStream(models, DataLoader().iterMusic(
+            platform, useCache=False, vocabulary=vocabulary))
+        return models
+    single, seconds = timeCall(trainSingle)
+    printTiming('one process', seconds)
+
+    shards = [(platform, (i, numShards), None) for i in range(numShards)]
+    def trainShards():
+        pool = multiprocessing.Pool(workers)
+        try:
+            return pool.map(generate._trainMusicShard, shards, 1)
+        finally:
+            pool.terminate()
+            pool.join()
+    modelLists, seconds = timeCall(trainShards)
+    printTiming('training the shards', seconds)
+    merged, seconds = timeCall(reduceModels, modelLists)
+    printTiming('tree reduce', seconds)
+
+    def decodeCounts(models):
+        vocabulary = models[0].vocabulary
+        return [sorted((vocabulary.decode(context),
+                        sorted((vocabulary.getToken(token), count)
+                               for token, count in counts.iteritems()))
+                       for context, counts in model.iterContextCounts())
+                for model in models]
+    print '  same counts:', decodeCounts(single) == decodeCounts(merged)
+
+
+def benchmarkPerplexity(artist, platform):
+    """
+    Splits the lyrics of artist and the songs of platform into training
+    and held-out sets, and reports the held-out perplexity of the models
+    trained on the rest, with the time each scoring took: the three
+    models with selectNGramModel backoff, each of them alone, the three
+    models pruned and frozen, and a BackoffModel(4).
+    """
+    import generate
+    dataLoader = DataLoader()
+    for name, split in ((artist, dataLoader.splitLyrics),
+                        (platform, dataLoader.splitMusic)):
+        vocabulary = Vocabulary()
+        training, heldOut = split(name, vocabulary=vocabulary)
+        print 'Held-out perplexity on %s (%d training, %d held out)' % (
+            name, len(training), len(heldOut))
+
+        models = generate.makeModels(vocabulary)
+        trainModelsFromStream(models, training)
+        pruned = generate.makeModels(vocabulary)
+        trainModelsFromStream(pruned, training)
+        pruneModels(pruned, {3: 2, 2: 2})
+        backoff = generate.makeModels(vocabulary, 4)
+        trainModelsFromStream(backoff, training)
+
+        setups = [('three models', models)]
+        setups += [(model.__class__.__name__ + ' alone', [model])
+                   for model in models]
+        setups += [('pruned {3: 2, 2: 2}', pruned),
+                   ('frozen', freezeModels(models)),
+                   ('BackoffModel(4)', backoff)]
+        for label, scored in setups:
+            (perplexity, floored), seconds = timeCall(computePerplexity,
+                                                      scored, heldOut)
+            print '  %-24s %10.1f %6.2f%% floored %9.3f s' % (
+                label, perplexity, 100 * floored, seconds)
+
+
+def benchmarkReproducible(artist, platform, numSentences, workers):
+    """
+    Generates numSentences lyric and musical sentences from one seed with
+    generateInParallel, with 1 and with workers processes and twice with
+    the same seed, and checks that the sentences are identical every time
+    (and differ for another seed), with the time each run took.
+    """
+    import generate
+    pitches = generate.KEY_SIGNATURES['e minor']
+    setups = [('lyrics', generate.trainLyricsModels(artist), 10, None),
+              ('music', generate.trainMusicModels(platform), 20, pitches)]
+    for kind, models, desiredLength, possiblePitches in setups:
+        print 'Generating %d %s sentences from seed 7' % (numSentences, kind)
+        runs = []
+        for label, seed, count in (('1 worker', 7, 1),
+                                   ('%d workers' % workers, 7, workers),
+                                   ('1 worker again', 7, 1),
+                                   ('seed 8', 8, 1)):
+            random.seed(0)
+            sentences, seconds = timeCall(generate.generateInParallel,
+                                          models, desiredLength,
+                                          numSentences, seed, count,
+                                          possiblePitches)
+            printTiming(label, seconds)
+            runs.append(sentences)
+        print '  same for %d workers: %s, same again: %s, ' \
+              'same for seed 8: %s' % (workers, runs[1] == runs[0],
+                                       runs[2] == runs[0],
+                                       runs[3] == runs[0])
+
+
+def benchmarkRhymes(artist, numCouplets):
+    """
+    Builds the RhymeIndex of the lyrics models of artist, and compares
+    generating numCouplets rhyming couplets with generateCouplet against
+    rejection sampling: generating second lines until the last word rhymes
+    with that of the first, giving up on a first line after 1000 tries.
+    Also reports how many final words came from each model and context
+    length: rhyming is only as good as the context the final word was
+    drawn after.
+    """
+    import generate
+    from rhymeIndex import RhymeIndex, getRhymeKey
+    models = generate.trainLyricsModels(artist)
+    rhymeIndex, seconds = timeCall(RhymeIndex, models)
+    print 'Rhyming %d couplets from %s (%d rhyme classes, %d final words)' \
+        % (numCouplets, artist, len(rhymeIndex.classes),
+           len(rhymeIndex.rhymeKeys))
+    printTiming('building the index', seconds)
+
+    rng = random.Random(0)
+    couplets, seconds = timeCall(lambda: [
+        generate.generateCouplet(models, 5, rhymeIndex, rng)
+        for i in range(numCouplets)])
+    printTiming('rhyme index', seconds)
+    rhymed = sum(1 for first, second in couplets
+                 if getRhymeKey(first[-1]) == getRhymeKey(second[-1]))
+    print '  rhymed: %d of %d' % (rhymed, numCouplets)
+    print '  final words by model and context length:'
+    for level, count in sorted(rhymeIndex.finalLevels.items()):
+        if level is None:
+            label = 'uniform'
+        else:
+            label = '%s, %d words' % (
+                models[level[0]].__class__.__name__, level[1])
+        print '    %-30s %5d' % (label, count)
+
+    def rejectionSample():
+        lines = 0
+        rhymed = 0
+        for i in range(numCouplets):
+            first = generate.generateSentence(models, 5, rng)
+            lines += 1
+            if not first:
+                continue
+            for attempt in range(1000):
+                second = generate.generateSentence(models, 5, rng)
+                lines += 1
+                if second and second[-1] != first[-1] and \
+                        getRhymeKey(second[-1]) == getRhymeKey(first[-1]):
+                    rhymed += 1
+                    break
+        return lines, rhymed
+    (lines, rhymed), seconds = timeCall(rejectionSample)
+    printTiming('rejection sampling', seconds)
+    print '  rhymed: %d of %d, %d lines generated' % (rhymed, numCouplets,
+                                                      lines)
+
+
+BENCHMARKS = {
+    'backoff': lambda: benchmarkBackoff('gamecube', 20000),
+    'batch': lambda: benchmarkBatchGeneration('the_beatles', 'gamecube',
+                                              5000),
+    'cache': lambda: benchmarkMusicCache('gamecube'),
+    'parallel': lambda: benchmarkParallelLoad('gamecube',
+                                              multiprocessing.cpu_count()),
+    'parser': lambda: benchmarkNoteLineParser('gamecube', 3),
+    'perplexity': lambda: benchmarkPerplexity('the_beatles', 'gamecube'),
+    'prune': lambda: benchmarkPruning('gamecube', [{3: 2}, {3: 2, 2: 2},
+                                                   {3: 3, 2: 2}]),
+    'refresh': lambda: benchmarkRefresh('the_beatles', 5),
+    'rhyme': lambda: benchmarkRhymes('the_beatles', 500),
+    'reproducible': lambda: benchmarkReproducible(
+        'the_beatles', 'gamecube', 2000, max(2, multiprocessing.cpu_count())),
+    'mmap': lambda: benchmarkMappedReader('gamecube', 10),
+    'frozen': lambda: benchmarkFrozen('the_beatles', 'gamecube', 200),
+    'compressed': lambda: benchmarkCompressedLoad('gamecube', 200,
+                                                  ['gz', 'bz2']),
+    'keys': lambda: benchmarkKeyFilter('gamecube', 20000),
+    'lyrics': lambda: benchmarkLyricsLoad('the_beatles'),
+    'convert': lambda: benchmarkNoteConversion('gamecube'),
+    'vocabulary': lambda: benchmarkVocabulary('gamecube', 1000),
+    'training': lambda: benchmarkTraining('the_beatles', 'gamecube'),
+    'sharded': lambda: benchmarkShardedTraining(
+        'gamecube', 4, multiprocessing.cpu_count()),
+    'sampling': lambda: benchmarkSampling('the_beatles', 2000),
+    'startup': lambda: benchmarkStartup('the_beatles', 'gamecube'),
+    'update': lambda: benchmarkOnlineUpdate('gamecube', 40),
+    'tracks': lambda: benchmarkMultiTrackLoad('gamecube', [1, 2, 3, 4]),
+    'midi': lambda: benchmarkMidiReader(os.path.join('data', 'midi',
+                                                     'fixtures')),
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(BENCHMARKS.keys())
+    for name in names:
+        BENCHMARKS[name]()
+        print
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compresses every file of a corpus directory (a platform directory under
+data/midi or an artist directory under data/lyrics) in place, replacing
+each file with a .gz, .bz2 or .xz copy. DataLoader reads compressed files
+transparently, so nothing else has to change.
+
+Usage: python compressCorpus.py <directory> [gz|bz2|xz]
+"""
+import bz2
+import gzip
+import os
+import shutil
+import sys
+from corpusFiles import isCompressed, lzma
+
+# compression name -> (file suffix, function opening such a file to write)
+COMPRESSORS = {
+    "gz": (".gz", lambda path: gzip.open(path, "wb")),
+    "bz2": (".bz2", lambda path: bz2.BZ2File(path, "w")),
+    "xz": (".xz", lambda path: lzma.LZMAFile(path, "w")),
+}
+
+
+def compressFile(path, method="gz"):
+    """
+    Writes a compressed copy of the file at path next to it, with the
+    suffix of method, then removes the original. The copy keeps the
+    original's modification time. Returns the path of the copy.
+    """
+    suffix, openCompressed = COMPRESSORS[method]
+    compressedPath = path + suffix
+
+    # write to a temporary file first so an interrupted run never leaves
+    # a truncated file that looks compressed
+    source = open(path, "rb")
+    target = openCompressed(compressedPath + ".tmp")
+    shutil.copyfileobj(source, target)
+    target.close()
+    source.close()
+
+    stat = os.stat(path)
+    os.utime(compressedPath + ".tmp", (stat.st_atime, stat.st_mtime))
+    os.rename(compressedPath + ".tmp", compressedPath)
+    os.remove(path)
+    return compressedPath
+
+def compressDirectory(dirPath, method="gz"):
+    """
+    Compresses every file in the directory dirPath that is not compressed
+    yet with compressFile. Returns a tuple of the total size of those
+    files before and after compression, in bytes.
+    """
+    if method not in COMPRESSORS:
+        raise ValueError("unknown compression method: %s" % method)
+    if method == "xz" and lzma is None:
+        raise ValueError("xz compression needs the lzma module "
+                         "(pip install backports.lzma)")
+
+    sizeBefore = 0
+    sizeAfter = 0
+    for fileName in sorted(os.listdir(dirPath)):
+        path = os.path.join(dirPath, fileName)
+        if isCompressed(fileName) or not os.path.isfile(path):
+            continue
+        sizeBefore += os.path.getsize(path)
+        sizeAfter += os.path.getsize(compressFile(path, method))
+    return sizeBefore, sizeAfter
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print __doc__.strip()
+        sys.exit(1)
+
+    method = sys.argv[2] if len(sys.argv) == 3 else "gz"
+    sizeBefore, sizeAfter = compressDirectory(sys.argv[1], method)
+    print "Compressed %.1f MB to %.1f MB" % (sizeBefore / 1e6,
+                                             sizeAfter / 1e6)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import cPickle
+from array import array
+
+CACHE_VERSION = 2
+LYRICS_CACHE_VERSION = 1
+
+
+class MusicCache(object):
+
+    def __init__(self, platform, cacheDir=None):
+        """
+        This is the MusicCache constructor. A MusicCache stores the parsed
+        PySynth tuples for every file of one platform directory in
+        data/cache/midi/<platform>, so that DataLoader.loadMusic does not
+        have to re-read and re-split the mid2asc dumps on every start.
+
+        The cache is made of two files:
+            manifest.pkl  the table of distinct (pitch, duration) notes
+                          plus, for each file name, its size and mtime,
+                          whether all of its tracks were parsed, and the
+                          slice of notes.bin holding each parsed track
+            notes.bin     one flat array of unsigned 16 bit note ids, the
+                          tracks of all files laid out one after another
+
+        notes.bin is a raw array, so it can be read in one call (or
+        memory-mapped) instead of being parsed.
+        """
+        if cacheDir is None:
+            scriptDir = os.path.dirname(os.path.abspath(__file__))
+            cacheDir = os.path.join(scriptDir, "cache", "midi", platform)
+        self.cacheDir = cacheDir
+        self.manifestPath = os.path.join(cacheDir, "manifest.pkl")
+        self.notesPath = os.path.join(cacheDir, "notes.bin")
+
+        self.notes = []      # note id -> (pitch, duration)
+        self.noteIds = {}    # (pitch, duration) -> note id
+        # file name -> (size, mtime, complete, {track: (offset, length)})
+        self.files = {}
+        self.noteArray = array("H")
+        # file name -> (size, mtime, complete, {track: ids}) to be saved
+        self.pending = {}
+        self.dirty = False
+
+        self.load()
+
+    def load(self):
+        """
+        Reads the manifest and the note array from disk, if they exist and
+        were written by this version of the cache. Otherwise the cache
+        starts out empty and every file will be parsed again.
+        """
+        if not os.path.exists(self.manifestPath) or \
+                not os.path.exists(self.notesPath):
+            return
+
+        try:
+            manifestFile = open(self.manifestPath, "rb")
+            manifest = cPickle.load(manifestFile)
+            manifestFile.close()
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return
+
+        if manifest.get("version") != CACHE_VERSION:
+            return
+
+        noteArray = array("H")
+        notesFile = open(self.notesPath, "rb")
+        noteArray.fromfile(notesFile, manifest["numNotes"])
+        notesFile.close()
+
+        self.notes = [(intern(pitch), duration)
+                      for pitch, duration in manifest["notes"]]
+        self.noteIds = dict((note, i) for i, note in enumerate(self.notes))
+        self.files = manifest["files"]
+        self.noteArray = noteArray
+
+    def get(self, fileName, path, tracks):
+        """
+        Returns a dictionary of {track number: list of PySynth tuples} for
+        the tracks of fileName listed in tracks (all tracks with notes if
+        tracks is None), if the file at path is cached with those tracks.
+        Tracks without notes are left out. Returns None if the file has to
+        be parsed again.
+        """
+        if not self.has(fileName, path, tracks):
+            return None
+        return self.read(fileName, tracks)
+
+    def read(self, fileName, tracks):
+        """
+        Returns the dictionary of songs get would return for fileName, as
+        it was cached, even if the file changed since then (or {} if it was
+        never cached). This is what the file contributed to the corpus the
+        last time it was loaded, which DataLoader.refreshMusicTracks takes
+        back out of the models. Cached tracks missing from tracks are left
+        out.
+        """
+        if fileName not in self.files:
+            return {}
+
+        segments = self.files[fileName][3]
+        if tracks is None:
+            tracks = segments.keys()
+
+        notes = self.notes
+        songs = {}
+        for track in tracks:
+            if track in segments:
+                offset, length = segments[track]
+                if length:
+                    songs[track] = [notes[i] for i in
+                                    self.noteArray[offset:offset + length]]
+        return songs
+
+    def has(self, fileName, path, tracks):
+        """
+        Returns True if get would return the cached tracks of fileName,
+        without building those songs. That is the case if the file did not
+        change since it was cached and either all of its tracks were parsed
+        or every track in tracks was.
+        """
+        entry = self.files.get(fileName)
+        if entry is None:
+            return False
+
+        size, mtime, complete, segments = entry
+        stat = os.stat(path)
+        if stat.st_size != size or stat.st_mtime != mtime:
+            return False
+
+        if complete:
+            return True
+        if tracks is None:
+            return False
+        for track in tracks:
+            if track not in segments:
+                return False
+        return True
+
+    def put(self, fileName, path, songs, tracks):
+        """
+        Records the freshly parsed songs for fileName, a dictionary of
+        {track number: list of PySynth tuples} holding the tracks listed in
+        tracks (or every track, if tracks is None), so that they will be
+        written out by the next call to save. Only the note ids of the
+        songs are kept, so a cold cache stays small while songs are
+        streamed.
+        """
+        stat = os.stat(path)
+        idsByTrack = {}
+        for track in tracks if tracks is not None else songs.keys():
+            song = songs.get(track, [])
+            idsByTrack[track] = array("H", [self.getNoteId(note)
+                                            for note in song])
+        self.pending[fileName] = (stat.st_size, stat.st_mtime,
+                                  tracks is None, idsByTrack)
+        self.dirty = True
+
+    def save(self, fileNames):
+        """
+        Writes the cache back to disk if anything changed. Only the files
+        in fileNames (the current contents of the platform directory) are
+        kept, so entries for deleted files are dropped.
+        """
+        if not self.dirty and len(fileNames) == len(self.files):
+            return
+
+        noteArray = array("H")
+        files = {}
+        for fileName in fileNames:
+            if fileName in self.pending:
+                size, mtime, complete, idsByTrack = self.pending[fileName]
+            elif fileName in self.files:
+                size, mtime, complete, segments = self.files[fileName]
+                idsByTrack = {}
+                for track, (offset, length) in segments.iteritems():
+                    idsByTrack[track] = self.noteArray[offset:offset + length]
+            else:
+                continue
+
+            segments = {}
+            for track, ids in idsByTrack.iteritems():
+                segments[track] = (len(noteArray), len(ids))
+                noteArray.extend(ids)
+            files[fileName] = (size, mtime, complete, segments)
+
+        manifest = {
+            "version": CACHE_VERSION,
+            "notes": self.notes,
+            "files": files,
+            "numNotes": len(noteArray),
+        }
+
+        if not os.path.exists(self.cacheDir):
+            os.makedirs(self.cacheDir)
+
+        # write to temporary files first so an interrupted save never
+        # leaves a manifest that points past the end of notes.bin
+        notesFile = open(self.notesPath + ".tmp", "wb")
+        noteArray.tofile(notesFile)
+        notesFile.close()
+        manifestFile = open(self.manifestPath + ".tmp", "wb")
+        cPickle.dump(manifest, manifestFile, cPickle.HIGHEST_PROTOCOL)
+        manifestFile.close()
+        os.rename(self.notesPath + ".tmp", self.notesPath)
+        os.rename(self.manifestPath + ".tmp", self.manifestPath)
+
+        self.files = files
+        self.noteArray = noteArray
+        self.pending = {}
+        self.dirty = False
+
+    def getNoteId(self, note):
+        """
+        Returns the id of the (pitch, duration) tuple note in the note
+        table, adding it to the table the first time it is seen.
+        """
+        noteId = self.noteIds.get(note)
+        if noteId is None:
+            noteId = len(self.notes)
+            self.notes.append(note)
+            self.noteIds[note] = noteId
+        return noteId
+
+
+class LyricsCache(object):
+
+    def __init__(self, artist, cacheDir=None):
+        """
+        This is the LyricsCache constructor. A LyricsCache stores the
+        cleaned and tokenized lines of every lyrics file of one artist in
+        data/cache/lyrics/<artist>.pkl, together with each file's size and
+        mtime, so that DataLoader.loadLyrics only cleans the files that
+        were added or changed since the last run.
+
+        The lines of a file are kept as a single string, with the words of
+        a line joined by spaces and the lines joined by newlines. That
+        pickles to less than half the size of nested lists of words, and
+        splitting it back up is faster than unpickling those lists.
+        """
+        if cacheDir is None:
+            scriptDir = os.path.dirname(os.path.abspath(__file__))
+            cacheDir = os.path.join(scriptDir, "cache", "lyrics")
+        self.cacheDir = cacheDir
+        self.cachePath = os.path.join(cacheDir, artist + ".pkl")
+
+        self.files = {}     # file name -> (size, mtime, joined lines)
+        self.dirty = False
+
+        self.load()
+
+    def load(self):
+        """
+        Reads the cached lines from disk, if they exist and were written by
+        this version of the cache.
+        """
+        if not os.path.exists(self.cachePath):
+            return
+
+        try:
+            cacheFile = open(self.cachePath, "rb")
+            cached = cPickle.load(cacheFile)
+            cacheFile.close()
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return
+
+        if cached.get("version") == LYRICS_CACHE_VERSION:
+            self.files = cached["files"]
+
+    def get(self, fileName, path):
+        """
+        Returns the cached list of lines (each a list of words) for
+        fileName if the file at path still has the size and mtime it had
+        when it was cached. Returns None if the file has to be cleaned
+        again.
+        """
+        if not self.has(fileName, path):
+            return None
+        return self.read(fileName)
+
+    def has(self, fileName, path):
+        """
+        Returns True if the file at path did not change since fileName was
+        cached, without splitting up its lines.
+        """
+        entry = self.files.get(fileName)
+        if entry is None:
+            return False
+
+        stat = os.stat(path)
+        return stat.st_size == entry[0] and stat.st_mtime == entry[1]
+
+    def read(self, fileName):
+        """
+        Returns the list of lines of fileName as it was cached, even if
+        the file changed since then, or [] if it was never cached.
+        """
+        entry = self.files.get(fileName)
+        if entry is None or not entry[2]:
+            return []
+        return [line.split(" ") for line in entry[2].split("\n")]
+
+    def put(self, fileName, path, lines):
+        """
+        Records the freshly cleaned lines of fileName, so that they will be
+        written out by the next call to save.
+        """
+        stat = os.stat(path)
+        text = "\n".join([" ".join(line) for line in lines])
+        self.files[fileName] = (stat.st_size, stat.st_mtime, text)
+        self.dirty = True
+
+    def save(self, fileNames):
+        """
+        Writes the cache back to disk if anything changed, keeping only the
+        files in fileNames (the current contents of the artist directory).
+        """
+        if not self.dirty and len(fileNames) == len(self.files):
+            return
+
+        files = dict((fileName, self.files[fileName])
+                     for fileName in fileNames if fileName in self.files)
+        cached = {"version": LYRICS_CACHE_VERSION, "files": files}
+
+        if not os.path.exists(self.cacheDir):
+            os.makedirs(self.cacheDir)
+
+        cacheFile = open(self.cachePath + ".tmp", "wb")
+        cPickle.dump(cached, cacheFile, cPickle.HIGHEST_PROTOCOL)
+        cacheFile.close()
+        os.rename(self.cachePath + ".tmp", self.cachePath)
+
+        self.files = files
+        self.dirty = False
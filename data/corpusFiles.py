@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import bz2
+import hashlib
+import os
+import zlib
+
+# xz needs the lzma module, which only ships with Python 3; on Python 2 it
+# comes from the backports.lzma package, if that is installed
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# file name suffix -> function returning a new streaming decompressor
+DECOMPRESSORS = {
+    ".gz": lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    ".bz2": bz2.BZ2Decompressor,
+}
+if lzma is not None:
+    DECOMPRESSORS[".xz"] = lzma.LZMADecompressor
+
+COMPRESSED_SUFFIXES = (".gz", ".bz2", ".xz")
+
+# bytes of compressed data read at a time; mid2asc dumps compress about
+# 100 to 1, so this already decompresses to more than a megabyte
+CHUNK_SIZE = 16384
+
+
+def compressionSuffix(path):
+    """
+    Returns the compression suffix of path (".gz", ".bz2" or ".xz"), or ""
+    if the file is not compressed.
+    """
+    lowerPath = path.lower()
+    for suffix in COMPRESSED_SUFFIXES:
+        if lowerPath.endswith(suffix):
+            return suffix
+    return ""
+
+def isCompressed(path):
+    """
+    Returns True if path names a gzip, bz2 or xz compressed file.
+    """
+    return compressionSuffix(path) != ""
+
+def stripCompression(path):
+    """
+    Returns path without its compression suffix, so that "song.mid.gz"
+    can be recognized as a .mid file.
+    """
+    return path[:len(path) - len(compressionSuffix(path))]
+
+def iterDecompressed(path):
+    """
+    Reads the compressed file at path a chunk at a time and yields its
+    decompressed contents piece by piece, so the whole file is never held
+    in memory. Files made of several concatenated streams (as gzip and
+    bzip2 allow) are read to the end, and NUL bytes padding a gzip file
+    after its last stream are ignored. Raises an IOError for an .xz file
+    if no lzma module is available.
+    """
+    suffix = compressionSuffix(path)
+    if suffix not in DECOMPRESSORS:
+        raise IOError("reading %s files needs the lzma module "
+                      "(pip install backports.lzma)" % suffix)
+
+    F = open(path, "rb")
+    try:
+        # None between two streams, until the next one starts
+        decompressor = None
+        while True:
+            chunk = F.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            while chunk:
+                if decompressor is None:
+                    if suffix == ".gz":
+                        chunk = chunk.lstrip("\0")
+                        if not chunk:
+                            break
+                    decompressor = DECOMPRESSORS[suffix]()
+                    started = False
+                try:
+                    data = decompressor.decompress(chunk)
+                except EOFError:
+                    # the Python 2 bz2 decompressor has no eof flag, so a
+                    # stream that ended exactly at the end of a chunk only
+                    # shows up when the next chunk is fed to it
+                    if not started:
+                        raise
+                    decompressor = None
+                    continue
+                started = True
+                if data:
+                    yield data
+                # anything after the end of a stream starts the next one
+                chunk = decompressor.unused_data
+                if chunk or getattr(decompressor, "eof", False):
+                    decompressor = None
+    finally:
+        F.close()
+
+def iterCorpusLines(path):
+    """
+    Yields the lines of the corpus file at path, each ending in a newline
+    (except possibly the last). Files ending in .gz, .bz2 or .xz are
+    decompressed on the fly as they are read.
+    """
+    if not isCompressed(path):
+        F = open(path, "rb")
+        try:
+            for line in F:
+                yield line
+        finally:
+            F.close()
+        return
+
+    rest = ""
+    for data in iterDecompressed(path):
+        lines = (rest + data).split("\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if rest:
+        yield rest
+
+def readCorpusFile(path):
+    """
+    Returns the whole (decompressed, if it ends in .gz, .bz2 or .xz)
+    contents of the corpus file at path as a string.
+    """
+    if not isCompressed(path):
+        F = open(path, "rb")
+        data = F.read()
+        F.close()
+        return data
+    return "".join(iterDecompressed(path))
+
+def isHeldOut(key, heldOutFraction, seed=0):
+    """
+    Returns True if the item named key (such as a file name) belongs to the
+    held-out share heldOutFraction of a corpus. The choice is a hash of
+    seed and key, so an item stays on the same side of the split from one
+    run to the next, and adding items to the corpus never moves others.
+    """
+    digest = hashlib.md5("%s\0%s" % (seed, key)).hexdigest()
+    return int(digest[:8], 16) < heldOutFraction * 0x100000000
+
+def fingerprintDirectory(path):
+    """
+    Returns a hex digest of the names, sizes and mtimes of the files in the
+    directory at path, which changes whenever a file of that corpus is
+    added, removed or modified, without reading any of them.
+    """
+    digest = hashlib.md5()
+    for fileName in sorted(os.listdir(path)):
+        stat = os.stat(os.path.join(path, fileName))
+        digest.update("%s\0%d\0%r\n" % (fileName, stat.st_size,
+                                          stat.st_mtime))
+    return digest.hexdigest()
@@ -1,8 +1,23 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import collections
+import multiprocessing
 import os
 import re
+import string
 from unicodedata import normalize
+from corpusCache import LyricsCache, MusicCache
+from corpusFiles import fingerprintDirectory, isCompressed, isHeldOut, \
+                        iterCorpusLines, stripCompression
+from midiReader import MELODY_TRACK, readMidiNoteFields, \
+                       readMidiTrackNoteFields
+from midiText import readMappedNoteFields, readMappedTrackNoteFields, \
+                     readNoteFields, readTrackNoteFields
+
+# characters removed from lyrics, and the table lowercasing the rest
+PUNCTUATION = ",.;:!*?/()'\"-_"
+LOWERCASE_TABLE = string.maketrans(string.ascii_uppercase,
+                                   string.ascii_lowercase)
 
 
 class DataLoader(object):
@@ -16,30 +31,153 @@ class DataLoader(object):
         The lyrics portion sets up a blank list, self.lyrics,
         for the lyrics to be loaded into, which will become a list
         of lists of words to be used in NGramModels. It also
-        instantiates regular expression member variables for
-        patterns to be found in the raw data.
+        instantiates a regular expression member variable for
+        bracketed text to be removed from the raw data.
 
         The music portion sets up a blank list, self.songs, which
         will become a list of lists of PySynth tuples to be
         used in generateMusic.py. Each inner list in self.songs
-        is a list of all the notes of exactly one midi file.
+        is a list of all the notes of exactly one midi file. Likewise,
+        self.trackSongs will hold one {track number: list of notes}
+        dictionary per midi file when several tracks are loaded. It also
+        sets up the tables that memoize the conversion of ASCII note
+        fields to PySynth values, since the corpus only has a few
+        hundred distinct pitch and duration fields.
         """
         # Lyrics
         self.lyrics = []
-        self.spaceRegex = re.compile("\s+")
-        self.punctuationRegex = re.compile("[,.;:!\*?\\/()'\"\-_]")
         self.bracketRegex = re.compile("\[.*?\]")
 
         # Music
         self.songs = []
+        self.trackSongs = []
+        self.pitchTable = {}    # ASCII pitch -> interned PySynth pitch
+        self.durationTable = {} # ASCII duration -> PySynth duration
+        self.noteTable = {}     # (ASCII pitch, ASCII duration) -> tuple
 
-    def loadLyrics(self, dirName):
+    def loadLyrics(self, dirName, vocabulary=None, useCache=True):
         """
         Loads the lyrics files from the directory specified by dirName,
         if that directory exists. For each line in each file,
         cleans that line by removing punctuation and extraneous
         whitespaces, and lowercasing all words in the line. Finally, adds
         the line to the self.lyrics list, where a line is a list of words.
+
+        If a Vocabulary is given, each line is added to self.lyrics as an
+        array('H') of word ids instead. The lyrics files may be gzip, bz2
+        or xz compressed.
+
+        If useCache is True, the cleaned lines of each file are read back
+        from the LyricsCache in data/cache/lyrics/<dirName>.pkl, and only
+        files whose size or mtime changed since the last run are cleaned
+        again.
+        """
+        for song, songLines in self.iterLyricsSongs(dirName, vocabulary,
+                                                    useCache):
+            # add each cleaned line of each song to self.lyrics
+            self.lyrics.extend(songLines)
+
+    def iterLyricsSongs(self, dirName, vocabulary=None, useCache=True):
+        """
+        Generator version of loadLyrics: yields a (file name, list of
+        lines) tuple for each lyrics file of the directory dirName, with
+        the lines cleaned (and encoded, if a Vocabulary is given) as
+        loadLyrics adds them to self.lyrics. The cache is saved once the
+        last file has been yielded.
+        """
+        artistDir = self.findArtistDir(dirName)
+        if artistDir is None:
+            return
+
+        songs = os.listdir(artistDir)
+        cache = LyricsCache(unicode(dirName, 'utf-8')) if useCache else None
+
+        for song in songs:
+            songPath = artistDir + song
+            songLines = None
+            if cache:
+                songLines = cache.get(song, songPath)
+            if songLines is None:
+                songLines = self.parseLyricsFile(songPath)
+                if cache:
+                    cache.put(song, songPath, songLines)
+
+            if vocabulary is not None:
+                songLines = [vocabulary.encode(line) for line in songLines]
+            yield song, songLines
+
+        if cache:
+            cache.save(songs)
+
+    def splitLyrics(self, dirName, heldOutFraction=0.1, seed=0,
+                    vocabulary=None):
+        """
+        Loads the lyrics of the directory dirName like loadLyrics, but
+        returns them as a tuple of two lists of lines, a training set and
+        a held-out set, instead of adding them to self.lyrics. About
+        heldOutFraction of the songs are held out, whole songs at a time so
+        that a chorus is never on both sides. Which songs are held out
+        depends only on seed and their file names without any compression
+        suffix (see corpusFiles.isHeldOut), so compressing the directory
+        never moves a song to the other side.
+        """
+        training = []
+        heldOut = []
+        for song, songLines in self.iterLyricsSongs(dirName, vocabulary):
+            if isHeldOut(stripCompression(song), heldOutFraction, seed):
+                heldOut.extend(songLines)
+            else:
+                training.extend(songLines)
+        return training, heldOut
+
+    def refreshLyrics(self, dirName, vocabulary=None):
+        """
+        Brings the LyricsCache of the artist directory dirName up to date
+        with the files in it, and returns a tuple of two lists of lines:
+        the lines of the songs that were added or changed since they were
+        last loaded, and the cached lines of the songs that were changed
+        or deleted. Only new and changed files are read, so the cost is
+        proportional to the change rather than to the whole corpus.
+
+        Models trained on the lines loadLyrics returned last time can be
+        brought up to date with nGramModel.updateModels(models, added,
+        removed). self.lyrics is left as it is. If a Vocabulary is given,
+        both lists hold arrays of word ids.
+        """
+        artistDir = self.findArtistDir(dirName)
+        if artistDir is None:
+            return [], []
+
+        songs = os.listdir(artistDir)
+        cache = LyricsCache(unicode(dirName, 'utf-8'))
+        added = []
+        removed = []
+
+        for song in songs:
+            songPath = artistDir + song
+            if cache.has(song, songPath):
+                continue
+            removed.extend(cache.read(song))
+            songLines = self.parseLyricsFile(songPath)
+            cache.put(song, songPath, songLines)
+            added.extend(songLines)
+
+        current = set(songs)
+        for song in cache.files.keys():
+            if song not in current:
+                removed.extend(cache.read(song))
+
+        cache.save(songs)
+        if vocabulary is not None:
+            added = [vocabulary.encode(line) for line in added]
+            removed = [vocabulary.encode(line) for line in removed]
+        return added, removed
+
+    def findArtistDir(self, dirName):
+        """
+        Returns the path of the lyrics directory of the artist dirName
+        (with a trailing slash), or None after printing a message if there
+        is no such directory.
         """
         scriptDir = os.path.dirname(os.path.abspath(__file__))
         musicDir = os.path.join(scriptDir, "lyrics/")
@@ -50,33 +188,127 @@ class DataLoader(object):
         if normalize('NFC', dirName) not in dirs:
         # check if this artist has a directory in the lyrics directory
             print "No artist named", dirName, "in directory", musicDir
-            return
+            return None
 
-        artistDir = musicDir + dirName + "/"
-        songs = os.listdir(artistDir)
-        for song in songs:
-            songFile = open(artistDir + song)
-            songLines = songFile.readlines()
-            songFile.close()
+        return musicDir + dirName + "/"
+
+    def parseLyricsFile(self, songPath):
+        """
+        Cleans every line of the lyrics file at the path songPath with
+        cleanLyricsLine and returns the list of non-empty lines, each a
+        list of words. The file may be gzip, bz2 or xz compressed.
+        """
+        songLines = []
+        for line in iterCorpusLines(songPath):
+            line = self.cleanLyricsLine(line)
+            if line:
+                songLines.append(line)
+        return songLines
+
+    def cleanLyricsLine(self, line):
+        """
+        Removes bracketed text (such as [Chorus]) and punctuation from the
+        string line, lowercases it and returns the list of its words.
+        Everything but the bracket removal happens in a single
+        str.translate pass, and the bracket regular expression only runs
+        on lines that have a bracket at all.
+        """
+        if "[" in line:
+            line = self.bracketRegex.sub("", line)
+        return line.translate(LOWERCASE_TABLE, PUNCTUATION).split()
 
-            # clean each line in each song and add it to self.lyrics
-            for line in songLines:
-                line = re.sub(self.bracketRegex, "", line)
-                line = re.sub(self.punctuationRegex, "", line)
-                line = re.sub(self.spaceRegex, " ", line)
-                line = line.lower()
-                line = line.strip().split()
-                line = [word for word in line if word != ""]
-                if line:
-                    self.lyrics.append(line)
+    def fingerprintLyrics(self, dirName):
+        """
+        Returns a fingerprint of the lyrics files of the artist directory
+        dirName (see corpusFiles.fingerprintDirectory), which changes
+        whenever loadLyrics would load different lines, or None if there
+        is no such directory.
+        """
+        artistDir = self.findArtistDir(dirName)
+        if artistDir is None:
+            return None
+        return fingerprintDirectory(artistDir)
 
+    def fingerprintMusic(self, platform):
+        """
+        Returns a fingerprint of the files of the specified platform
+        directory, which changes whenever iterMusic would yield different
+        songs, or None if there is no such directory.
+        """
+        midiDir = os.path.dirname(os.path.abspath(__file__)) + "/midi/"
+        if platform not in os.listdir(midiDir):
+            print "No platform named", platform, "in directory", midiDir
+            return None
+        return fingerprintDirectory(midiDir + platform)
 
-    def loadMusic(self, platform):
+    def loadMusic(self, platform, useCache=True, workers=1,
+                  vocabulary=None):
         """
         Loads the midi files to the specified platform directory by
-        extracting data out of those midi .txt files and converting that
-        data into PySynth tuple format, then adding each song's list of
-        tuples to the self.songs list.
+        extracting data out of those midi .txt (or .mid) files and
+        converting that data into PySynth tuple format, then adding each
+        song's list of tuples to the self.songs list. The files may be
+        gzip, bz2 or xz compressed (see data/compressCorpus.py).
+
+        See iterMusicTracks for the meaning of useCache, workers and
+        vocabulary.
+        """
+        for song in self.iterMusic(platform, useCache, workers, vocabulary):
+            self.songs.append(song)
+
+    def loadMusicTracks(self, platform, tracks=None, useCache=True,
+                        workers=1, vocabulary=None):
+        """
+        Works like loadMusic, but gathers the notes of every track listed
+        in tracks (or of all tracks, if tracks is None) in one pass over
+        each file, and adds one dictionary of {track number: list of
+        PySynth tuples} per file to the self.trackSongs list. Tracks
+        without notes are left out of the dictionaries.
+        """
+        for songs in self.iterMusicTracks(platform, tracks, useCache,
+                                          workers, vocabulary):
+            self.trackSongs.append(songs)
+
+    def iterMusic(self, platform, useCache=True, workers=1,
+                  vocabulary=None, shard=None):
+        """
+        Generator version of loadMusic: yields the songs of the specified
+        platform directory one at a time, in the order loadMusic would add
+        them to self.songs, without keeping them in memory. See
+        iterMusicTracks for the meaning of shard.
+        """
+        for songs in self.iterMusicTracks(platform, [MELODY_TRACK], useCache,
+                                          workers, vocabulary, shard):
+            yield songs[MELODY_TRACK]
+
+    def iterMusicTracks(self, platform, tracks=None, useCache=True,
+                        workers=1, vocabulary=None, shard=None):
+        """
+        Generator version of loadMusicTracks: yields one dictionary of
+        {track number: song} per file of the specified platform directory,
+        in directory order, skipping files without notes in those tracks.
+
+        If useCache is True, songs parsed on an earlier run are read back
+        from the MusicCache in data/cache/midi/<platform>, and only files
+        whose size or mtime changed since then (or whose tracks were not
+        all parsed yet) are parsed again.
+
+        If workers is greater than 1, the files that have to be parsed are
+        spread across a pool of that many processes. The songs come out in
+        the same order either way: the pool is handed the files in
+        directory order, no more than twice as many at a time as there are
+        workers (see iterWindowed), so that the songs parsed ahead of their
+        turn, which are held back until the files before them are done,
+        never pile up past a few files.
+
+        If a Vocabulary is given, each song is yielded as an array('H') of
+        note ids instead of a list of PySynth tuples.
+
+        If shard is an (index, count) tuple, only every count-th file of
+        the directory is read, starting with file number index, so that
+        count processes can each read one shard of a platform. Shards are
+        always read without the cache: it is one pair of files per
+        platform, which several processes must not write at once.
         """
         midiDir = os.path.dirname(os.path.abspath(__file__)) + "/midi/"
         platformDir = midiDir + platform
@@ -86,35 +318,222 @@ class DataLoader(object):
             return
 
         midiFiles = os.listdir(platformDir)
-        midiFiles = [platformDir + "/" + midiFile for midiFile in midiFiles]
+        if shard is not None:
+            index, count = shard
+            midiFiles = midiFiles[index::count]
+            useCache = False
+        midiPaths = [platformDir + "/" + fileName for fileName in midiFiles]
+        cache = MusicCache(platform) if useCache else None
+
+        cached = [bool(cache) and
+                  cache.has(midiFiles[i], midiPaths[i], tracks)
+                  for i in range(len(midiFiles))]
+        missing = [(midiPaths[i], tracks) for i in range(len(midiFiles))
+                   if not cached[i]]
+
+        pool = None
+        if workers > 1 and len(missing) > 1:
+            workers = min(workers, len(missing))
+            pool = multiprocessing.Pool(workers)
+            parsed = iterWindowed(pool, _parseMidiFileTracks, missing,
+                                  2 * workers)
+        else:
+            parsed = (self.parseMidiFileTracks(midiPath, tracks)
+                      for midiPath, tracks in missing)
+
+        try:
+            for i in range(len(midiFiles)):
+                if cached[i]:
+                    songs = cache.get(midiFiles[i], midiPaths[i], tracks)
+                else:
+                    songs = next(parsed)
+                    if cache:
+                        cache.put(midiFiles[i], midiPaths[i], songs, tracks)
+
+                songs = dict((track, song) for track, song
+                             in songs.iteritems() if song)
+                if songs:
+                    if vocabulary is not None:
+                        for track in songs:
+                            songs[track] = vocabulary.encode(songs[track])
+                    yield songs
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+
+        if cache:
+            cache.save(midiFiles)
+
+    def splitMusic(self, platform, heldOutFraction=0.1, seed=0,
+                   vocabulary=None):
+        """
+        Streams the songs of the specified platform directory like
+        iterMusic, and returns them as a tuple of two lists of songs, a
+        training set and a held-out set of about heldOutFraction of them.
+        Which songs are held out depends only on seed and the notes of
+        each song (see corpusFiles.isHeldOut), so copies of a song always
+        end up on the same side.
+        """
+        training = []
+        heldOut = []
+        for song in self.iterMusic(platform):
+            side = heldOut if isHeldOut(song, heldOutFraction, seed) \
+                else training
+            if vocabulary is not None:
+                song = vocabulary.encode(song)
+            side.append(song)
+        return training, heldOut
+
+    def refreshMusic(self, platform, vocabulary=None):
+        """
+        Works like refreshMusicTracks for the melody track only: returns a
+        tuple of the list of added songs and the list of removed songs of
+        the specified platform directory since it was last loaded.
+        """
+        added, removed = self.refreshMusicTracks(platform, [MELODY_TRACK],
+                                                 vocabulary)
+        return [songs[MELODY_TRACK] for songs in added], \
+               [songs[MELODY_TRACK] for songs in removed]
+
+    def refreshMusicTracks(self, platform, tracks=None, vocabulary=None):
+        """
+        Brings the MusicCache of the specified platform directory up to
+        date for the tracks listed in tracks (or all tracks, if tracks is
+        None), and returns a tuple of two lists of {track number: song}
+        dictionaries, in the form iterMusicTracks yields them: one for the
+        files that were added or changed since they were last loaded, and
+        one with the cached songs of the files that were changed or
+        deleted. Only new and changed files are parsed.
+
+        Models trained on the songs loaded last time can be brought up to
+        date with nGramModel.updateModels. If a Vocabulary is given, the
+        songs are arrays of note ids.
+        """
+        midiDir = os.path.dirname(os.path.abspath(__file__)) + "/midi/"
+        platformDir = midiDir + platform
+
+        if platform not in os.listdir(midiDir):
+            print "No platform named", platform, "in directory", midiDir
+            return [], []
+
+        midiFiles = os.listdir(platformDir)
+        cache = MusicCache(platform)
+        added = []
+        removed = []
+
+        for fileName in midiFiles:
+            midiPath = platformDir + "/" + fileName
+            if cache.has(fileName, midiPath, tracks):
+                continue
+            removed.append(cache.read(fileName, tracks))
+            songs = self.parseMidiFileTracks(midiPath, tracks)
+            cache.put(fileName, midiPath, songs, tracks)
+            added.append(songs)
+
+        current = set(midiFiles)
+        for fileName in cache.files.keys():
+            if fileName not in current:
+                removed.append(cache.read(fileName, tracks))
+
+        cache.save(midiFiles)
+        added = [songs for songs in added if songs]
+        removed = [songs for songs in removed if songs]
+        if vocabulary is not None:
+            for songs in added + removed:
+                for track in songs:
+                    songs[track] = vocabulary.encode(songs[track])
+        return added, removed
+
+    def parseMidiFileTracks(self, midiFile, tracks=None):
+        """
+        Extracts the notes of the tracks listed in tracks (or of every
+        track, if tracks is None) out of the .txt or .mid file at the path
+        midiFile, and returns them as a dictionary of {track number: list
+        of PySynth tuples}. Tracks without notes are left out.
+
+        A .txt file is memory-mapped and searched for the note lines of
+        each listed track, so lines of other tracks are never read into
+        strings. All tracks at once are read in a single pass over the
+        lines instead, and so are compressed files, which are decompressed
+        as they are read.
+        """
+        if tracks is not None and list(tracks) == [MELODY_TRACK]:
+            # the melody alone has a faster path
+            song = self.parseMidiFile(midiFile)
+            return {MELODY_TRACK: song} if song else {}
+
+        if stripCompression(midiFile).lower().endswith(".mid"):
+            fieldsByTrack = readMidiTrackNoteFields(midiFile, tracks)
+        elif tracks is not None and not isCompressed(midiFile):
+            fieldsByTrack = readMappedTrackNoteFields(midiFile, tracks)
+        else:
+            fieldsByTrack = readTrackNoteFields(iterCorpusLines(midiFile),
+                                                tracks)
 
-        for midiFile in midiFiles:
-            F = open(midiFile, "r")
-            lines = F.readlines()
-            F.close()
+        return dict((track, self.convertNotes(noteFields)) for
+                    track, noteFields in fieldsByTrack.iteritems())
 
-            song = []
-            for line in lines:
-                line = line.split()
+    def parseMidiFile(self, midiFile):
+        """
+        Extracts the notes of track 1 out of the file at the path
+        midiFile and returns them as a list of PySynth tuples. The file is
+        either a mid2asc .txt dump, which is memory-mapped and searched
+        for track 1 note lines without reading the other lines into
+        strings, or a .mid file, which is read directly without going
+        through mid2asc. Either kind of file may also be gzip, bz2 or xz
+        compressed (for example "song.txt.gz"), in which case it is
+        decompressed a chunk at a time as it is read.
+        """
+        if stripCompression(midiFile).lower().endswith(".mid"):
+            noteFields = readMidiNoteFields(midiFile)
+        elif isCompressed(midiFile):
+            noteFields = readNoteFields(iterCorpusLines(midiFile))
+        else:
+            noteFields = readMappedNoteFields(midiFile)
 
-                # extract pitch and duration from .txt song data, convert
-                # those values to pysynth format, and add the
-                # (pitch, duration) tuple to the song list
-                if "TR" in line and line[line.index("TR") + 1] == "1" \
-                        and "NT" in line:
-                    noteIndex = line.index("NT")
-                    pitch = line[noteIndex + 1]
-                    pitch = self.formatPitch(pitch)
+        return self.convertNotes(noteFields)
 
-                    duration = line[noteIndex + 2]
-                    duration = self.formatDuration(duration)
+    def convertNotes(self, noteFields):
+        """
+        Returns the list of PySynth tuples for the list of raw (ASCII
+        pitch, ASCII duration) tuples noteFields.
+        """
+        # look up the pysynth (pitch, duration) tuple of each note and add
+        # it to the song list, converting fields only on first sight
+        noteTable = self.noteTable
+        song = []
+        for fields in noteFields:
+            pysynthTuple = noteTable.get(fields)
+            if pysynthTuple is None:
+                pysynthTuple = self.convertNote(fields)
+            song.append(pysynthTuple)
+
+        return song
+
+    def convertNote(self, fields):
+        """
+        Converts the (ASCII pitch, ASCII duration) tuple fields to a
+        PySynth tuple and remembers it in self.noteTable, so that every
+        later note with the same fields is a single dictionary lookup and
+        shares the same tuple. The pitch and duration conversions are
+        memoized separately in self.pitchTable and self.durationTable.
+        """
+        asciiPitch, asciiDuration = fields
 
-                    pysynthTuple = (pitch, duration)
-                    song.append(pysynthTuple)
+        pitch = self.pitchTable.get(asciiPitch)
+        if pitch is None:
+            pitch = intern(self.formatPitch(asciiPitch))
+            self.pitchTable[asciiPitch] = pitch
 
-            if song:
-                self.songs.append(song)
+        duration = self.durationTable.get(asciiDuration)
+        if duration is None:
+            duration = self.formatDuration(asciiDuration)
+            self.durationTable[asciiDuration] = duration
 
+        pysynthTuple = (pitch, duration)
+        self.noteTable[fields] = pysynthTuple
+        return pysynthTuple
 
     def formatPitch(self, asciiPitch):
         """
@@ -201,6 +620,38 @@ class DataLoader(object):
 
         return duration
 
+
+_workerDataLoader = None
+
+def iterWindowed(pool, function, argumentsList, window):
+    """
+    Calls function on every item of argumentsList in pool, and yields the
+    results in the order of argumentsList. At most window calls are
+    handed to the pool at a time: the next one only goes in once the
+    oldest result is taken, so no more than window results are ever held
+    back waiting for their turn, however long the list.
+    """
+    pending = collections.deque()
+    for arguments in argumentsList:
+        if len(pending) >= window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(function, (arguments,)))
+    while pending:
+        yield pending.popleft().get()
+
+def _parseMidiFileTracks(arguments):
+    """
+    Process pool entry point for DataLoader.iterMusicTracks. Pool workers
+    can only call module level functions, so this wraps
+    parseMidiFileTracks, taking its arguments as one (midiFile, tracks)
+    tuple. Each worker process keeps one DataLoader, so its conversion
+    tables are filled once rather than once per file.
+    """
+    global _workerDataLoader
+    if _workerDataLoader is None:
+        _workerDataLoader = DataLoader()
+    return _workerDataLoader.parseMidiFileTracks(*arguments)
+
 if __name__ == "__main__":
     dataLoader = DataLoader()
     dataLoader.loadLyrics('the_beatles')
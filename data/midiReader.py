@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import struct
+from fractions import Fraction
+from corpusFiles import readCorpusFile
+
+# mid2asc spells every note relative to the current key signature. The
+# seven notes of the major scale of the key get their scale spelling, and
+# the other five are spelled as a raised 1st, lowered 3rd, raised 4th,
+# raised 5th and lowered 7th scale degree (in C major: C# Eb F# G# Bb).
+# Minor keys use the spelling of their relative major, and C is middle C
+# (note number 60), written with one ' per octave above and one - per
+# octave below.
+LETTERS = "CDEFGAB"
+NATURAL_PITCHES = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+MAJOR_TONICS = ["Cb", "Gb", "Db", "Ab", "Eb", "Bb", "F", "C",
+                "G", "D", "A", "E", "B", "F#", "C#"]
+SCALE_STEPS = [0, 2, 4, 5, 7, 9, 11]
+CHROMATIC_DEGREES = [(0, 1), (2, -1), (3, 1), (4, 1), (6, -1)]
+MIDDLE_C = 60
+
+# the track mid2asc numbers TR 1, which DataLoader turns into songs
+MELODY_TRACK = 1
+
+
+def makeSpellingTable(sharps):
+    """
+    Returns a list of 12 (letter, accidental) tuples, one per pitch class
+    starting at C, for the key signature with the given number of sharps
+    (negative for flats). The accidental is +1 per sharp and -1 per flat.
+    """
+    tonic = MAJOR_TONICS[sharps + 7]
+    tonicLetter = LETTERS.index(tonic[0])
+    tonicPitch = NATURAL_PITCHES[tonic[0]] + tonic.count("#") - \
+                 tonic.count("b")
+
+    table = [None] * 12
+    degrees = [(degree, 0) for degree in range(7)] + CHROMATIC_DEGREES
+    for degree, shift in degrees:
+        letter = LETTERS[(tonicLetter + degree) % 7]
+        pitchClass = (tonicPitch + SCALE_STEPS[degree] + shift) % 12
+        accidental = (pitchClass - NATURAL_PITCHES[letter]) % 12
+        if accidental > 6:
+            accidental -= 12
+        table[pitchClass] = (letter, accidental)
+    return table
+
+SPELLING_TABLES = dict((sharps, makeSpellingTable(sharps))
+                       for sharps in range(-7, 8))
+
+
+def spellPitch(noteNumber, table):
+    """
+    Returns the mid2asc name of the MIDI note number noteNumber, such as
+    "F#--" or "Bb'", using the spelling table of the current key.
+    """
+    letter, accidental = table[noteNumber % 12]
+    octave = (noteNumber - accidental - NATURAL_PITCHES[letter] -
+              MIDDLE_C) // 12
+    if accidental > 0:
+        letter += "#" * accidental
+    else:
+        letter += "b" * -accidental
+    if octave > 0:
+        return letter + "'" * octave
+    return letter + "-" * -octave
+
+def formatBeats(ticks, division):
+    """
+    Returns the mid2asc representation of a duration of ticks ticks at
+    division ticks per beat, a whole number of beats and/or a reduced
+    fraction: "2", "23/96" or "1+1/2". A note that is never turned off
+    (ticks is None) lasts "infinity".
+    """
+    if ticks is None:
+        return "infinity"
+
+    beats = Fraction(ticks, division)
+    whole = beats.numerator // beats.denominator
+    part = beats - whole
+    if part == 0:
+        return str(whole)
+    fraction = "%d/%d" % (part.numerator, part.denominator)
+    if whole == 0:
+        return fraction
+    return "%d+%s" % (whole, fraction)
+
+
+def readVariableLength(data, pos):
+    """
+    Reads a MIDI variable-length quantity from the bytearray data at index
+    pos and returns a tuple of its value and the index after it.
+    """
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+def readChunks(data):
+    """
+    Splits the contents of a standard MIDI file into its header fields and
+    track chunks. Returns a tuple of the number of ticks per beat and the
+    list of track chunk bytearrays. Raises a ValueError for data that is not
+    a standard MIDI file or uses SMPTE timing.
+    """
+    if data[:4] != "MThd":
+        raise ValueError("not a standard MIDI file")
+
+    headerLength = struct.unpack(">I", data[4:8])[0]
+    division = struct.unpack(">h", data[12:14])[0]
+    if division <= 0:
+        raise ValueError("SMPTE time division is not supported")
+
+    tracks = []
+    pos = 8 + headerLength
+    while pos + 8 <= len(data):
+        chunkType = data[pos:pos + 4]
+        chunkLength = struct.unpack(">I", data[pos + 4:pos + 8])[0]
+        if chunkType == "MTrk":
+            tracks.append(bytearray(data[pos + 8:pos + 8 + chunkLength]))
+        pos += 8 + chunkLength
+
+    return division, tracks
+
+def readTrackEvents(track, trackNumber, withNotes=True):
+    """
+    Reads the note and key signature events of one track chunk. If
+    withNotes is False, only the key signatures are collected, which is
+    all that is needed from tracks whose notes are not wanted.
+
+    Returns a tuple of two lists. The notes are [tick, trackNumber, seq,
+    note number, length in ticks] lists, where the length is None for a
+    note that is never turned off. The keys are (tick, trackNumber, seq,
+    sharps) tuples. seq numbers the events of the track in order, so that
+    sorting both lists together restores the order mid2asc prints them in:
+    by time, then by track, then by position in the track. Like mid2asc, a
+    note off ends every note of its channel and pitch that is still
+    sounding, not just the oldest one.
+    """
+    notes = []
+    keys = []
+    playing = {}    # (channel, note number) -> notes still sounding
+    pos = 0
+    tick = 0
+    seq = 0
+    status = None
+
+    while pos < len(track):
+        delta, pos = readVariableLength(track, pos)
+        tick += delta
+        byte = track[pos]
+
+        if byte == 0xFF:
+            metaType = track[pos + 1]
+            length, pos = readVariableLength(track, pos + 2)
+            if metaType == 0x2F:
+                break
+            if metaType == 0x59 and length >= 1:
+                sharps = track[pos] - 256 if track[pos] > 127 else track[pos]
+                keys.append((tick, trackNumber, seq,
+                             max(-7, min(7, sharps))))
+                seq += 1
+            pos += length
+            status = None
+            continue
+
+        if byte == 0xF0 or byte == 0xF7:
+            length, pos = readVariableLength(track, pos + 1)
+            pos += length
+            status = None
+            continue
+
+        if byte & 0x80:
+            status = byte
+            pos += 1
+        elif status is None:
+            raise ValueError("data byte without a status byte")
+
+        kind = status & 0xF0
+        if kind == 0xC0 or kind == 0xD0:
+            pos += 1
+            continue
+        if not withNotes or (kind != 0x80 and kind != 0x90):
+            pos += 2
+            continue
+
+        key = (status & 0x0F, track[pos])
+        velocity = track[pos + 1]
+        pos += 2
+
+        if kind == 0x90 and velocity > 0:
+            note = [tick, trackNumber, seq, key[1], None]
+            notes.append(note)
+            playing.setdefault(key, []).append(note)
+            seq += 1
+        elif kind == 0x80 or kind == 0x90:
+            for note in playing.pop(key, ()):
+                note[4] = tick - note[0]
+
+    return notes, keys
+
+def readNoteEvents(midiFile, tracks=None):
+    """
+    Reads the .mid file at the path midiFile and returns a list of
+    (track, pitch, duration) tuples, one per note, in the order mid2asc
+    would print them. The pitch and duration are spelled exactly as in the
+    NT lines of a mid2asc .txt file (for example "C#'" and "1+1/2"), so
+    they go through the same conversion as notes read from those files.
+    If tracks is a collection of track numbers, only the notes of those
+    tracks are returned. The file may be gzip, bz2 or xz compressed.
+    """
+    data = readCorpusFile(midiFile)
+
+    division, chunks = readChunks(data)
+    events = []
+    for trackNumber in range(len(chunks)):
+        withNotes = tracks is None or trackNumber in tracks
+        notes, keys = readTrackEvents(chunks[trackNumber], trackNumber,
+                                      withNotes)
+        events.extend(notes)
+        events.extend(keys)
+    events.sort(key=lambda event: (event[0], event[1], event[2]))
+
+    # the same few pitches and lengths come up over and over, so each is
+    # only spelled once per key and formatted once per file
+    sharps = 0
+    pitches = {}
+    durations = {}
+    noteEvents = []
+    for event in events:
+        if len(event) == 4:
+            sharps = event[3]
+            continue
+
+        pitch = pitches.get((sharps, event[3]))
+        if pitch is None:
+            pitch = spellPitch(event[3], SPELLING_TABLES[sharps])
+            pitches[(sharps, event[3])] = pitch
+        duration = durations.get(event[4])
+        if duration is None:
+            duration = formatBeats(event[4], division)
+            durations[event[4]] = duration
+        noteEvents.append((event[1], pitch, duration))
+    return noteEvents
+
+def readMidiNoteFields(midiFile):
+    """
+    Returns the list of (pitch, duration) tuples of the melody track of the
+    .mid file at the path midiFile, the same list midiText.readNoteFields
+    returns for the mid2asc .txt dump of that file.
+    """
+    return [(pitch, duration) for track, pitch, duration
+            in readNoteEvents(midiFile, [MELODY_TRACK])]
+
+def readMidiTrackNoteFields(midiFile, tracks=None):
+    """
+    Returns a dictionary of {track number: list of (pitch, duration)
+    tuples} for the tracks of the .mid file at the path midiFile listed in
+    tracks (or every track, if tracks is None), the same dictionary
+    midiText.readTrackNoteFields returns for the mid2asc .txt dump of that
+    file. Tracks without notes are left out.
+    """
+    fieldsByTrack = {}
+    for track, pitch, duration in readNoteEvents(midiFile, tracks):
+        if track in fieldsByTrack:
+            fieldsByTrack[track].append((pitch, duration))
+        else:
+            fieldsByTrack[track] = [(pitch, duration)]
+    return fieldsByTrack
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import mmap
+import os
+
+# Every line mid2asc writes starts with the same fixed-width fields, e.g.
+#   BA    1   CR       1/2   TR  1   CH  1   NT  C'        1/2   von=100
+# The track number is printed (at least) two characters wide after "TR",
+# so the track field of a track 1 line always reads " TR  1 ". Only note
+# lines carry an " NT " field, followed by the pitch and the duration of
+# the note.
+TRACK_FIELD = " TR "
+TRACK_ONE = " 1 "
+NOTE_FIELD = " NT "
+TRACK_ONE_FIELD = TRACK_FIELD + TRACK_ONE
+
+
+def readNoteFields(lines):
+    """
+    Returns a list of (pitch, duration) tuples holding the raw ASCII pitch
+    and duration fields of every track 1 note line in lines, an iterable
+    of lines of a mid2asc .txt file (for example an open file).
+
+    Lines are rejected with substring checks on the fixed-width fields
+    before anything is split: a line that is not on track 1 is dropped
+    after one find, a control event on track 1 after a second one, and
+    only the few characters after NT are ever tokenized. The result is
+    the same as splitting every line and looking for the "TR" and "NT"
+    tokens.
+    """
+    fields = []
+    for line in lines:
+        track = line.find(TRACK_FIELD)
+        if track < 0 or not line.startswith(TRACK_ONE, track + 4):
+            continue
+
+        note = line.find(NOTE_FIELD, track + 7)
+        if note < 0:
+            continue
+
+        pitchAndDuration = line[note + 4:].split(None, 2)
+        fields.append((pitchAndDuration[0], pitchAndDuration[1]))
+
+    return fields
+
+def readTrackNoteFields(lines, tracks=None):
+    """
+    Returns a dictionary of {track number: list of (pitch, duration)
+    tuples} with the raw ASCII fields of every note line in lines, for
+    the tracks in the collection tracks, or for every track if tracks is
+    None. Tracks without notes are left out. Like readNoteFields, each
+    line is only looked at once and only the track number and the fields
+    after NT are ever split out.
+    """
+    if tracks is not None:
+        tracks = set(tracks)
+
+    fieldsByTrack = {}
+    for line in lines:
+        track = line.find(TRACK_FIELD)
+        if track < 0:
+            continue
+
+        trackEnd = line.find(" ", track + 5)
+        note = line.find(NOTE_FIELD, trackEnd)
+        if note < 0:
+            continue
+
+        trackNumber = int(line[track + 4:trackEnd])
+        if tracks is not None and trackNumber not in tracks:
+            continue
+
+        pitchAndDuration = line[note + 4:].split(None, 2)
+        fields = (pitchAndDuration[0], pitchAndDuration[1])
+        if trackNumber in fieldsByTrack:
+            fieldsByTrack[trackNumber].append(fields)
+        else:
+            fieldsByTrack[trackNumber] = [fields]
+
+    return fieldsByTrack
+
+def mapFile(path):
+    """
+    Returns a read-only memory map of the file at path, or None if the
+    file is empty (an empty file cannot be mapped).
+    """
+    F = open(path, "rb")
+    try:
+        if os.fstat(F.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(F.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        F.close()
+
+def readMappedNoteFields(path):
+    """
+    Returns the same list as readNoteFields for the mid2asc .txt file at
+    path, but memory-maps the file and searches the mapped bytes for the
+    " TR  1 " field instead of iterating over lines. Lines of other tracks
+    are never turned into strings at all; for track 1 lines only the
+    fields after NT are sliced out and split.
+    """
+    data = mapFile(path)
+    if data is None:
+        return []
+    try:
+        return scanTrackNoteFields(data, 1)
+    finally:
+        data.close()
+
+def readMappedTrackNoteFields(path, tracks):
+    """
+    Returns the same dictionary as readTrackNoteFields for the mid2asc
+    .txt file at path and the collection of track numbers tracks, using
+    the memory-mapped scan of readMappedNoteFields once for each track.
+    That is only worth it for a few tracks: to gather every track, each
+    line has to be looked at anyway, and readTrackNoteFields is faster.
+    """
+    data = mapFile(path)
+    if data is None:
+        return {}
+
+    fieldsByTrack = {}
+    try:
+        for trackNumber in tracks:
+            fields = scanTrackNoteFields(data, trackNumber)
+            if fields:
+                fieldsByTrack[trackNumber] = fields
+    finally:
+        data.close()
+
+    return fieldsByTrack
+
+def scanTrackNoteFields(data, trackNumber):
+    """
+    Returns the list of (pitch, duration) tuples of every note line of the
+    given track in data, the mapped contents of a mid2asc .txt file.
+    """
+    trackField = "%s%2d " % (TRACK_FIELD, trackNumber)
+    fieldLength = len(trackField)
+    find = data.find
+    size = data.size()
+
+    fields = []
+    track = find(trackField)
+    while track >= 0:
+        lineStart = data.rfind("\n", 0, track) + 1
+        lineEnd = find("\n", track)
+        if lineEnd < 0:
+            lineEnd = size
+
+        # the track field is the first " TR " of its line
+        if find(TRACK_FIELD, lineStart, track + 4) == track:
+            note = find(NOTE_FIELD, track + fieldLength, lineEnd)
+            if note >= 0:
+                pitchAndDuration = data[note + 4:lineEnd].split(None, 2)
+                fields.append((pitchAndDuration[0], pitchAndDuration[1]))
+
+        track = find(trackField, lineEnd)
+
+    return fields
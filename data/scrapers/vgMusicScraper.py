@@ -90,6 +90,10 @@ class VGMusicScraper(BaseScraper):
         ASCII files for music other than the music from the VGmusic site
         (i.e. if one wanted to manually or automatically download music
         from different sites).
+
+        DataLoader reads .mid files directly, so this conversion is no
+        longer needed to load scraped music; it is kept for tools that
+        want the mid2asc text dumps.
         """
         print "Converting midi files to .txt files"
         midiFiles = os.listdir(midiDir)
@@ -107,12 +111,10 @@ class VGMusicScraper(BaseScraper):
                 returnCode = subprocess.call(convertCommand, stdout=FNULL, \
                                              stderr=subprocess.STDOUT, \
                                              shell=True)
-                removeCommand = "rm " + midiFile
-                subprocess.call(removeCommand, shell=True)
+                os.remove(midiFile)
 
                 if returnCode != 0:
-                    removeCommand = "rm " + midiTextFile
-                    subprocess.call(removeCommand, shell=True)
+                    os.remove(midiTextFile)
 
         print "\nConverted all midi files in", self.fullPlatform,
         print "directory to .txt files"
@@ -122,5 +124,6 @@ if __name__ == "__main__":
     scraper = VGMusicScraper()
     platform, path = scraper.getUserPlatform()
     scraper.scrape(platform, path)
-    scraper.convertMidiToAscii("../midi/" + platform)
+    # DataLoader reads the .mid files directly, so there is no need to
+    # run convertMidiToAscii here anymore
 
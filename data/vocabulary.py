@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from array import array
+
+# Sequences of ids are stored as arrays of unsigned 16 bit integers
+ID_TYPECODE = "H"
+MAX_ID = 65535
+
+
+class Vocabulary(object):
+
+    def __init__(self, tokens=()):
+        """
+        This is the Vocabulary constructor. A Vocabulary maps every token
+        it has seen (a word, a PySynth tuple, or one of the special start
+        and end symbols) to a dense integer id, starting at 0, and back.
+        Any tokens passed in are added in order.
+
+        N-gram models trained on id sequences hash small integers instead
+        of strings and tuples, and only need the Vocabulary again to
+        decode the sentences they generate.
+        """
+        self.tokens = []    # id -> token
+        self.ids = {}       # token -> id
+        for token in tokens:
+            self.getId(token)
+
+    def __len__(self):
+        """
+        Returns the number of distinct tokens in the vocabulary.
+        """
+        return len(self.tokens)
+
+    def __contains__(self, token):
+        """
+        Returns True if token has an id in the vocabulary.
+        """
+        return token in self.ids
+
+    def getId(self, token):
+        """
+        Returns the id of token, giving it the next free id the first time
+        it is seen. Raises a ValueError once the vocabulary no longer fits
+        in 16 bit ids.
+        """
+        tokenId = self.ids.get(token)
+        if tokenId is None:
+            tokenId = len(self.tokens)
+            if tokenId > MAX_ID:
+                raise ValueError("vocabulary is limited to %d tokens" % \
+                                 (MAX_ID + 1))
+            self.tokens.append(token)
+            self.ids[token] = tokenId
+        return tokenId
+
+    def getToken(self, tokenId):
+        """
+        Returns the token with the id tokenId.
+        """
+        return self.tokens[tokenId]
+
+    def encode(self, tokens):
+        """
+        Returns an array('H') of the ids of the tokens in the list tokens,
+        adding any new tokens to the vocabulary.
+        """
+        getId = self.getId
+        return array(ID_TYPECODE, [getId(token) for token in tokens])
+
+    def decode(self, ids):
+        """
+        Returns the list of tokens for the sequence of ids.
+        """
+        tokens = self.tokens
+        return [tokens[tokenId] for tokenId in ids]
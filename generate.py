@@ -5,12 +5,25 @@ sys.path.append('./language-models')
 sys.path.append('./data')
 sys.path.append('./pysynth')
 import pysynth
+import hashlib
+import itertools
+import multiprocessing
+import os
 import random
+from bisect import bisect_right
 from data.dataLoader import *
 from unigramModel import *
 from bigramModel import *
 from trigramModel import *
+from backoffModel import *
+from frozenModel import *
+from rhymeIndex import *
 from musicData import *
+from vocabulary import Vocabulary
+
+# trained models are saved here, one model file per corpus and model kind
+MODEL_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'data', 'cache', 'models')
 
 
 # -----------------------------------------------------------------------------
@@ -18,7 +31,57 @@ from musicData import *
 # Functions to implement: trainLyricsModels, selectNGramModel,
 # generateSentence, and runLyricsGenerator
 
-def trainLyricsModels(lyricsDirectory):
+def makeModels(vocabulary, maxOrder=None):
+    """
+    Requires: vocabulary is a Vocabulary, maxOrder is None or >= 1
+    Modifies: nothing
+    Effects:  returns a list of untrained models sharing vocabulary, in
+              descending priority: a TrigramModel, a BigramModel and a
+              UnigramModel, or, if maxOrder is given, a single
+              BackoffModel that backs off from n-grams of that order on
+              its own.
+    """
+    if maxOrder is not None:
+        return [BackoffModel(maxOrder, vocabulary)]
+    return [TrigramModel(vocabulary), BigramModel(vocabulary),
+            UnigramModel(vocabulary)]
+
+def getModelPath(kind, name, maxOrder=None, minCounts=None):
+    """
+    Requires: kind is 'lyrics' or 'music', name names the corpus
+    Modifies: nothing
+    Effects:  returns the path of the model file in MODEL_CACHE_DIR for
+              the models makeModels(vocabulary, maxOrder) returns,
+              trained on that corpus and pruned with minCounts.
+    """
+    if maxOrder is None:
+        models = 'ngram'
+    else:
+        models = 'backoff%d' % maxOrder
+    if minCounts:
+        models += '-min' + '-'.join('%dx%d' % (order, minCounts[order])
+                                    for order in sorted(minCounts))
+    return os.path.join(MODEL_CACHE_DIR, '%s-%s-%s.bin' % (kind, name, models))
+
+def loadTrainedModels(modelPath, fingerprint, maxOrder, frozen):
+    """
+    Requires: modelPath was returned by getModelPath for maxOrder
+    Modifies: nothing
+    Effects:  returns the models saved in the model file at modelPath, if
+              it was saved with fingerprint (see frozenModel.loadModels),
+              or None if they have to be trained. If frozen is True, they
+              are the FrozenModels of the file; otherwise they are the
+              models of makeModels(vocabulary, maxOrder) holding the same
+              counts and sampling tables (see frozenModel.thawModels),
+              which can be trained further like freshly trained ones.
+    """
+    models = loadModels(modelPath, fingerprint)
+    if models is None or frozen:
+        return models
+    return thawModels(models, makeModels(models[0].vocabulary, maxOrder))
+
+def trainLyricsModels(lyricsDirectory, maxOrder=None, useCache=True,
+                      minCounts=None, frozen=False):
     """
     Requires: nothing
     Modifies: nothing
@@ -27,21 +90,56 @@ def trainLyricsModels(lyricsDirectory):
               instance of each of the NGramModel child classes and trains
               them using the text loaded from the data loader. The list
               should be in tri-, then bi-, then unigramModel order.
+              The words are encoded as ids of a Vocabulary shared by the
+              three models, and all three are trained in a single pass
+              over the lyrics, then frozen into sampling tables.
+              If maxOrder is given, the list holds a single BackoffModel
+              of that order instead (see makeModels).
+              If minCounts is given, the models are pruned with it after
+              training (see nGramModel.pruneModels), to save memory.
+              If useCache is True and the lyrics did not change since the
+              models were last trained, the models are loaded from their
+              model file (see getModelPath) instead of being trained
+              again; otherwise they are saved to it after training.
+              Loaded or trained, the models are of the same classes and
+              can be updated (see nGramModel.updateModels), pruned and
+              merged. If frozen is True, the list holds read-only
+              FrozenModels instead, loaded or trained, which take a
+              fraction of the memory.
               Returns the list of trained models.
     """
 
+    vocabulary = Vocabulary()
     dataLoader = DataLoader()
-    dataLoader.loadLyrics(lyricsDirectory) # lyrics stored in dataLoader.lyrics
-    models = [TrigramModel(), BigramModel(), UnigramModel()]
-    models[0].trainModel(dataLoader.lyrics)
-    models[1].trainModel(dataLoader.lyrics)
-    models[2].trainModel(dataLoader.lyrics)
+    modelPath = getModelPath('lyrics', lyricsDirectory, maxOrder, minCounts)
+    fingerprint = None
+    if useCache:
+        fingerprint = dataLoader.fingerprintLyrics(lyricsDirectory)
+        if fingerprint is not None:
+            models = loadTrainedModels(modelPath, fingerprint, maxOrder,
+                                       frozen)
+            if models is not None:
+                return models
+
+    # lyrics stored in dataLoader.lyrics
+    dataLoader.loadLyrics(lyricsDirectory, vocabulary=vocabulary)
+    models = makeModels(vocabulary, maxOrder)
+    trainModelsFromStream(models, dataLoader.lyrics)
+    if minCounts:
+        pruneModels(models, minCounts)
+    for model in models:
+        model.freeze()
+    if fingerprint is not None:
+        saveModels(models, modelPath, fingerprint)
+    if frozen:
+        return freezeModels(models)
     return models
 
 def selectNGramModel(models, sentence):
     """
     Requires: models is a list of NGramModel objects sorted by descending
-              priority: tri-, then bi-, then unigrams.
+              priority: tri-, then bi-, then unigrams, or a list of a
+              single BackoffModel.
     Modifies: nothing
     Effects:  starting from the beginning of the models list, returns the
               first possible model that can be used for the current sentence
@@ -49,56 +147,200 @@ def selectNGramModel(models, sentence):
               wrote a function that checks if a model can be used to pick a
               word for a sentence!)
     """
-    if models[0].trainingDataHasNGram(sentence):
-        return models[0]
-    elif models[1].trainingDataHasNGram(sentence):
-        return models[1]
-    else:
-        return models[2]
+    for model in models[:-1]:
+        if model.trainingDataHasNGram(sentence):
+            return model
+    return models[-1]
 
 
 
-def sentenceTooLong(desiredLength, currentLength):
+def sentenceTooLong(desiredLength, currentLength, rng=None):
     """
-    Requires: nothing
-    Modifies: nothing
+    Requires: rng is None or a random.Random
+    Modifies: rng (the random module if rng is None)
     Effects:  returns a bool indicating whether or not this sentence should
               be ended based on its length. This function has been done for
               you.
     """
+    if rng is None:
+        rng = random
     STDEV = 1
-    val = random.gauss(currentLength, STDEV)
+    val = rng.gauss(currentLength, STDEV)
     return val > desiredLength
 
-def generateSentence(models, desiredLength):
+def generateSentence(models, desiredLength, rng=None):
     """
     Requires: models is a list of trained NGramModel objects sorted by
               descending priority: tri-, then bi-, then unigrams.
               desiredLength is the desired length of the sentence.
-    Modifies: nothing
+              rng is None or a random.Random.
+    Modifies: rng (the random module if rng is None)
     Effects:  returns a list of strings where each string is a word in the
               generated sentence. The returned list should NOT include
               any of the special starting or ending symbols.
               For more details about generating a sentence using the
               NGramModels, see the spec.
+              Every random number is drawn from rng if one is given, so
+              the same models and a random.Random seeded the same way
+              always give the same sentence, whatever else uses the
+              random module meanwhile.
     """
-    sentence = ['^::^',"^:::^"]
+    endSymbol = models[0].endSymbol
+    sentence = list(models[0].startSymbols)
     length = 0
-    while ((not sentenceTooLong(desiredLength, length)) and (sentence[len(sentence) - 1] != '$:::$')):
+    while ((not sentenceTooLong(desiredLength, length, rng)) and (sentence[len(sentence) - 1] != endSymbol)):
         theGram = selectNGramModel(models, sentence)
-        nextWord = theGram.getNextToken(sentence)
+        nextWord = theGram.getNextToken(sentence, rng)
         sentence.append(nextWord)
-        if nextWord != '$:::$':
+        if nextWord != endSymbol:
             length += 1
 
-    sentence2 = []
-
-    for i in sentence:
-        if i != '^::^' and  i != '^:::^' and i != '$:::$':
-            sentence2.append(i)
+    return models[0].decodeSentence(sentence)
 
+def generateSentences(models, desiredLength, numSentences, rng=None):
+    """
+    Requires: models is a list of trained NGramModel objects sorted by
+              descending priority, as for generateSentence
+    Modifies: rng (the random module if rng is None)
+    Effects:  returns a list of numSentences sentences, each generated like
+              generateSentence(models, desiredLength) would, but all at
+              once (see generateBatch).
+    """
+    return generateBatch(models, desiredLength, numSentences, rng=rng)
 
-    return sentence2
+def generateBatch(models, desiredLength, numSentences, possiblePitches=None,
+                  rng=None):
+    """
+    Requires: models is a list of trained NGramModel objects sorted by
+              descending priority, possiblePitches is None or a list of
+              pitches for a musical key, rng is None or a random.Random
+    Modifies: rng (the random module if rng is None)
+    Effects:  returns a list of numSentences sentences (lists of words, or
+              of PySynth tuples if possiblePitches is given), generated by
+              advancing numSentences chains together, one token per chain
+              per step. A chain drops out once it draws the end symbol or
+              sentenceTooLong tells it to stop, checked before every step
+              exactly as in generateSentence, and the batch is done when
+              no chain is left.
+
+              The model to use and its sampling table (or, for music, its
+              table of candidates in the key, see getKeySamplingTable)
+              depend only on the last getContextLength() tokens of a
+              chain, so they are looked up once per distinct context for
+              the whole batch and then shared by every chain that reaches
+              it: after that, drawing a token is one random number and one
+              binary search. Every sentence follows the same distribution
+              as with generateSentence, but the random numbers are drawn
+              in another order, so a given seed gives other sentences.
+    """
+    if rng is None:
+        rng = random
+    endSymbol = models[0].endSymbol
+    contextLength = max(model.getContextLength() for model in models)
+    pitchMask = None
+    if possiblePitches is not None:
+        pitchMask = getPitchMask(possiblePitches)
+
+    sentences = [list(models[0].startSymbols) for i in range(numSentences)]
+    lengths = [0] * numSentences
+    tables = {}     # last contextLength tokens -> (model, table)
+    active = range(numSentences)
+    while active:
+        active = [i for i in active
+                  if not sentenceTooLong(desiredLength, lengths[i], rng)]
+        stillActive = []
+        for i in active:
+            sentence = sentences[i]
+            context = tuple(sentence[len(sentence) - contextLength:])
+            entry = tables.get(context)
+            if entry is None:
+                model = selectNGramModel(models, sentence)
+                if pitchMask is None:
+                    table = model.getSamplingTable(sentence)
+                else:
+                    table = model.getKeySamplingTable(sentence, pitchMask)
+                entry = (model, table)
+                tables[context] = entry
+
+            model, table = entry
+            if table is None:
+                token = model.getRandomNote(possiblePitches, rng)
+            else:
+                tokens, cumulative = table
+                randomize = rng.randrange(0, cumulative[-1])
+                token = tokens[bisect_right(cumulative, randomize)]
+            sentence.append(token)
+            if token != endSymbol:
+                lengths[i] += 1
+                stillActive.append(i)
+        active = stillActive
+
+    return [models[0].decodeSentence(sentence) for sentence in sentences]
+
+def generateRhymingSentence(models, desiredLength, rhymeIndex, rhymeKey=None,
+                            exclude=None, rng=None):
+    """
+    Requires: models is a list of trained models, as for generateSentence,
+              rhymeIndex is a RhymeIndex of models, rhymeKey is None or a
+              rhyme key, exclude is None or a word, rng is None or a
+              random.Random
+    Modifies: rhymeIndex, rng (the random module if rng is None)
+    Effects:  generates a line like generateSentence, except that its last
+              word is drawn by rhymeIndex.getFinalToken from the words of
+              the rhyme class rhymeKey, other than exclude (from the words
+              that have a rhyme, if rhymeKey is None). The last word comes
+              where the line would have ended, when it grows too long or
+              the end symbol is drawn; if the line so far cannot lead to
+              the class (see RhymeIndex.canReachClass), one word that can
+              is added first (see RhymeIndex.getStepToken). Returns the
+              list of words.
+    """
+    endSymbol = models[0].endSymbol
+    if exclude is not None:
+        exclude = models[0].encodeToken(exclude)
+    sentence = list(models[0].startSymbols)
+    length = 0
+    while True:
+        if not sentenceTooLong(desiredLength, length, rng):
+            theGram = selectNGramModel(models, sentence)
+            nextWord = theGram.getNextToken(sentence, rng)
+            if nextWord != endSymbol:
+                sentence.append(nextWord)
+                length += 1
+                continue
+        if not rhymeIndex.canReachClass(sentence, rhymeKey, exclude):
+            # one more word, after which the last word follows from the
+            # line instead of being drawn from the unigram counts
+            stepWord = rhymeIndex.getStepToken(sentence, rhymeKey, exclude,
+                                               rng)
+            if stepWord is not None:
+                sentence.append(stepWord)
+        finalWord = rhymeIndex.getFinalToken(sentence, rhymeKey, exclude, rng)
+        if finalWord is not None:
+            sentence.append(finalWord)
+        break
+
+    return models[0].decodeSentence(sentence)
+
+def generateCouplet(models, desiredLength, rhymeIndex, rng=None):
+    """
+    Requires: models is a list of trained models, as for generateSentence,
+              rhymeIndex is a RhymeIndex of models, rng is None or a
+              random.Random
+    Modifies: rhymeIndex, rng (the random module if rng is None)
+    Effects:  returns a pair of lines whose last words rhyme: the first
+              line ends in a word of a rhyme class with more than one
+              word, and the second in another word of that class. Neither
+              line is ever generated twice.
+    """
+    first = generateRhymingSentence(models, desiredLength, rhymeIndex,
+                                    rng=rng)
+    if not first:
+        return first, generateSentence(models, desiredLength, rng)
+    second = generateRhymingSentence(models, desiredLength, rhymeIndex,
+                                     getRhymeKey(str(first[-1])), first[-1],
+                                     rng)
+    return first, second
 
 def printSongLyrics(verseOne, verseTwo, chorus):
     """
@@ -114,23 +356,26 @@ def printSongLyrics(verseOne, verseTwo, chorus):
             print (' '.join(line)).capitalize()
         print '\n',
 
-def runLyricsGenerator(models):
+def runLyricsGenerator(models, rng=None, rhymeIndex=None):
     """
-    Requires: models is a list of a trained nGramModel child class objects
-    Modifies: nothing
+    Requires: models is a list of a trained nGramModel child class objects,
+              rng is None or a random.Random, rhymeIndex is None or a
+              RhymeIndex of models
+    Modifies: rng (the random module if rng is None), rhymeIndex
     Effects:  generates a verse one, a verse two, and a chorus, then
               calls printSongLyrics to print the song out.
+              With a rhymeIndex, each verse and the chorus are made of
+              two rhyming couplets (see generateCouplet).
     """
-    verseOne = []
-    verseTwo = []
-    chorus = []
-    list = [0,1,2,3]
-    for i in list:
-        verseOne.append(generateSentence(models, 5))
-    for i in list:
-        verseTwo.append(generateSentence(models, 5))
-    for i in list:
-        chorus.append(generateSentence(models, 5))
+    if rhymeIndex is None:
+        lines = generateSentences(models, 5, 12, rng)
+    else:
+        lines = []
+        for i in range(6):
+            lines.extend(generateCouplet(models, 5, rhymeIndex, rng))
+    verseOne = lines[0:4]
+    verseTwo = lines[4:8]
+    chorus = lines[8:12]
 
     # add rest of runLyricsGenerator implementation here
     printSongLyrics(verseOne, verseTwo,  chorus)
@@ -143,75 +388,253 @@ def runLyricsGenerator(models):
 # Functions to implement: trainMusicModels, generateMusicalSentence, and
 # runMusicGenerator
 
-def trainMusicModels(musicDirectory):
+def trainMusicModels(musicDirectory, maxOrder=None, useCache=True,
+                     minCounts=None, workers=1, frozen=False):
     """
     Requires: nothing
     Modifies: nothing
     Effects:  works exactly as trainLyricsModels from the core, except
-              now the dataLoader calls the DataLoader's loadMusic() function
-              and takes a music directory name instead of an artist name.
+              now the dataLoader streams songs with the DataLoader's
+              iterMusic() function and takes a music directory name (or a
+              list of them) instead of an artist name. All three models are
+              trained in a single pass, one song at a time, with the notes
+              encoded as ids of a shared Vocabulary, then frozen into
+              sampling tables.
               Returns a list of trained models in order of tri-, then bi-, then
-              unigramModel objects.
+              unigramModel objects, or a list of a single BackoffModel of
+              order maxOrder if maxOrder is given, such as 5 for
+              five-gram music models. Like trainLyricsModels, it prunes
+              the models with minCounts if given, loads the models from
+              their model file if useCache is True and none of the music
+              directories changed, and returns FrozenModels exactly when
+              frozen is True.
+              If workers is greater than 1, the models are trained in
+              shards by a pool of that many processes and then merged
+              (see trainShardedMusicModels).
     """
+    if isinstance(musicDirectory, basestring):
+        musicDirectory = [musicDirectory]
+
+    vocabulary = Vocabulary()
     dataLoader = DataLoader()
-    dataLoader.loadMusic(musicDirectory) # music stored in dataLoader.songs
-    models = [TrigramModel(), BigramModel(), UnigramModel()]
-    models[0].trainModel(dataLoader.songs)
-    models[1].trainModel(dataLoader.songs)
-    models[2].trainModel(dataLoader.songs)
-    # add rest of trainMusicModels implementation here
+    modelPath = getModelPath('music', '+'.join(musicDirectory), maxOrder,
+                             minCounts)
+    fingerprint = None
+    if useCache:
+        fingerprints = [dataLoader.fingerprintMusic(platform)
+                        for platform in musicDirectory]
+        if None not in fingerprints:
+            fingerprint = ','.join(fingerprints)
+            models = loadTrainedModels(modelPath, fingerprint, maxOrder,
+                                       frozen)
+            if models is not None:
+                return models
+
+    if workers > 1:
+        models = trainShardedMusicModels(musicDirectory, maxOrder, workers)
+    else:
+        songs = itertools.chain.from_iterable(
+            dataLoader.iterMusic(platform, vocabulary=vocabulary)
+            for platform in musicDirectory)
+        models = makeModels(vocabulary, maxOrder)
+        trainModelsFromStream(models, songs)
+    if minCounts:
+        pruneModels(models, minCounts)
+    for model in models:
+        model.freeze()
+    if fingerprint is not None:
+        saveModels(models, modelPath, fingerprint)
+    if frozen:
+        return freezeModels(models)
 
     return models
 
-def generateMusicalSentence(models, desiredLength, possiblePitches):
+def trainShardedMusicModels(musicDirectories, maxOrder, workers):
     """
-    Requires: possiblePitches is a list of pitches for a musical key
+    Requires: musicDirectories is a list of music directory names,
+              workers > 1
     Modifies: nothing
+    Effects:  splits the songs of musicDirectories into shards, trains
+              the models of makeModels(vocabulary, maxOrder) on each shard
+              in a pool of workers processes, and merges them into one
+              list of models with reduceModels, which it returns unfrozen.
+              Each directory is one shard, or, if there are fewer
+              directories than workers, is split into workers // (number
+              of directories) shards of interleaved files, which are read
+              without the MusicCache (see DataLoader.iterMusicTracks).
+              The counts are the same as with trainMusicModels.
+    """
+    numChunks = max(1, workers // len(musicDirectories))
+    shards = []
+    for platform in musicDirectories:
+        for index in range(numChunks):
+            shard = (index, numChunks) if numChunks > 1 else None
+            shards.append((platform, shard, maxOrder))
+
+    pool = multiprocessing.Pool(min(workers, len(shards)))
+    try:
+        modelLists = pool.map(_trainMusicShard, shards, 1)
+    finally:
+        pool.terminate()
+        pool.join()
+    return reduceModels(modelLists)
+
+def _trainMusicShard(arguments):
+    """
+    Requires: arguments is a (platform, shard, maxOrder) tuple
+    Modifies: nothing
+    Effects:  process pool entry point for trainShardedMusicModels: trains
+              and returns the models of makeModels on the songs of one
+              shard of a music directory, with a vocabulary of their own.
+    """
+    platform, shard, maxOrder = arguments
+    vocabulary = Vocabulary()
+    models = makeModels(vocabulary, maxOrder)
+    trainModelsFromStream(models, DataLoader().iterMusic(
+        platform, vocabulary=vocabulary, shard=shard))
+    return models
+
+def generateMusicalSentence(models, desiredLength, possiblePitches, rng=None):
+    """
+    Requires: possiblePitches is a list of pitches for a musical key,
+              rng is None or a random.Random
+    Modifies: rng (the random module if rng is None)
     Effects:  works exactly like generateSentence from the core, except
               now we call the NGramModel child class' getNextNote()
               function instead of getNextToken(). Everything else
               should be exactly the same as the core.
     """
-    sentence = ['^::^', '^:::^']
+    endSymbol = models[0].endSymbol
+    sentence = list(models[0].startSymbols)
     length = 0
-    while ((not sentenceTooLong(desiredLength, length)) and (sentence[len(sentence) - 1] != '$:::$')):
+    while ((not sentenceTooLong(desiredLength, length, rng)) and (sentence[len(sentence) - 1] != endSymbol)):
         theGram = selectNGramModel(models, sentence)
-        nextnote = theGram.getNextNote(sentence, possiblePitches)
+        nextnote = theGram.getNextNote(sentence, possiblePitches, rng)
         sentence.append(nextnote)
-        if nextnote != '$:::$':
+        if nextnote != endSymbol:
             length += 1
 
-    sentence2 = []
+    return models[0].decodeSentence(sentence)
 
-    for i in sentence:
-        if i != '^::^' and  i != '^:::^' and i != '$:::$':
-            sentence2.append(i)
 
+    # add rest of generateMusicalSentence implementation here
 
-    return sentence2
+def generateMusicalSentences(models, desiredLength, possiblePitches,
+                             numSentences, rng=None):
+    """
+    Requires: possiblePitches is a list of pitches for a musical key,
+              rng is None or a random.Random
+    Modifies: rng (the random module if rng is None)
+    Effects:  returns a list of numSentences musical sentences, each
+              generated like generateMusicalSentence would, but all at
+              once (see generateBatch).
+    """
+    return generateBatch(models, desiredLength, numSentences,
+                         possiblePitches, rng)
 
+# generateInParallel generates its sentences in chunks of this many, each
+# a generateBatch on its own random stream
+GENERATION_CHUNK_SIZE = 64
 
-    # add rest of generateMusicalSentence implementation here
+def deriveSeed(seed, index):
+    """
+    Requires: seed is a hashable value, index is an int
+    Modifies: nothing
+    Effects:  returns the seed of the random stream of item index of a
+              batch generated from seed. The streams of two items are as
+              good as independent, unlike those of seed + index.
+    """
+    digest = hashlib.md5("%r\0%d" % (seed, index)).hexdigest()
+    return int(digest[:16], 16)
+
+def generateInParallel(models, desiredLength, numSentences, seed,
+                       workers=1, possiblePitches=None):
+    """
+    Requires: models is a list of trained models, as for generateBatch,
+              possiblePitches is None or a list of pitches for a musical
+              key, workers >= 1
+    Modifies: nothing
+    Effects:  returns a list of numSentences sentences (musical sentences
+              if possiblePitches is given), generated in a pool of workers
+              processes. The sentences are split into chunks of
+              GENERATION_CHUNK_SIZE, and chunk i is generated with
+              generateBatch on its own random.Random(deriveSeed(seed, i)).
+              The chunks do not depend on workers, so the whole list only
+              depends on models and seed: it is the same from one run to
+              the next and for any number of workers, and the random
+              module is left alone.
+    """
+    chunks = [(None, desiredLength, possiblePitches, deriveSeed(seed, i),
+               min(GENERATION_CHUNK_SIZE, numSentences - start))
+              for i, start in enumerate(range(0, numSentences,
+                                              GENERATION_CHUNK_SIZE))]
+    workers = min(workers, len(chunks))
+    if workers <= 1:
+        results = [_generateChunk((models,) + chunk[1:]) for chunk in chunks]
+    else:
+        pool = multiprocessing.Pool(workers, _initGenerationWorker, (models,))
+        try:
+            results = pool.map(_generateChunk, chunks, 1)
+        finally:
+            pool.terminate()
+            pool.join()
 
+    return [sentence for result in results for sentence in result]
 
+# the models of a generateInParallel worker, handed over once when the
+# pool starts instead of with every chunk
+_workerModels = None
 
-def runMusicGenerator(models, songName):
+def _initGenerationWorker(models):
     """
     Requires: models is a list of trained models
+    Modifies: _workerModels
+    Effects:  process pool initializer for generateInParallel.
+    """
+    global _workerModels
+    _workerModels = models
+
+def _generateChunk(arguments):
+    """
+    Requires: arguments is a (models, desiredLength, possiblePitches,
+              chunkSeed, numSentences) tuple; models is None in a pool
+              worker
     Modifies: nothing
+    Effects:  process pool entry point for generateInParallel: returns
+              numSentences sentences generated together by generateBatch
+              on random.Random(chunkSeed).
+    """
+    models, desiredLength, possiblePitches, chunkSeed, numSentences = \
+        arguments
+    if models is None:
+        models = _workerModels
+    return generateBatch(models, desiredLength, numSentences,
+                         possiblePitches, random.Random(chunkSeed))
+
+
+def runMusicGenerator(models, songName, rng=None):
+    """
+    Requires: models is a list of trained models, rng is None or a
+              random.Random
+    Modifies: rng (the random module if rng is None)
     Effects:  runs the music generator as following the details in the spec.
               Note: For the core, this should print "Under construction".
     """
+    if rng is None:
+        rng = random
     keylist = KEY_SIGNATURES.keys()
-    randomkey = random.choice(keylist)
-    tuplelist = generateMusicalSentence(models, 100, KEY_SIGNATURES[randomkey])
+    randomkey = rng.choice(keylist)
+    tuplelist = generateMusicalSentence(models, 100, KEY_SIGNATURES[randomkey],
+                                        rng)
     pysynth.make_wav(tuplelist, fn=songName)
 
-def playchord(models, songName, desiredlength):
+def playchord(models, songName, desiredlength, rng=None):
+    if rng is None:
+        rng = random
     keylist = KEY_SIGNATURES.keys()
-    randomkey = random.choice(keylist)
+    randomkey = rng.choice(keylist)
     thekey = KEY_SIGNATURES[randomkey]
-    originalsong = generateMusicalSentence(models, desiredlength, thekey)
+    originalsong = generateMusicalSentence(models, desiredlength, thekey, rng)
     pysynth.make_wav(originalsong, fn='wav/' + 'chord1' + '.wav')
     secondsong = []
     thirdsong = []
@@ -230,33 +653,35 @@ def playchord(models, songName, desiredlength):
     pysynth.make_wav(secondsong, fn='wav/' + 'chord2' + '.wav' )
     pysynth.mix_files('wav/' + 'chord1'+ '.wav','wav/' + 'chord2' + '.wav', songName )
 
-def makeatonic(models, songName, desiredlength):
+def makeatonic(models, songName, desiredlength, rng=None):
+    if rng is None:
+        rng = random
     keylist = KEY_SIGNATURES.keys()
-    randomkey = random.choice(keylist)
-    sentence = ['^::^', '^:::^']
-    firsttonic = (KEY_SIGNATURES[randomkey][0] + '4', random.choice(NOTE_DURATIONS))
-    sentence.append(firsttonic)
+    randomkey = rng.choice(keylist)
+    endSymbol = models[0].endSymbol
+    sentence = list(models[0].startSymbols)
+    firsttonic = (KEY_SIGNATURES[randomkey][0] + '4', rng.choice(NOTE_DURATIONS))
+    sentence.append(models[0].encodeToken(firsttonic))
     length = 0
-    while ((not sentenceTooLong(desiredlength, length)) and (sentence[len(sentence) - 1] != '$:::$')):
+    while ((not sentenceTooLong(desiredlength, length, rng)) and (sentence[len(sentence) - 1] != endSymbol)):
         theGram = selectNGramModel(models, sentence)
-        nextnote = theGram.getNextNote(sentence, KEY_SIGNATURES[randomkey])
+        nextnote = theGram.getNextNote(sentence, KEY_SIGNATURES[randomkey], rng)
         sentence.append(nextnote)
-        if nextnote != '$:::$':
+        if nextnote != endSymbol:
             length += 1
 
-    sentence2 = []
-    for i in sentence:
-        if i != '^::^' and i != '^:::^' and i != '$:::$':
-            sentence2.append(i)
+    sentence2 = models[0].decodeSentence(sentence)
 
     sentence2.append(sentence2[0])
     pysynth.make_wav(sentence2, fn = songName)
 
-def makeKeyChange(models, songName):
+def makeKeyChange(models, songName, rng=None):
+    if rng is None:
+        rng = random
     keylist = KEY_SIGNATURES.keys()
-    randomkey = random.choice(keylist)
+    randomkey = rng.choice(keylist)
     firstKey = KEY_SIGNATURES[randomkey]
-    originalsong = generateMusicalSentence(models, 40, firstKey)
+    originalsong = generateMusicalSentence(models, 40, firstKey, rng)
     originalCopy = []
     for x in originalsong:
         originalCopy.append(x)
@@ -264,7 +689,7 @@ def makeKeyChange(models, songName):
     firstKeyIndex = keylist.index(randomkey)
     secondKeyIndex = keylist[firstKeyIndex + 2]
     secondKey = KEY_SIGNATURES[secondKeyIndex]
-    secondSong = generateMusicalSentence(models, 20, secondKey)
+    secondSong = generateMusicalSentence(models, 20, secondKey, rng)
     for i in secondSong:
         originalsong.append(i)
     for j in originalCopy:
@@ -323,8 +748,11 @@ def main():
     musicDirectory = 'gamecube'
 
     print 'Starting program and loading data...'
-    lyricsModels = trainLyricsModels(lyricsDirectory)
-    musicModels = trainMusicModels(musicDirectory)
+    # nothing here trains the models further, so the model files are
+    # loaded as they are instead of being thawed
+    lyricsModels = trainLyricsModels(lyricsDirectory, frozen=True)
+    rhymeIndex = None   # built the first time lyrics are asked for
+    musicModels = trainMusicModels(musicDirectory, frozen=True)
     print 'Data successfully loaded\n'
 
     userInput = getUserInput(teamName, lyricsSource, musicSource)
@@ -332,7 +760,9 @@ def main():
     while userInput != 3:
         print '\n',
         if userInput == 1:
-            runLyricsGenerator(lyricsModels)
+            if rhymeIndex is None:
+                rhymeIndex = RhymeIndex(lyricsModels)
+            runLyricsGenerator(lyricsModels, rhymeIndex=rhymeIndex)
         elif userInput == 2:
             print 'What would you like to do?'
             print '1. Make a regular song'
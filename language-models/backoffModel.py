@@ -0,0 +1,389 @@
+from nGramModel import *
+
+# Each trie node is a list of four slots: the counts of the tokens that
+# follow the node's context, the children (one per token that can come
+# before that context), the sampling table built from the counts, and the
+# sampling tables of the candidates in each key, by pitch mask
+COUNTS = 0
+CHILDREN = 1
+TABLE = 2
+KEY_TABLES = 3
+
+
+def makeNode():
+    """
+    Requires: nothing
+    Modifies: nothing
+    Effects:  returns a new, empty trie node.
+    """
+    return [{}, {}, None, None]
+
+
+# -----------------------------------------------------------------------------
+# BackoffModel class ----------------------------------------------------------
+
+class BackoffModel(NGramModel):
+
+    def __init__(self, maxOrder, vocabulary=None):
+        """
+        Requires: maxOrder >= 1, vocabulary is None or a Vocabulary (see
+                  NGramModel)
+        Modifies: self (this instance of the BackoffModel object)
+        Effects:  this is the BackoffModel constructor. A BackoffModel
+                  holds the n-grams of every order from 1 to maxOrder in a
+                  single trie and backs off on its own, so
+                  BackoffModel(3) behaves like the list of a TrigramModel,
+                  a BigramModel and a UnigramModel, and BackoffModel(5)
+                  needs no new classes.
+
+                  self.nGramCounts is the root of the trie. The root counts
+                  the unigrams; its child for a token t counts what follows
+                  t; that node's child for a token s counts what follows
+                  s t, and so on, up to contexts of maxOrder - 1 tokens.
+                  The contexts are stored last token first, so the longest
+                  context of a sentence that was seen in training is found
+                  in one walk from the root, however many orders there
+                  are.
+        """
+        self.maxOrder = maxOrder
+        super(BackoffModel, self).__init__(vocabulary)
+        self.nGramCounts = makeNode()
+
+    def __str__(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns the string to print when you call print on a
+                  BackoffModel object.
+        """
+        return 'This is a BackoffModel object of order %d' % self.maxOrder
+
+    def resetCounts(self):
+        """
+        Requires: nothing
+        Modifies: self.nGramCounts
+        Effects:  replaces the trie with an empty one.
+        """
+        self.nGramCounts = makeNode()
+        self.clearSamplingTables()
+
+    def countSentence(self, sentence, delta=1):
+        """
+        Requires: sentence is a list of tokens that starts with
+                  self.startSymbols and ends with self.endSymbol; if delta
+                  is negative, sentence was counted before
+        Modifies: self.nGramCounts
+        Effects:  counts every token of sentence after the first under
+                  each of its contexts of up to maxOrder - 1 tokens, and
+                  under the empty context (the unigrams) unless it is a
+                  start symbol, exactly as the fixed-order models do. With
+                  a delta of -1 the sentence is uncounted instead, and
+                  nodes left without counts are removed. The sampling
+                  tables of every node touched are dropped.
+        """
+        root = self.nGramCounts
+        numStartSymbols = len(self.startSymbols)
+        for i in range(1, len(sentence)):
+            token = sentence[i]
+            path = []
+            if i >= numStartSymbols:
+                path.append(root)
+
+            node = root
+            for depth in range(1, min(self.maxOrder - 1, i) + 1):
+                child = node[CHILDREN].get(sentence[i - depth])
+                if child is None:
+                    child = makeNode()
+                    node[CHILDREN][sentence[i - depth]] = child
+                path.append(child)
+                node = child
+
+            for node in path:
+                count = node[COUNTS].get(token, 0) + delta
+                if count > 0:
+                    node[COUNTS][token] = count
+                else:
+                    node[COUNTS].pop(token, None)
+                node[TABLE] = None
+                node[KEY_TABLES] = None
+
+            if delta < 0:
+                # only the last maxOrder - 1 tokens of the context have
+                # nodes, so copying the rest would make this quadratic
+                self.pruneContext(sentence[max(0, i - self.maxOrder + 1):i])
+
+    def pruneContext(self, context):
+        """
+        Requires: context is a list of tokens
+        Modifies: self.nGramCounts
+        Effects:  removes the nodes along the path of context that have
+                  no counts left, deepest first. A node without counts
+                  never has children, since every token counted under a
+                  context is also counted under its shorter suffixes.
+        """
+        path = [self.nGramCounts]
+        for depth in range(1, min(self.maxOrder - 1, len(context)) + 1):
+            child = path[-1][CHILDREN].get(context[-depth])
+            if child is None:
+                break
+            path.append(child)
+
+        for depth in range(len(path) - 1, 0, -1):
+            if path[depth][COUNTS]:
+                break
+            del path[depth - 1][CHILDREN][context[-depth]]
+
+    def prune(self, minCounts):
+        """
+        Requires: minCounts is a dictionary of {order: minimum count}
+        Modifies: self.nGramCounts
+        Effects:  removes the n-grams of every order counted fewer times
+                  than the minimum count of that order (see
+                  NGramModel.prune). A node left without counts is removed
+                  with all of its children, since findNode must never stop
+                  at a node without candidates; the root always stays.
+                  The dictionaries that lost entries are compacted.
+                  The sampling tables of every node that changed are
+                  dropped. Returns the number of n-grams removed.
+        """
+        removed = 0
+        nodes = [(self.nGramCounts, None, None, 1)]
+        while nodes:
+            node, parent, token, order = nodes.pop()
+            minCount = minCounts.get(order, 1)
+            if minCount > 1:
+                counts = node[COUNTS]
+                rare = [key for key, count in counts.iteritems()
+                        if count < minCount]
+                for key in rare:
+                    del counts[key]
+                if rare:
+                    removed += len(rare)
+                    node[TABLE] = None
+                    node[KEY_TABLES] = None
+                    compactDictionary(counts)
+                if not counts and parent is not None:
+                    del parent[CHILDREN][token]
+                    removed += self.countNGrams(node)
+                    continue
+            for key, child in node[CHILDREN].items():
+                nodes.append((child, node, key, order + 1))
+        return removed
+
+    def countNGrams(self, node):
+        """
+        Requires: node is a node of the trie
+        Modifies: nothing
+        Effects:  returns the number of n-grams counted in the subtree of
+                  node.
+        """
+        total = 0
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            total += len(node[COUNTS])
+            nodes.extend(node[CHILDREN].itervalues())
+        return total
+
+    def mergeCounts(self, other, translation=None):
+        """
+        Requires: other is a BackoffModel of the same maxOrder, translation
+                  is as for NGramModel.mergeCounts
+        Modifies: self.nGramCounts
+        Effects:  adds the counts of every node of the trie of other to the
+                  node of the same context in self, creating the nodes
+                  self is missing, and drops the sampling tables of self.
+                  Raises a ValueError if other is not a BackoffModel of the
+                  same order.
+        """
+        if not isinstance(other, BackoffModel) or \
+                other.maxOrder != self.maxOrder:
+            raise ValueError("cannot merge %s into %s" % (other, self))
+        nodes = [(self.nGramCounts, other.nGramCounts)]
+        while nodes:
+            node, otherNode = nodes.pop()
+            addCountDictionaries(node[COUNTS], otherNode[COUNTS], 0,
+                                 translation)
+            node[TABLE] = None
+            node[KEY_TABLES] = None
+            for token, otherChild in otherNode[CHILDREN].iteritems():
+                if translation is not None:
+                    token = translation[token]
+                child = node[CHILDREN].get(token)
+                if child is None:
+                    child = makeNode()
+                    node[CHILDREN][token] = child
+                nodes.append((child, otherChild))
+
+    def findNode(self, sentence):
+        """
+        Requires: sentence is a list of tokens
+        Modifies: nothing
+        Effects:  walks down the trie along the last tokens of sentence,
+                  and returns the node of the longest context of at most
+                  maxOrder - 1 tokens that was seen in training.
+        """
+        node = self.nGramCounts
+        position = len(sentence) - 1
+        stop = max(position - self.maxOrder + 1, -1)
+        while position > stop:
+            child = node[CHILDREN].get(sentence[position])
+            if child is None:
+                break
+            node = child
+            position -= 1
+        return node
+
+    def getBackoffDictionaries(self, sentence, cache=None):
+        """
+        Requires: sentence is a list of tokens
+        Modifies: nothing
+        Effects:  returns the list of the counts of every node on the way
+                  from the root down to the node findNode returns for
+                  sentence, longest context first (see
+                  NGramModel.getBackoffDictionaries).
+        """
+        node = self.nGramCounts
+        dictionaries = [node[COUNTS]]
+        position = len(sentence) - 1
+        stop = max(position - self.maxOrder + 1, -1)
+        while position > stop:
+            node = node[CHILDREN].get(sentence[position])
+            if node is None:
+                break
+            dictionaries.append(node[COUNTS])
+            position -= 1
+        dictionaries.reverse()
+        return [counts for counts in dictionaries if counts]
+
+    def getContextLength(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns maxOrder - 1, the length of the longest context
+                  the model looks up.
+        """
+        return self.maxOrder - 1
+
+    def trainingDataHasNGram(self, sentence):
+        """
+        Requires: sentence is a list of tokens
+        Modifies: nothing
+        Effects:  returns True if the model is trained: thanks to backoff
+                  it can always choose a next token after that.
+        """
+        return len(self.nGramCounts[COUNTS]) > 0
+
+    def getCandidateDictionary(self, sentence):
+        """
+        Requires: sentence is a list of tokens, and trainingDataHasNGram
+                  has returned True for this model
+        Modifies: nothing
+        Effects:  returns the dictionary of candidate next tokens after the
+                  longest context of sentence the model knows.
+        """
+        return self.findNode(sentence)[COUNTS]
+
+    def getSamplingTable(self, sentence):
+        """
+        Requires: sentence is a list of tokens, and trainingDataHasNGram
+                  has returned True for this model
+        Modifies: the trie node of the longest known context of sentence
+        Effects:  returns the sampling table of the candidates after the
+                  longest known context of sentence, which is kept in the
+                  trie node itself.
+        """
+        node = self.findNode(sentence)
+        if node[TABLE] is None:
+            node[TABLE] = self.makeSamplingTable(node[COUNTS])
+        return node[TABLE]
+
+    def getKeySamplingTable(self, sentence, pitchMask):
+        """
+        Requires: sentence is a list of tokens, and trainingDataHasNGram
+                  has returned True for this model
+        Modifies: the trie node of the longest known context of sentence
+        Effects:  returns the sampling table of the candidates in the key
+                  of pitchMask after the longest known context of sentence
+                  (see NGramModel.getKeySamplingTable), which is kept in
+                  the trie node itself.
+        """
+        node = self.findNode(sentence)
+        if node[KEY_TABLES] is None:
+            node[KEY_TABLES] = {}
+        try:
+            return node[KEY_TABLES][pitchMask]
+        except KeyError:
+            table = self.makeKeySamplingTable(
+                self.getTableItems(self.getSamplingTable(sentence)), pitchMask)
+            node[KEY_TABLES][pitchMask] = table
+            return table
+
+    def iterContextCounts(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  yields a (tuple of context tokens, candidate dictionary)
+                  pair for every node of the trie, the root first with the
+                  empty context. The tokens are in sentence order.
+        """
+        nodes = [((), self.nGramCounts)]
+        while nodes:
+            context, node = nodes.pop()
+            if node[COUNTS]:
+                yield context, node[COUNTS]
+            for token, child in node[CHILDREN].iteritems():
+                nodes.append(((token,) + context, child))
+
+    def setContextCounts(self, contextTokens, counts):
+        """
+        Requires: contextTokens is a tuple of fewer than maxOrder tokens
+                  the model has no counts for yet, counts is a candidate
+                  dictionary
+        Modifies: self.nGramCounts
+        Effects:  makes counts the counts of the node of contextTokens,
+                  creating the nodes on the way to it (see
+                  NGramModel.setContextCounts).
+        """
+        node = self.nGramCounts
+        for token in reversed(contextTokens):
+            child = node[CHILDREN].get(token)
+            if child is None:
+                child = makeNode()
+                node[CHILDREN][token] = child
+            node = child
+        node[COUNTS] = counts
+
+    def setSamplingTable(self, contextTokens, table):
+        """
+        Requires: contextTokens is a tuple of tokens the model has a node
+                  for, table is a sampling table of its counts
+        Modifies: the trie node of contextTokens
+        Effects:  makes table the sampling table kept in the node of
+                  contextTokens (see NGramModel.setSamplingTable).
+        """
+        self.findNode(list(contextTokens))[TABLE] = table
+
+    def freeze(self):
+        """
+        Requires: the model is trained
+        Modifies: every node of self.nGramCounts
+        Effects:  builds the sampling table of every context up front.
+        """
+        nodes = [self.nGramCounts]
+        while nodes:
+            node = nodes.pop()
+            if node[TABLE] is None and node[COUNTS]:
+                node[TABLE] = self.makeSamplingTable(node[COUNTS])
+            nodes.extend(node[CHILDREN].itervalues())
+
+
+# -----------------------------------------------------------------------------
+# Testing code ----------------------------------------------------------------
+
+if __name__ == '__main__':
+    text = [ ['the', 'quick', 'brown', 'fox'], ['the', 'lazy', 'dog'] ]
+    sentence = [ '^::^', '^:::^', 'the', 'quick' ]
+    backoffModel = BackoffModel(4)
+    backoffModel.trainModel(text)
+    print backoffModel.getCandidateDictionary(sentence)
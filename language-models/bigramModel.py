@@ -9,81 +9,45 @@ from nGramModel import *
 
 class BigramModel(NGramModel):
 
-    def __init__(self):
+    order = 2
+
+    def __init__(self, vocabulary=None):
         """
-        Requires: nothing
+        Requires: vocabulary is None or a Vocabulary (see NGramModel)
         Modifies: self (this instance of the BigramModel object)
         Effects:  this is the BigramModel constructor, which is done
                   for you. It allows BigramModel to access the data
                   from the NGramModel class by calling the NGramModel
                   constructor.
         """
-        super(BigramModel, self).__init__()
+        super(BigramModel, self).__init__(vocabulary)
 
-    def trainModel(self, text):
+    def countSentence(self, sentence, delta=1):
         """
-        Requires: text is a list of lists of strings
-        Modifies: self.nGramCounts, a two-dimensional dictionary. For examples
-                  and pictures of the BigramModel's version of
-                  self.nGramCounts, see the spec.
-        Effects:  this function populates the self.nGramCounts dictionary,
-                  which has strings as keys and dictionaries of
-                  {string: integer} pairs as values.
-                  Note: make sure to use the return value of prepData to
-                  populate the dictionary, which will allow the special
-                  symbols to be included as their own tokens in
-                  self.nGramCounts. For more details, see the spec.
+        Requires: sentence is a list of tokens that starts with
+                  self.startSymbols and ends with self.endSymbol; if delta
+                  is negative, sentence was counted before
+        Modifies: self.nGramCounts
+        Effects:  counts every pair of adjacent tokens in sentence, exactly
+                  as trainModel does for each sentence. With a delta of -1
+                  the sentence is uncounted instead, and pairs whose count
+                  drops to zero are removed, along with contexts that are
+                  left without any following token. The sampling tables
+                  of the contexts counted are dropped.
         """
-        self.nGramCounts = {}
-        lyrics = BigramModel.prepData(self, text)
-        for words in lyrics:
-            for i in range(len(words) - 1):
-                self.nGramCounts[words[i]] = {}
-
-
-        for words in lyrics:
-            for i in range(len(words) - 1):
-                if self.nGramCounts.get(words[i], False):
-                    count = self.nGramCounts[words[i]].get(words[i+1] , 0)
-                    self.nGramCounts[words[i]].update({words[i+1] : count + 1 })
-                else:
-                    self.nGramCounts[words[i]] = {words[i+1] : 1}
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+        counts = self.nGramCounts
+        invalidate = self.samplingTables or self.keyTables
+        for i in range(len(sentence) - 1):
+            if invalidate:
+                self.invalidateContext(sentence[i])
+            following = counts.setdefault(sentence[i], {})
+            count = following.get(sentence[i + 1], 0) + delta
+            if count > 0:
+                following[sentence[i + 1]] = count
+            else:
+                following.pop(sentence[i + 1], None)
+                if not following:
+                    del counts[sentence[i]]
 
     def trainingDataHasNGram(self, sentence):
         """
@@ -117,6 +81,48 @@ class BigramModel(NGramModel):
 
         return dict2
 
+    def getContext(self, sentence):
+        """
+        Requires: sentence is a list of strings, and len(sentence) >= 1
+        Modifies: nothing
+        Effects:  returns the last token of sentence, which the candidates
+                  depend on.
+        """
+        return sentence[-1]
+
+    def getContextCounts(self, context):
+        """
+        Requires: context is a token in self.nGramCounts
+        Modifies: nothing
+        Effects:  returns the candidate dictionary of the tokens following
+                  context.
+        """
+        return self.nGramCounts[context]
+
+    def iterContexts(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns every token that has candidates after it.
+        """
+        return self.nGramCounts.iterkeys()
+
+    def removeContext(self, context):
+        """
+        Requires: context is a token whose candidate dictionary is empty
+        Modifies: self.nGramCounts
+        Effects:  removes the empty dictionary of context.
+        """
+        del self.nGramCounts[context]
+
+    def getContextTokens(self, context):
+        """
+        Requires: context is a token
+        Modifies: nothing
+        Effects:  returns the one-token tuple of context.
+        """
+        return (context,)
+
 # -----------------------------------------------------------------------------
 # Testing code ----------------------------------------------------------------
 
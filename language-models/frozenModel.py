@@ -0,0 +1,619 @@
+import cPickle
+import os
+import random
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from nGramModel import *
+from vocabulary import Vocabulary
+
+# Contexts are packed into one integer, 16 bits per token id, which is
+# stored as words of 32 bits, the most significant first. "I" is 32 bits
+# wide on every platform, unlike "L", which is 64 bits wide only on 64 bit
+# Unix builds, so the arrays of a model file read back the same anywhere
+TOKEN_BITS = 16
+KEY_WORD_BITS = 32
+KEY_WORD_MASK = (1 << KEY_WORD_BITS) - 1
+KEY_WORD_TYPECODE = "I"
+
+# Model files start with MODEL_FILE_MAGIC and the version of their layout,
+# which must equal MODEL_FILE_VERSION for the file to be read back
+MODEL_FILE_MAGIC = "NGRM"
+MODEL_FILE_VERSION = 2
+MODEL_FILE_PREAMBLE = struct.Struct("<4sII")
+# every array starts at a multiple of this many bytes into the file
+ARRAY_ALIGNMENT = 8
+
+
+def packContext(context):
+    """
+    Requires: context is a sequence of token ids below 2 ** 16
+    Modifies: nothing
+    Effects:  returns the integer holding the ids of context, the first
+              one in the highest bits.
+    """
+    key = 0
+    for token in context:
+        key = (key << TOKEN_BITS) | token
+    return key
+
+def unpackContext(key, length):
+    """
+    Requires: key was returned by packContext for a context of length
+              token ids
+    Modifies: nothing
+    Effects:  returns the tuple of the token ids of that context.
+    """
+    mask = (1 << TOKEN_BITS) - 1
+    context = []
+    for i in range(length):
+        context.append(key & mask)
+        key >>= TOKEN_BITS
+    context.reverse()
+    return tuple(context)
+
+def getNumKeyWords(length):
+    """
+    Requires: length >= 0
+    Modifies: nothing
+    Effects:  returns the number of 32 bit words that hold the packed
+              contexts of length tokens, at least one.
+    """
+    return max(1, (length * TOKEN_BITS + KEY_WORD_BITS - 1) // KEY_WORD_BITS)
+
+def splitKey(key, numWords):
+    """
+    Requires: key was returned by packContext, and fits in numWords words
+    Modifies: nothing
+    Effects:  returns the list of the numWords 32 bit words of key, the
+              most significant first.
+    """
+    return [(key >> (KEY_WORD_BITS * (numWords - 1 - i))) & KEY_WORD_MASK
+            for i in range(numWords)]
+
+def joinKey(words):
+    """
+    Requires: words is a sequence of 32 bit words
+    Modifies: nothing
+    Effects:  returns the packed context that splitKey split into words.
+    """
+    key = 0
+    for word in words:
+        key = (key << KEY_WORD_BITS) | word
+    return key
+
+def findKey(keyWords, key):
+    """
+    Requires: keyWords is a list of arrays of the same length, holding the
+              words of sorted packed contexts (see FrozenModel), key was
+              returned by packContext
+    Modifies: nothing
+    Effects:  returns the position of key among the contexts of keyWords,
+              or -1 if it is not one of them. The positions of the keys
+              with the same first word are found by binary search in the
+              array of first words, and narrowed down by the next word
+              among those, and so on.
+    """
+    words = splitKey(key, len(keyWords))
+    if len(words) == 1:
+        keys = keyWords[0]
+        position = bisect_left(keys, words[0])
+        if position < len(keys) and keys[position] == words[0]:
+            return position
+        return -1
+    low = 0
+    high = len(keyWords[0])
+    for keys, word in zip(keyWords, words):
+        low = bisect_left(keys, word, low, high)
+        high = bisect_right(keys, word, low, high)
+        if low == high:
+            return -1
+    return low
+
+
+# -----------------------------------------------------------------------------
+# FrozenModel class -----------------------------------------------------------
+
+class FrozenModel(NGramModel):
+
+    def __init__(self, model):
+        """
+        Requires: model is a trained NGramModel (a fixed-order model or a
+                  BackoffModel) whose tokens are ids of a Vocabulary
+        Modifies: self (this instance of the FrozenModel object)
+        Effects:  this is the FrozenModel constructor. It copies the counts
+                  of model into flat arrays laid out like a compressed
+                  sparse row matrix, with one row per context:
+                      successors   the token ids that follow each context,
+                                   row after row (unsigned 16 bit)
+                      cumulative   the running total of their counts,
+                                   starting again at every row
+                      rowStarts    where each row starts in successors,
+                                   plus the end of the last row
+                  Rows are grouped by context length and sorted by packed
+                  context within each group, so that a context's row is
+                  found by binary search in self.contextKeys[length], the
+                  list of the arrays of the words of those packed contexts
+                  (see findKey). The
+                  successors of a row are in the order of model's
+                  candidate dictionary, so a FrozenModel draws exactly the
+                  same tokens as model for the same random numbers.
+
+                  A FrozenModel answers trainingDataHasNGram,
+                  getCandidateDictionary, getNextToken and getNextNote like
+                  the model it was made from, but it cannot be trained any
+                  further. Raises a ValueError if model has no vocabulary.
+        """
+        if model.vocabulary is None:
+            raise ValueError("only models trained on vocabulary ids "
+                             "can be frozen")
+        super(FrozenModel, self).__init__(model.vocabulary)
+        self.nGramCounts = None
+
+        if isinstance(model, FrozenModel):
+            # copy the arrays as they are, keeping the order of every row
+            self.successors = array("H", model.successors)
+            self.cumulative = array("I", model.cumulative)
+            self.rowStarts = array("I", model.rowStarts)
+            self.contextKeys = dict(
+                (length, [array(KEY_WORD_TYPECODE, keys) for keys in words])
+                for length, words in model.contextKeys.iteritems())
+            self.firstRows = dict(model.firstRows)
+            self.contextLengths = list(model.contextLengths)
+            return
+
+        rows = [(len(context), packContext(context), counts)
+                for context, counts in model.iterContextCounts()]
+        rows.sort(key=lambda row: (row[0], row[1]))
+
+        self.successors = array("H")
+        self.cumulative = array("I")
+        self.rowStarts = array("I", [0])
+        # context length -> arrays of the words of its sorted contexts
+        self.contextKeys = {}
+        self.firstRows = {}      # context length -> row of its first key
+        for rowNumber, (length, key, counts) in enumerate(rows):
+            if length not in self.contextKeys:
+                self.contextKeys[length] = [
+                    array(KEY_WORD_TYPECODE)
+                    for i in range(getNumKeyWords(length))]
+                self.firstRows[length] = rowNumber
+            keyWords = self.contextKeys[length]
+            for keys, word in zip(keyWords, splitKey(key, len(keyWords))):
+                keys.append(word)
+
+            total = 0
+            for token, count in counts.iteritems():
+                total += count
+                self.successors.append(token)
+                self.cumulative.append(total)
+            self.rowStarts.append(len(self.successors))
+
+        # longest contexts first, so that findRow backs off like the trie
+        # of a BackoffModel
+        self.contextLengths = sorted(self.contextKeys, reverse=True)
+
+    @classmethod
+    def fromArrays(cls, vocabulary, successors, cumulative, rowStarts,
+                   contextKeys, firstRows):
+        """
+        Requires: the arguments are the attributes of the same name of a
+                  FrozenModel built on vocabulary
+        Modifies: nothing
+        Effects:  returns a new FrozenModel made of those arrays, without
+                  copying them. This is how loadModels rebuilds the models
+                  of a model file.
+        """
+        model = cls.__new__(cls)
+        NGramModel.__init__(model, vocabulary)
+        model.nGramCounts = None
+        model.successors = successors
+        model.cumulative = cumulative
+        model.rowStarts = rowStarts
+        model.contextKeys = contextKeys
+        model.firstRows = firstRows
+        model.contextLengths = sorted(contextKeys, reverse=True)
+        return model
+
+    def __str__(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns the string to print when you call print on a
+                  FrozenModel object.
+        """
+        return 'This is a FrozenModel object'
+
+    def resetCounts(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  raises a ValueError: a FrozenModel cannot be retrained.
+        """
+        raise ValueError("a FrozenModel cannot be trained")
+
+    def countSentence(self, sentence, delta=1):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  raises a ValueError: a FrozenModel cannot be retrained.
+        """
+        raise ValueError("a FrozenModel cannot be trained")
+
+    def setContextCounts(self, contextTokens, counts):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  raises a ValueError: the counts of a FrozenModel cannot
+                  change.
+        """
+        raise ValueError("a FrozenModel cannot be trained")
+
+    def prune(self, minCounts):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  raises a ValueError: the counts of a FrozenModel cannot
+                  change, so prune the model before freezing it.
+        """
+        raise ValueError("a FrozenModel cannot be pruned")
+
+    def mergeCounts(self, other, translation=None):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  raises a ValueError: counts are merged before freezing.
+        """
+        raise ValueError("a FrozenModel cannot be merged into")
+
+    def freeze(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  does nothing, since a FrozenModel is frozen already.
+        """
+        return
+
+    def findRow(self, sentence):
+        """
+        Requires: sentence is a list of token ids
+        Modifies: nothing
+        Effects:  returns the row of the longest context at the end of
+                  sentence that the model has candidates for, or -1 if
+                  there is none.
+        """
+        for length in self.contextLengths:
+            if length > len(sentence):
+                continue
+            position = findKey(self.contextKeys[length],
+                               packContext(sentence[len(sentence) - length:]))
+            if position >= 0:
+                return self.firstRows[length] + position
+        return -1
+
+    def getContextLength(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns the length of the longest context of the model.
+        """
+        if not self.contextLengths:
+            return 0
+        return self.contextLengths[0]
+
+    def trainingDataHasNGram(self, sentence):
+        """
+        Requires: sentence is a list of token ids
+        Modifies: nothing
+        Effects:  returns True if this model can be used to choose the
+                  next token for the sentence, just like the model it was
+                  made from.
+        """
+        return self.findRow(sentence) >= 0
+
+    def getCandidateDictionary(self, sentence):
+        """
+        Requires: sentence is a list of token ids, and trainingDataHasNGram
+                  has returned True for this model
+        Modifies: nothing
+        Effects:  returns the dictionary of the candidate next tokens of
+                  sentence and their counts, rebuilt from its row.
+        """
+        return dict(self.getCandidateItems(sentence))
+
+    def getBackoffDictionaries(self, sentence, cache=None):
+        """
+        Requires: sentence is a list of token ids, cache is None or a
+                  dictionary the caller keeps for this model
+        Modifies: cache
+        Effects:  returns the list of the candidate dictionaries, rebuilt
+                  from their rows, of every context at the end of sentence
+                  the model has a row for, longest context first (see
+                  NGramModel.getBackoffDictionaries). Each row is rebuilt
+                  once per cache, which maps rows to their dictionaries.
+        """
+        if cache is None:
+            cache = {}
+        dictionaries = []
+        for length in self.contextLengths:
+            if length > len(sentence):
+                continue
+            position = findKey(self.contextKeys[length],
+                               packContext(sentence[len(sentence) - length:]))
+            if position >= 0:
+                row = self.firstRows[length] + position
+                candidates = cache.get(row)
+                if candidates is None:
+                    start = self.rowStarts[row]
+                    end = self.rowStarts[row + 1]
+                    candidates = dict(self.getTableItems(
+                        (self.successors[start:end],
+                         self.cumulative[start:end])))
+                    cache[row] = candidates
+                dictionaries.append(candidates)
+        return dictionaries
+
+    def getSamplingTable(self, sentence):
+        """
+        Requires: sentence is a list of token ids, and trainingDataHasNGram
+                  has returned True for this model
+        Modifies: nothing
+        Effects:  returns the sampling table of the row of sentence, made
+                  of slices of the arrays: the running totals of a row
+                  already start over from zero.
+        """
+        row = self.findRow(sentence)
+        start = self.rowStarts[row]
+        end = self.rowStarts[row + 1]
+        return self.successors[start:end], self.cumulative[start:end]
+
+    def getKeySamplingTable(self, sentence, pitchMask):
+        """
+        Requires: sentence is a list of token ids, and trainingDataHasNGram
+                  has returned True for this model
+        Modifies: self.keyTables
+        Effects:  returns the sampling table of the candidates in the key
+                  of pitchMask in the row of sentence, kept per row and key
+                  (see NGramModel.getKeySamplingTable).
+        """
+        row = self.findRow(sentence)
+        key = (row, pitchMask)
+        try:
+            return self.keyTables[key]
+        except KeyError:
+            table = self.makeKeySamplingTable(
+                self.getCandidateItems(sentence), pitchMask)
+            self.keyTables[key] = table
+            return table
+
+    def iterContextTables(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  yields a (tuple of context tokens, sampling table) pair
+                  for every row, where the sampling table is a copy of the
+                  row like makeSamplingTable returns, in the order of the
+                  row.
+        """
+        for length in sorted(self.contextKeys):
+            firstRow = self.firstRows[length]
+            for position, words in enumerate(zip(*self.contextKeys[length])):
+                row = firstRow + position
+                start = self.rowStarts[row]
+                end = self.rowStarts[row + 1]
+                yield unpackContext(joinKey(words), length), \
+                    (list(self.successors[start:end]),
+                     array("L", self.cumulative[start:end]))
+
+    def iterContextCounts(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  yields a (tuple of context tokens, candidate dictionary)
+                  pair for every row, rebuilt from the arrays. The
+                  dictionaries need not list the candidates in the order
+                  of their row.
+        """
+        for contextTokens, table in self.iterContextTables():
+            yield contextTokens, dict(self.getTableItems(table))
+
+    def getNextToken(self, sentence, rng=None):
+        """
+        Requires: sentence is a list of token ids, and trainingDataHasNGram
+                  has returned True for this model; rng is None or a
+                  random.Random
+        Modifies: rng (the random module if rng is None)
+        Effects:  draws the next token of sentence straight from the
+                  arrays: a random number below the row's total count, and
+                  a binary search for the first running total above it.
+        """
+        if rng is None:
+            rng = random
+        row = self.findRow(sentence)
+        start = self.rowStarts[row]
+        end = self.rowStarts[row + 1]
+        randomize = rng.randrange(0, self.cumulative[end - 1])
+        return self.successors[bisect_right(self.cumulative, randomize,
+                                            start, end)]
+
+    def getMemorySize(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns the number of bytes held by the arrays of the
+                  model.
+        """
+        arrays = [self.successors, self.cumulative, self.rowStarts]
+        size = sum(len(values) * values.itemsize for values in arrays)
+        for keyWords in self.contextKeys.itervalues():
+            size += sum(len(keys) * keys.itemsize for keys in keyWords)
+        return size
+
+
+def thawModels(frozenModels, models):
+    """
+    Requires: frozenModels is a list of FrozenModel objects, models is a
+              list of as many untrained models of the classes they were
+              frozen from, such as generate.makeModels returns
+    Modifies: models
+    Effects:  loads the counts of each FrozenModel into the model at the
+              same position, which can then be trained, updated, pruned
+              and merged like the model that was frozen, and returns
+              models. Every context gets the sampling table of its row
+              too, since the rebuilt dictionaries need not list the
+              candidates in the order of the row: the models draw the
+              same tokens as the FrozenModels until they are trained
+              again.
+    """
+    for frozen, model in zip(frozenModels, models):
+        for contextTokens, table in frozen.iterContextTables():
+            model.setContextCounts(contextTokens,
+                                   dict(model.getTableItems(table)))
+            model.setSamplingTable(contextTokens, table)
+    return models
+
+def freezeModels(models):
+    """
+    Requires: models is a list of trained NGramModel objects whose tokens
+              are ids of a Vocabulary
+    Modifies: nothing
+    Effects:  returns the list of FrozenModel copies of models, in the same
+              order, ready to be used in their place.
+    """
+    return [FrozenModel(model) for model in models]
+
+
+# -----------------------------------------------------------------------------
+# Model files -----------------------------------------------------------------
+
+def saveModels(models, path, fingerprint=None):
+    """
+    Requires: models is a list of trained NGramModel objects sharing one
+              Vocabulary, fingerprint is None or a string identifying the
+              corpus they were trained on
+    Modifies: the file at path
+    Effects:  writes models, frozen (see FrozenModel), to a model file at
+              path, together with their vocabulary and fingerprint.
+
+              A model file is the preamble (MODEL_FILE_MAGIC, the format
+              version and the length of the header), a pickled header
+              holding the fingerprint, the tokens of the vocabulary and
+              the layout of every array, and then the raw contents of the
+              arrays, each starting at a multiple of ARRAY_ALIGNMENT bytes
+              into the file. The arrays can thus be read back in one call
+              each, or memory-mapped, instead of being unpickled. The file
+              is written under a temporary name first, so an interrupted
+              save never leaves a broken model file behind.
+    """
+    frozen = [model if isinstance(model, FrozenModel)
+              else FrozenModel(model) for model in models]
+
+    layouts = []
+    arrays = []
+    for model in frozen:
+        named = [("successors", model.successors),
+                 ("cumulative", model.cumulative),
+                 ("rowStarts", model.rowStarts)]
+        for length, keyWords in model.contextKeys.iteritems():
+            for i in range(len(keyWords)):
+                named.append(((length, i), keyWords[i]))
+        layouts.append({
+            "arrays": [(name, values.typecode, values.itemsize, len(values))
+                       for name, values in named],
+            "firstRows": model.firstRows,
+        })
+        arrays.extend(values for name, values in named)
+
+    header = cPickle.dumps({
+        "fingerprint": fingerprint,
+        "byteorder": sys.byteorder,
+        "tokens": frozen[0].vocabulary.tokens,
+        "models": layouts,
+    }, cPickle.HIGHEST_PROTOCOL)
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    F = open(path + ".tmp", "wb")
+    F.write(MODEL_FILE_PREAMBLE.pack(MODEL_FILE_MAGIC, MODEL_FILE_VERSION,
+                                     len(header)))
+    F.write(header)
+    for values in arrays:
+        F.write("\0" * (-F.tell() % ARRAY_ALIGNMENT))
+        values.tofile(F)
+    F.close()
+    os.rename(path + ".tmp", path)
+
+def loadModels(path, fingerprint=None):
+    """
+    Requires: nothing
+    Modifies: nothing
+    Effects:  returns the list of FrozenModel objects saved at path by
+              saveModels, sharing a new Vocabulary with the same ids as
+              the one they were saved with. If fingerprint is given, the
+              file must have been saved with the same fingerprint.
+              Returns None if there is no file at path, if it is not a
+              model file of this version or was written on a machine with
+              other array sizes, or if it is stale.
+    """
+    if not os.path.exists(path):
+        return None
+
+    F = open(path, "rb")
+    try:
+        preamble = F.read(MODEL_FILE_PREAMBLE.size)
+        if len(preamble) < MODEL_FILE_PREAMBLE.size:
+            return None
+        magic, version, headerLength = MODEL_FILE_PREAMBLE.unpack(preamble)
+        if magic != MODEL_FILE_MAGIC or version != MODEL_FILE_VERSION:
+            return None
+        try:
+            header = cPickle.loads(F.read(headerLength))
+        except (EOFError, cPickle.UnpicklingError):
+            return None
+        if fingerprint is not None and header["fingerprint"] != fingerprint:
+            return None
+
+        vocabulary = Vocabulary(header["tokens"])
+        models = []
+        for layout in header["models"]:
+            named = {}
+            for name, typecode, itemsize, count in layout["arrays"]:
+                values = array(typecode)
+                if values.itemsize != itemsize:
+                    return None
+                F.seek(-F.tell() % ARRAY_ALIGNMENT, os.SEEK_CUR)
+                try:
+                    values.fromfile(F, count)
+                except EOFError:
+                    return None
+                if header["byteorder"] != sys.byteorder:
+                    values.byteswap()
+                named[name] = values
+
+            contextKeys = {}
+            for name in sorted(name for name in named
+                               if isinstance(name, tuple)):
+                contextKeys.setdefault(name[0], []).append(named[name])
+            models.append(FrozenModel.fromArrays(
+                vocabulary, named["successors"], named["cumulative"],
+                named["rowStarts"], contextKeys, layout["firstRows"]))
+        return models
+    finally:
+        F.close()
+
+
+# -----------------------------------------------------------------------------
+# Testing code ----------------------------------------------------------------
+
+if __name__ == '__main__':
+    from vocabulary import Vocabulary
+    from trigramModel import TrigramModel
+    vocabulary = Vocabulary()
+    text = [ ['the', 'quick', 'brown', 'fox'], ['the', 'lazy', 'dog'] ]
+    trigramModel = TrigramModel(vocabulary)
+    trigramModel.trainModel([vocabulary.encode(row) for row in text])
+    frozenModel = FrozenModel(trigramModel)
+    sentence = trigramModel.startSymbols + [vocabulary.getId('the')]
+    print frozenModel.getCandidateDictionary(sentence)
@@ -1,8 +1,109 @@
+import itertools
+import math
 import random
 import sys
+from array import array
+from bisect import bisect_right
 sys.path.append('../data')
 from data.musicData import *
 
+# Symbols that prepData puts around every sentence
+START_SYMBOLS = ['^::^', '^:::^']
+END_SYMBOL = '$:::$'
+
+# probability below the lowest order model when scoring, so that a token no
+# model has seen does not make a whole held-out set impossible
+PROBABILITY_FLOOR = 1e-6
+
+# pitch class name (such as 'c#') -> the bit standing for it in pitch masks,
+# for every spelling of every pitch class with up to two sharps or flats.
+# The table is fixed, rather than filled in as pitch classes come up, so
+# that the bits and masks cached in a model mean the same thing in any
+# process the model is copied to.
+PITCH_CLASS_BITS = dict((pitch, 1 << i) for i, pitch in enumerate(sorted(
+    letter + accidental for letter in 'abcdefg'
+    for accidental in ('', '#', '##', 'b', 'bb'))))
+
+
+def getPitchMask(pitches):
+    """
+    Requires: pitches is a list of pitch class names, such as a list of
+              KEY_SIGNATURES
+    Modifies: nothing
+    Effects:  returns the integer with the bits of the pitch classes in
+              pitches set. A pitch class is in pitches exactly if its bit
+              is set in the mask. Raises a ValueError for a name that is
+              not in PITCH_CLASS_BITS.
+    """
+    mask = 0
+    for pitch in pitches:
+        try:
+            mask |= PITCH_CLASS_BITS[pitch]
+        except KeyError:
+            raise ValueError("unknown pitch class %r" % (pitch,))
+    return mask
+
+def compactDictionary(dictionary):
+    """
+    Requires: dictionary is a dictionary
+    Modifies: dictionary
+    Effects:  rebuilds the hash table of dictionary in place at the size
+              its entries need. A dictionary never shrinks when entries
+              are deleted from it, so pruning alone frees no memory.
+    """
+    items = dictionary.items()
+    dictionary.clear()
+    dictionary.update(items)
+
+def deepSizeOf(obj, seen=None):
+    """
+    Requires: seen is None or a set of object ids
+    Modifies: seen
+    Effects:  returns an estimate in bytes of the memory held by obj and
+              everything it refers to through dictionaries, lists and
+              tuples, counting shared objects once. Objects whose ids are
+              in seen are counted as already measured.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += deepSizeOf(key, seen) + deepSizeOf(value, seen)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += deepSizeOf(item, seen)
+    return size
+
+
+def addCountDictionaries(target, source, depth, translation=None):
+    """
+    Requires: target and source are count dictionaries nested depth levels
+              deep (0 for {token: count}), translation is None or a list
+              mapping the token ids of source to those of target
+    Modifies: target
+    Effects:  adds every count of source to target, creating the inner
+              dictionaries target is missing. Adding is associative and
+              commutative, so any number of dictionaries can be summed in
+              any grouping and order.
+    """
+    for key, value in source.iteritems():
+        if translation is not None:
+            key = translation[key]
+        if depth == 0:
+            target[key] = target.get(key, 0) + value
+        else:
+            inner = target.get(key)
+            if inner is None:
+                inner = {}
+                target[key] = inner
+            addCountDictionaries(inner, value, depth - 1, translation)
+
+
 # -----------------------------------------------------------------------------
 # NGramModel class ------------------------------------------------------------
 # Core functions to implement: prepData, weightedChoice, and getNextToken
@@ -10,16 +111,40 @@ from data.musicData import *
 
 class NGramModel(object):
 
-    def __init__(self):
+    # the number of tokens in each n-gram of a fixed-order model, which
+    # NGramIndex uses to hand it its counts; None for other models
+    order = None
+
+    def __init__(self, vocabulary=None):
         """
-        Requires: nothing
+        Requires: vocabulary is None or a Vocabulary shared by every model
+                  trained on the same data
         Modifies: self (this instance of the NGramModel object)
         Effects:  This is the NGramModel constructor. It sets up an empty
                   dictionary as a member variable. It is called from the
                   constructors of the NGramModel child classes. This
                   function is done for you.
+                  Without a vocabulary the model is trained on lists of
+                  strings (or PySynth tuples). With a vocabulary it is
+                  trained on sequences of token ids from that vocabulary,
+                  and its start and end symbols are ids too.
         """
         self.nGramCounts = {}
+        # context -> (tokens, cumulative counts), built from nGramCounts on
+        # first use; anything that changes nGramCounts must empty it
+        self.samplingTables = {}
+        # context -> {pitch mask: sampling table of the candidates in that
+        # key, or None if there are none}; emptied with samplingTables
+        self.keyTables = {}
+        self.pitchBits = {}     # token -> bit of its pitch class
+        self.vocabulary = vocabulary
+        if vocabulary is None:
+            self.startSymbols = START_SYMBOLS
+            self.endSymbol = END_SYMBOL
+        else:
+            self.startSymbols = [vocabulary.getId(symbol)
+                                 for symbol in START_SYMBOLS]
+            self.endSymbol = vocabulary.getId(END_SYMBOL)
 
     def __str__(self):
         """
@@ -45,16 +170,8 @@ class NGramModel(object):
                   parameter in this function.
         """
         textCopy = []
-        textCopy = text[:]
-        for row in textCopy:
-                row.insert(0,'^:::^')
-                row.insert(0,'^::^')
-        for row in textCopy:
-                row.append('$:::$')
-
-
-
-        # add the rest of your prepData implementation here
+        for row in text:
+            textCopy.append(self.startSymbols + list(row) + [self.endSymbol])
 
         return textCopy
 
@@ -62,10 +179,36 @@ class NGramModel(object):
         """
         Requires: text is a list of lists of strings
         Modifies: self.nGramCounts
-        Effects:  this function populates the self.nGramCounts dictionary.
-                  It does not need to be modified here because you will
-                  override it in the NGramModel child classes according
-                  to the spec.
+        Effects:  this function populates the self.nGramCounts dictionary
+                  by counting every sentence of prepData(text) with
+                  countSentence. text itself is not modified. To train
+                  several models on the same text, trainModelsFromStream
+                  is faster, since it reads the text only once.
+        """
+        self.resetCounts()
+        for sentence in self.prepData(text):
+            self.countSentence(sentence)
+
+    def resetCounts(self):
+        """
+        Requires: nothing
+        Modifies: self.nGramCounts, self.samplingTables, self.keyTables
+        Effects:  empties the model, so that it can be trained again.
+        """
+        self.nGramCounts = {}
+        self.clearSamplingTables()
+
+    def countSentence(self, sentence, delta=1):
+        """
+        Requires: sentence is a list of strings that starts with the
+                  START_SYMBOLS and ends with the END_SYMBOL, delta is 1
+                  or -1
+        Modifies: self.nGramCounts
+        Effects:  adds the n-grams of this one sentence to
+                  self.nGramCounts, or takes them back out if delta is -1.
+                  Overridden in the NGramModel child classes; it is what
+                  trainModelsFromStream and updateModels use to train a
+                  model one sentence at a time.
         """
         return
 
@@ -93,78 +236,848 @@ class NGramModel(object):
         """
         return {}
 
-    def weightedChoice(self, candidates):
+    def weightedChoice(self, candidates, rng=None):
         """
         Requires: candidates is a dictionary; the keys of candidates are items
-                  you want to choose from and the values are integers
-        Modifies: nothing
+                  you want to choose from and the values are integers;
+                  rng is None or a random.Random
+        Modifies: rng (the random module if rng is None)
         Effects:  returns a candidate item (a key in the candidates dictionary)
                   based on the algorithm described in the spec.
         """
-        token = candidates.keys()
-        values = candidates.values()
+        return self.sampleTable(self.makeSamplingTable(candidates), rng)
+
+    def makeSamplingTable(self, candidates):
+        """
+        Requires: candidates is a non-empty dictionary whose values are
+                  positive integers
+        Modifies: nothing
+        Effects:  returns a (tokens, cumulative) tuple, where tokens is the
+                  list of keys of candidates and cumulative is an array of
+                  the running totals of their values, in the same order.
+        """
+        cumulative = array("L")
         total = 0
-        culm = []
-        for i in values:
-            total += i
-            culm.append(total)
-        randomize = random.randrange(0, max(culm))
-        for x in culm:
-            if x > randomize:
-                index = culm.index(x)
-                return token[index]
+        for count in candidates.itervalues():
+            total += count
+            cumulative.append(total)
+        return candidates.keys(), cumulative
 
+    def sampleTable(self, table, rng=None):
+        """
+        Requires: table was returned by makeSamplingTable, rng is None or a
+                  random.Random
+        Modifies: rng (the random module if rng is None)
+        Effects:  draws a random number below the total count and returns
+                  the first token whose running total is above it, found
+                  by binary search. That is the token weightedChoice picks
+                  for the same random number, so a sampling table gives the
+                  same distribution as the candidates it was built from.
+                  The random number comes from rng if one is given, so that
+                  threads or processes drawing from their own random.Random
+                  do not share the state of the random module.
+        """
+        if rng is None:
+            rng = random
+        tokens, cumulative = table
+        randomize = rng.randrange(0, cumulative[-1])
+        return tokens[bisect_right(cumulative, randomize)]
 
+    def getTableItems(self, table):
+        """
+        Requires: table was returned by makeSamplingTable or
+                  getSamplingTable
+        Modifies: nothing
+        Effects:  returns the list of (token, count) pairs table was built
+                  from, in the order of the table.
+        """
+        tokens, cumulative = table
+        items = []
+        previous = 0
+        for i in range(len(tokens)):
+            items.append((tokens[i], cumulative[i] - previous))
+            previous = cumulative[i]
+        return items
 
+    def getSamplingTable(self, sentence):
+        """
+        Requires: sentence is a list of strings, and trainingDataHasNGram
+                  has returned True for this particular language model
+        Modifies: self.samplingTables
+        Effects:  returns the sampling table of the candidates for the next
+                  token of sentence. Each context's table is built once and
+                  reused until the model is trained again.
+        """
+        context = self.getContext(sentence)
+        table = self.samplingTables.get(context)
+        if table is None:
+            table = self.makeSamplingTable(
+                self.getCandidateDictionary(sentence))
+            self.samplingTables[context] = table
+        return table
 
-    def getNextToken(self, sentence):
+    def clearSamplingTables(self):
         """
-        Requires: sentence is a list of strings, and this model can be used to
-                  choose the next token for the current sentence
+        Requires: nothing
+        Modifies: self.samplingTables, self.keyTables
+        Effects:  drops every sampling table built from the counts. Must be
+                  called whenever self.nGramCounts changes.
+        """
+        self.samplingTables = {}
+        self.keyTables = {}
+
+    def setSamplingTable(self, contextTokens, table):
+        """
+        Requires: contextTokens is a tuple of tokens the model has counts
+                  for, table is a sampling table of exactly those counts
+        Modifies: self.samplingTables
+        Effects:  makes table the sampling table of contextTokens, so that
+                  draws after it follow the order of table rather than
+                  that of the candidate dictionary.
+        """
+        self.samplingTables[self.getContext(list(contextTokens))] = table
+
+    def invalidateContext(self, context):
+        """
+        Requires: context was returned by getContext
+        Modifies: self.samplingTables, self.keyTables
+        Effects:  drops the sampling tables of context only, after its
+                  counts changed. The tables of every other context stay
+                  valid.
+        """
+        self.samplingTables.pop(context, None)
+        self.keyTables.pop(context, None)
+
+    def addSequences(self, sequences):
+        """
+        Requires: sequences is an iterable of lists or id arrays of tokens
+                  (without the start and end symbols)
+        Modifies: self.nGramCounts, self.samplingTables, self.keyTables
+        Effects:  counts every sequence in sequences in place, as if it had
+                  been part of the training data, dropping only the
+                  sampling tables of the contexts whose counts changed, so
+                  that a model in use can take in new songs without being
+                  trained again.
+        """
+        countSentences([self], sequences, 1)
+
+    def removeSequences(self, sequences):
+        """
+        Requires: every sequence in sequences was counted by the model
+                  before, in training or by addSequences
+        Modifies: self.nGramCounts, self.samplingTables, self.keyTables
+        Effects:  uncounts every sequence in sequences in place, like
+                  addSequences. N-grams left with a count of zero are
+                  removed, so the model ends up as if it had been trained
+                  without them.
+        """
+        countSentences([self], sequences, -1)
+
+    def score(self, sequences, floor=PROBABILITY_FLOOR):
+        """
+        Requires: sequences is an iterable of lists or id arrays of tokens
+                  (without the start and end symbols)
+        Modifies: nothing
+        Effects:  returns the natural log of the probability this model
+                  alone gives sequences (see scoreSequences).
+        """
+        return scoreSequences([self], sequences, floor)[0]
+
+    def perplexity(self, sequences, floor=PROBABILITY_FLOOR):
+        """
+        Requires: sequences is as for score
+        Modifies: nothing
+        Effects:  returns the perplexity of this model alone on sequences
+                  (see computePerplexity).
+        """
+        return computePerplexity([self], sequences, floor)[0]
+
+    def mergeCounts(self, other, translation=None):
+        """
+        Requires: other is a model of the same class and order as self,
+                  translation is None if both models use the same token
+                  ids, or else the list mapping the ids of other to those
+                  of self (see mergeModels)
+        Modifies: self.nGramCounts, self.samplingTables, self.keyTables
+        Effects:  adds the counts of other to the counts of self, so that
+                  self ends up as if it had also been trained on the data
+                  of other. Raises a ValueError if the models do not hold
+                  the same kind of n-grams.
+        """
+        if type(self) is not type(other) or self.order is None:
+            raise ValueError("cannot merge %s into %s" % (other, self))
+        addCountDictionaries(self.nGramCounts, other.nGramCounts,
+                             self.order - 1, translation)
+        self.clearSamplingTables()
+
+    def prune(self, minCounts):
+        """
+        Requires: minCounts is a dictionary of {order: minimum count}
+        Modifies: self.nGramCounts, self.samplingTables, self.keyTables
+        Effects:  removes every n-gram of the model's order counted fewer
+                  than minCounts[self.order] times (none if the order is
+                  not in minCounts), along with the contexts left without
+                  candidates, compacts the dictionaries that lost entries,
+                  and drops the sampling tables of the contexts that
+                  changed. Sentences whose context is pruned away back off
+                  to the next model. Returns the number of n-grams removed.
+        """
+        minCount = minCounts.get(self.order, 1)
+        if minCount <= 1:
+            return 0
+
+        removed = 0
+        for context in list(self.iterContexts()):
+            counts = self.getContextCounts(context)
+            rare = [token for token, count in counts.iteritems()
+                    if count < minCount]
+            if not rare:
+                continue
+            for token in rare:
+                del counts[token]
+            removed += len(rare)
+            self.invalidateContext(context)
+            if counts:
+                compactDictionary(counts)
+            else:
+                self.removeContext(context)
+        return removed
+
+    def getMemorySize(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns an estimate in bytes of the memory held by the
+                  counts of the model and the sampling tables built from
+                  them (see deepSizeOf).
+        """
+        seen = set()
+        return sum(deepSizeOf(obj, seen) for obj in
+                   (self.nGramCounts, self.samplingTables, self.keyTables))
+
+    def removeContext(self, context):
+        """
+        Requires: context was returned by iterContexts and has no
+                  candidates left
+        Modifies: self.nGramCounts
+        Effects:  removes context from self.nGramCounts. Overridden in the
+                  NGramModel child classes whose contexts have their own
+                  dictionaries.
+        """
+        return
+
+    def freeze(self):
+        """
+        Requires: the model is trained
+        Modifies: self.samplingTables
+        Effects:  builds the sampling table of every context up front, so
+                  that no draw has to build one later.
+        """
+        for context in self.iterContexts():
+            if context not in self.samplingTables:
+                self.samplingTables[context] = \
+                    self.makeSamplingTable(self.getContextCounts(context))
+
+    def getContext(self, sentence):
+        """
+        Requires: sentence is a list of strings
+        Modifies: nothing
+        Effects:  returns the part of sentence this model bases its choice
+                  of the next token on. Overridden in the NGramModel child
+                  classes.
+        """
+        return None
+
+    def getContextLength(self):
+        """
+        Requires: self.order is set, as in every fixed-order model
+        Modifies: nothing
+        Effects:  returns the number of tokens at the end of a sentence
+                  that the choice of its next token depends on.
+        """
+        return self.order - 1
+
+    def getContextCounts(self, context):
+        """
+        Requires: context was returned by getContext or iterContexts
+        Modifies: nothing
+        Effects:  returns the candidate dictionary for context, the same
+                  one getCandidateDictionary returns for a sentence with
+                  that context. Overridden in the NGramModel child classes.
+        """
+        return {}
+
+    def iterContexts(self):
+        """
+        Requires: nothing
         Modifies: nothing
+        Effects:  returns an iterable of every context this model has
+                  candidates for. Overridden in the NGramModel child
+                  classes.
+        """
+        return []
+
+    def getContextTokens(self, context):
+        """
+        Requires: context was returned by getContext or iterContexts
+        Modifies: nothing
+        Effects:  returns the tuple of tokens that context stands for, in
+                  sentence order. Overridden in the NGramModel child
+                  classes.
+        """
+        return ()
+
+    def iterContextCounts(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  yields a (tuple of context tokens, candidate dictionary)
+                  pair for every context of the model, which is all a
+                  FrozenModel needs to copy it.
+        """
+        for context in self.iterContexts():
+            yield self.getContextTokens(context), \
+                self.getContextCounts(context)
+
+    def setContextCounts(self, contextTokens, counts):
+        """
+        Requires: self.order is set, as in every fixed-order model,
+                  contextTokens is a tuple of order - 1 tokens the model
+                  has no counts for yet, counts is a candidate dictionary
+        Modifies: self.nGramCounts
+        Effects:  makes counts the candidate dictionary of contextTokens,
+                  the reverse of iterContextCounts. This is how the counts
+                  of a FrozenModel are loaded back into a model that can
+                  be trained further (see frozenModel.thawModels).
+        """
+        if not contextTokens:
+            self.nGramCounts = counts
+            return
+        target = self.nGramCounts
+        for token in contextTokens[:-1]:
+            inner = target.get(token)
+            if inner is None:
+                inner = {}
+                target[token] = inner
+            target = inner
+        target[contextTokens[-1]] = counts
+
+    def getNextToken(self, sentence, rng=None):
+        """
+        Requires: sentence is a list of strings, and this model can be used to
+                  choose the next token for the current sentence; rng is
+                  None or a random.Random
+        Modifies: rng (the random module if rng is None)
         Effects:  returns the next token to be added to sentence by calling
                   the getCandidateDictionary and weightedChoice functions.
                   For more information on how to put all these functions
                   together, see the spec.
         """
-        value1 = self.getCandidateDictionary(sentence)
-        value2 = self.weightedChoice(value1)
-        return value2
+        return self.sampleTable(self.getSamplingTable(sentence), rng)
 
-    def getNextNote(self, musicalSentence, possiblePitches):
+    def getNextNote(self, musicalSentence, possiblePitches, rng=None):
         """
         Requires: musicalSentence is a list of PySynth tuples,
                   possiblePitches is a list of possible pitches for this
                   line of music (in other words, a key signature), and this
                   model can be used to choose the next note for the current
-                  musical sentence
-        Modifies: nothing
+                  musical sentence; rng is None or a random.Random
+        Modifies: self.keyTables, rng (the random module if rng is None)
         Effects:  returns the next note to be added to the "musical sentence".
                   For details on how to do this and how this will differ
                   from the getNextToken function from the core, see the spec.
                   Please note that this function is for the reach only.
+                  The candidates in the key are drawn from a sampling table
+                  kept per context and key (see getKeySamplingTable).
+        """
+        table = self.getKeySamplingTable(musicalSentence,
+                                         getPitchMask(possiblePitches))
+        if table is not None:
+            return self.sampleTable(table, rng)
+        else:
+            return self.getRandomNote(possiblePitches, rng)
+
+    def getRandomNote(self, possiblePitches, rng=None):
+        """
+        Requires: possiblePitches is a list of pitches for a musical key,
+                  rng is None or a random.Random
+        Modifies: self.vocabulary, if the note is new to it, and rng (the
+                  random module if rng is None)
+        Effects:  returns a random note of the fourth octave in that key,
+                  with a random duration. getNextNote falls back on this
+                  when none of the candidates are in the key.
+        """
+        if rng is None:
+            rng = random
+        pitch = str(rng.choice(possiblePitches)) + '4'
+        duration = rng.choice(NOTE_DURATIONS)
+        return self.encodeToken((pitch, duration))
+
+    def getPitchBit(self, token):
+        """
+        Requires: token is a note token of this model, not a start or end
+                  symbol
+        Modifies: self.pitchBits
+        Effects:  returns the bit of the pitch class of token in pitch
+                  masks: the pitch of the note up to its last character
+                  (the octave), so 'c#' for the pitch 'c#4'. A note whose
+                  pitch class is not in PITCH_CLASS_BITS is in no key and
+                  gets 0.
+        """
+        bit = self.pitchBits.get(token)
+        if bit is None:
+            justnote = self.decodeToken(token)[0]
+            list1 = justnote.split(justnote[-1])
+            bit = PITCH_CLASS_BITS.get(list1[0], 0)
+            self.pitchBits[token] = bit
+        return bit
+
+    def makeKeySamplingTable(self, items, pitchMask):
+        """
+        Requires: items is a list of (candidate, count) pairs returned by
+                  getCandidateItems, pitchMask was returned by getPitchMask
+        Modifies: self.pitchBits
+        Effects:  returns the sampling table of the candidates in items
+                  whose pitch class is in pitchMask, plus the end symbol,
+                  or None if there are none of them.
         """
-        alldict = {}
-        listofkeys = []
-        justnote = 'string'
         secondList = {}
-        alldict = self.getCandidateDictionary(musicalSentence)
-        listofkeys = alldict.keys()
-        for note in listofkeys:
-            if note == '$:::$':
-                secondList[note] = alldict[note]
-            else:
-                justnote = note[0]
-                list1 = justnote.split(justnote[-1])
-                if list1[0] in possiblePitches:
-                    secondList[note] = alldict[note]
+        for note, count in items:
+            if note == self.endSymbol or self.getPitchBit(note) & pitchMask:
+                secondList[note] = count
+        if not secondList:
+            return None
+        return self.makeSamplingTable(secondList)
 
-        if bool(secondList):
-            return self.weightedChoice(secondList)
-        else:
-            pitch = str(random.choice(possiblePitches)) + '4'
-            duration = random.choice(NOTE_DURATIONS)
-            return (pitch, duration)
+    def getKeySamplingTable(self, sentence, pitchMask):
+        """
+        Requires: sentence is a list of tokens, and trainingDataHasNGram
+                  has returned True for this particular language model
+        Modifies: self.keyTables
+        Effects:  returns the sampling table of the candidates for the next
+                  note of sentence that are in the key of pitchMask (see
+                  makeKeySamplingTable), or None if none are. Each table is
+                  built the first time its context and key come up, and
+                  reused until the counts of the context change, so
+                  filtering a note by key is a dictionary lookup instead of
+                  a scan of the candidates.
+        """
+        context = self.getContext(sentence)
+        tables = self.keyTables.get(context)
+        if tables is None:
+            tables = {}
+            self.keyTables[context] = tables
+        try:
+            return tables[pitchMask]
+        except KeyError:
+            table = self.makeKeySamplingTable(
+                self.getCandidateItems(sentence), pitchMask)
+            tables[pitchMask] = table
+            return table
+
+    def getBackoffDictionaries(self, sentence, cache=None):
+        """
+        Requires: sentence is a list of tokens, cache is None or a
+                  dictionary the caller keeps for this model
+        Modifies: cache
+        Effects:  returns the list of the candidate dictionaries of the
+                  contexts at the end of sentence that the model knows,
+                  longest context first, for scoreSequences to back off
+                  through. A model of one order has at most one of them.
+                  Overridden in the models that know contexts of several
+                  lengths; models that have to rebuild their dictionaries
+                  keep them in cache, which lives as long as the caller
+                  wants them to.
+        """
+        if not self.trainingDataHasNGram(sentence):
+            return []
+        return [self.getCandidateDictionary(sentence)]
+
+    def getCandidateItems(self, sentence):
+        """
+        Requires: sentence is a list of strings, and trainingDataHasNGram
+                  has returned True for this particular language model
+        Modifies: nothing
+        Effects:  returns the list of (candidate, count) pairs of the
+                  candidate dictionary of sentence, in the order of its
+                  sampling table, which is the dictionary's order unless
+                  the table was set by setSamplingTable.
+        """
+        return self.getTableItems(self.getSamplingTable(sentence))
+
+    def save(self, path, fingerprint=None):
+        """
+        Requires: the model is trained on the ids of a Vocabulary
+        Modifies: the file at path
+        Effects:  writes the model to a versioned binary model file at
+                  path, frozen into the flat arrays of a FrozenModel (see
+                  frozenModel.saveModels).
+        """
+        from frozenModel import saveModels
+        saveModels([self], path, fingerprint)
+
+    @staticmethod
+    def load(path, fingerprint=None):
+        """
+        Requires: path is a model file written by save
+        Modifies: nothing
+        Effects:  returns the FrozenModel saved at path. Raises an IOError
+                  if the file is missing, unreadable, stale (its
+                  fingerprint is not fingerprint) or holds several models.
+        """
+        from frozenModel import loadModels
+        models = loadModels(path, fingerprint)
+        if models is None or len(models) != 1:
+            raise IOError("%s is not a current model file" % path)
+        return models[0]
+
+    def encodeToken(self, token):
+        """
+        Requires: nothing
+        Modifies: self.vocabulary, if token is new to it
+        Effects:  returns token as this model stores it: its id if the
+                  model has a vocabulary, otherwise token itself.
+        """
+        if self.vocabulary is None:
+            return token
+        return self.vocabulary.getId(token)
+
+    def decodeToken(self, token):
+        """
+        Requires: token is a token of this model
+        Modifies: nothing
+        Effects:  returns the string or PySynth tuple that token stands for.
+        """
+        if self.vocabulary is None:
+            return token
+        return self.vocabulary.getToken(token)
+
+    def decodeSentence(self, sentence):
+        """
+        Requires: sentence is a list of tokens of this model
+        Modifies: nothing
+        Effects:  returns the list of strings or PySynth tuples for
+                  sentence, leaving out the start and end symbols. This is
+                  the only place where generated id sequences are decoded.
+        """
+        symbols = set(self.startSymbols + [self.endSymbol])
+        return [self.decodeToken(token) for token in sentence
+                if token not in symbols]
+
+
+# -----------------------------------------------------------------------------
+# NGramIndex class ------------------------------------------------------------
+
+class NGramIndex(object):
+
+    def __init__(self, startSymbols=START_SYMBOLS, endSymbol=END_SYMBOL):
+        """
+        Requires: startSymbols and endSymbol are the markers of the models
+                  the index will feed (strings, or ids of their vocabulary)
+        Modifies: self (this instance of the NGramIndex object)
+        Effects:  This is the NGramIndex constructor. An NGramIndex counts
+                  the unigrams, bigrams and trigrams of a corpus together,
+                  in one pass over its tokens, and hands each table to the
+                  model of that order. The tables have exactly the layout
+                  of the nGramCounts of UnigramModel, BigramModel and
+                  TrigramModel.
+        """
+        self.startSymbols = startSymbols
+        self.endSymbol = endSymbol
+        self.counts = {1: {}, 2: {}, 3: {}}
+
+    def addSentence(self, sentence):
+        """
+        Requires: sentence is a list or array of tokens, without the start
+                  and end symbols
+        Modifies: self.counts
+        Effects:  counts every n-gram of sentence as if it were wrapped in
+                  the start and end symbols, without copying or modifying
+                  sentence. The two tokens before each new token are
+                  carried along, so every token costs one update per order.
+        """
+        unigrams = self.counts[1]
+        bigrams = self.counts[2]
+        trigrams = self.counts[3]
+
+        # the pair of start symbols is the first bigram of every sentence
+        first, second = self.startSymbols
+        following = bigrams.setdefault(first, {})
+        following[second] = following.get(second, 0) + 1
+
+        for token in itertools.chain(sentence, (self.endSymbol,)):
+            unigrams[token] = unigrams.get(token, 0) + 1
+            following = bigrams.setdefault(second, {})
+            following[token] = following.get(token, 0) + 1
+            following = trigrams.setdefault(first, {}) \
+                                .setdefault(second, {})
+            following[token] = following.get(token, 0) + 1
+            first = second
+            second = token
+
+    def getCounts(self, order):
+        """
+        Requires: order is 1, 2 or 3
+        Modifies: nothing
+        Effects:  returns the counts of that order, in the layout of the
+                  nGramCounts of the model of that order.
+        """
+        return self.counts[order]
+
+    def canFeed(self, model):
+        """
+        Requires: model is an NGramModel object
+        Modifies: nothing
+        Effects:  returns True if this index holds the counts model needs,
+                  that is if model is a fixed-order model of order 1, 2 or
+                  3.
+        """
+        return model.order in self.counts
+
+    def feedModels(self, models):
+        """
+        Requires: models is a list of NGramModel objects of distinct
+                  orders that canFeed accepts, using this index's start and
+                  end symbols
+        Modifies: the nGramCounts of every model in models
+        Effects:  hands each model the counts of its order. The tables are
+                  not copied, so the index should not be added to
+                  afterwards.
+        """
+        for model in models:
+            model.nGramCounts = self.getCounts(model.order)
+            model.clearSamplingTables()
+
+
+# -----------------------------------------------------------------------------
+# Streaming training ----------------------------------------------------------
+
+def trainModelsFromStream(models, sentences):
+    """
+    Requires: models is a list of NGramModel objects of distinct orders
+              sharing the same vocabulary (or none), sentences is an
+              iterable of lists or id arrays of tokens (for example
+              DataLoader.lyrics, or a generator such as
+              DataLoader.iterMusic)
+    Modifies: the nGramCounts of every model in models
+    Effects:  trains every model in models in a single pass over
+              sentences. The unigram, bigram and trigram models are fed
+              by one NGramIndex; any other model (such as a BackoffModel)
+              counts each sentence itself. Each sentence is read once and
+              then dropped, so only one sentence is held in memory at a
+              time, and the sentences themselves are never modified.
+    """
+    index = NGramIndex(models[0].startSymbols, models[0].endSymbol)
+    indexed = [model for model in models if index.canFeed(model)]
+    others = [model for model in models if not index.canFeed(model)]
+    for model in others:
+        model.resetCounts()
+
+    startSymbols = models[0].startSymbols
+    endSymbol = models[0].endSymbol
+    for sentence in sentences:
+        if indexed:
+            index.addSentence(sentence)
+        if others:
+            wrapped = startSymbols + list(sentence) + [endSymbol]
+            for model in others:
+                model.countSentence(wrapped)
+
+    index.feedModels(indexed)
+
+def updateModels(models, added, removed):
+    """
+    Requires: models is a list of NGramModel objects sharing the same
+              vocabulary (or none) and already trained, added and removed
+              are iterables of sentences, and every sentence in removed
+              was part of the data the models were trained on
+    Modifies: the nGramCounts of every model in models
+    Effects:  brings the models up to date with a changed corpus by
+              counting only the sentences in added and uncounting the ones
+              in removed (for example the two lists returned by
+              DataLoader.refreshLyrics), instead of retraining from
+              scratch. The counts end up the same as if the models had
+              been retrained on the new corpus.
+    """
+    countSentences(models, removed, -1)
+    countSentences(models, added, 1)
+
+def pruneModels(models, minCounts):
+    """
+    Requires: models is a list of trained NGramModel objects, minCounts is
+              a dictionary of {order: minimum count}, such as {3: 2} to
+              drop the trigrams seen only once
+    Modifies: the nGramCounts of every model in models
+    Effects:  prunes every model (see NGramModel.prune), trading some
+              fidelity for memory, and returns the list of the (number of
+              n-grams removed, bytes saved) pairs of the models, where the
+              bytes saved are the drop in getMemorySize. Leave the lowest
+              order model unpruned: every sentence backs off to it in the
+              end.
+    """
+    results = []
+    for model in models:
+        before = model.getMemorySize()
+        removed = model.prune(minCounts)
+        results.append((removed, before - model.getMemorySize()))
+    return results
+
+def mergeModels(models, others):
+    """
+    Requires: models and others are lists of the same kinds of trained
+              models, in the same order, each list sharing one vocabulary
+              (or none)
+    Modifies: the nGramCounts of every model in models, and their
+              vocabulary
+    Effects:  adds the counts of each model of others to the model at the
+              same position in models, and returns models. Models trained
+              in separate processes each have their own vocabulary, so the
+              ids of others are first translated into the vocabulary of
+              models, which takes in the tokens it has not seen yet.
+    """
+    translation = None
+    vocabulary = models[0].vocabulary
+    otherVocabulary = others[0].vocabulary
+    if vocabulary is not otherVocabulary and otherVocabulary is not None:
+        translation = [vocabulary.getId(token)
+                       for token in otherVocabulary.tokens]
+    for model, other in zip(models, others):
+        model.mergeCounts(other, translation)
+    return models
+
+def reduceModels(modelLists):
+    """
+    Requires: modelLists is a non-empty list of lists of models that
+              mergeModels can merge, for example trained on separate
+              shards of a corpus
+    Modifies: the models in modelLists
+    Effects:  merges all of modelLists into one list of models, pairwise
+              in rounds like a tree, and returns it. Since merging is
+              associative, the counts come out the same as if the models
+              had been trained on all the shards at once.
+    """
+    while len(modelLists) > 1:
+        merged = [mergeModels(modelLists[i], modelLists[i + 1])
+                  for i in range(0, len(modelLists) - 1, 2)]
+        if len(modelLists) % 2:
+            merged.append(modelLists[-1])
+        modelLists = merged
+    return modelLists[0]
+
+def scoreSequences(models, sequences, floor=PROBABILITY_FLOOR):
+    """
+    Requires: models is a list of trained models sorted by descending
+              priority, as for generate.selectNGramModel, sequences is an
+              iterable of lists or id arrays of tokens (without the start
+              and end symbols), floor is a probability above zero
+    Modifies: nothing
+    Effects:  returns a tuple of the natural log of the probability the
+              models give sequences, the number of tokens scored and the
+              number of them that had to fall back on the floor.
+
+              Every token of a sequence after the start symbols, the end
+              symbol included, is scored by interpolating, Witten-Bell
+              style, the candidate dictionaries of its context that the
+              models back off through (see getBackoffDictionaries), from
+              the first model to the last and from the longest context to
+              the shortest: with c the count of the token, n the total
+              count and t the number of distinct candidates of a
+              dictionary, the probability there is (c + t * p) / (n + t),
+              where p is the probability of the next dictionary down, and
+              floor below the last one. A token is never scored by one
+              model alone, so a token the trigram model never saw after
+              its context still gets the bigram and unigram estimates,
+              and only a token no dictionary has falls back on the floor.
+
+              The dictionaries of each distinct context, and the total
+              and size of each dictionary, are looked up once per call, so
+              scoring a held-out set mostly costs a few dictionary lookups
+              per token.
+    """
+    startSymbols = models[0].startSymbols
+    endSymbol = models[0].endSymbol
+    contextLength = max(model.getContextLength() for model in models)
+
+    # last contextLength tokens -> list of (candidates, total, types),
+    # shortest context first
+    contexts = {}
+    summaries = {}  # id of candidates -> (candidates, total, types)
+    caches = [{} for model in models]   # for getBackoffDictionaries
+    logProbability = 0.0
+    numTokens = 0
+    numFloored = 0
+    for sequence in sequences:
+        sentence = startSymbols + list(sequence) + [endSymbol]
+        for i in range(len(startSymbols), len(sentence)):
+            tail = sentence[max(0, i - contextLength):i]
+            key = tuple(tail)
+            levels = contexts.get(key)
+            if levels is None:
+                levels = []
+                for model, cache in zip(models, caches):
+                    for candidates in model.getBackoffDictionaries(tail,
+                                                                   cache):
+                        level = summaries.get(id(candidates))
+                        if level is None:
+                            level = (candidates, sum(candidates.itervalues()),
+                                     len(candidates))
+                            summaries[id(candidates)] = level
+                        levels.append(level)
+                levels.reverse()
+                contexts[key] = levels
+
+            token = sentence[i]
+            probability = floor
+            seen = False
+            for candidates, total, types in levels:
+                count = candidates.get(token, 0)
+                if count:
+                    seen = True
+                probability = (count + types * probability) / \
+                    float(total + types)
+            if not seen:
+                numFloored += 1
+            logProbability += math.log(probability)
+            numTokens += 1
+    return logProbability, numTokens, numFloored
+
+def computePerplexity(models, sequences, floor=PROBABILITY_FLOOR):
+    """
+    Requires: models and sequences are as for scoreSequences
+    Modifies: nothing
+    Effects:  returns a tuple of the perplexity of the models on
+              sequences and the share of their tokens that fell back on
+              the floor (see scoreSequences). The perplexity is e to the
+              minus average log probability per token, the number of
+              equally likely choices the models are as unsure as on
+              average. Lower is better; comparing it on a held-out set
+              (see DataLoader.splitLyrics and splitMusic) before and after
+              a change shows whether the change cost model quality, as
+              long as the floor share stays small.
+    """
+    logProbability, numTokens, numFloored = scoreSequences(models, sequences,
+                                                           floor)
+    if numTokens == 0:
+        return float("nan"), float("nan")
+    return math.exp(-logProbability / numTokens), \
+        numFloored / float(numTokens)
+
+def countSentences(models, sentences, delta):
+    """
+    Requires: models is a list of NGramModel objects sharing the same
+              vocabulary (or none), delta is 1 or -1
+    Modifies: the nGramCounts of every model in models
+    Effects:  wraps each sentence in the start and end symbols and adds
+              it to (or, if delta is -1, removes it from) every model.
+              Each model drops the sampling tables of the contexts it
+              counts the sentences under.
+    """
+    startSymbols = models[0].startSymbols
+    endSymbol = models[0].endSymbol
+    for sentence in sentences:
+        sentence = startSymbols + list(sentence) + [endSymbol]
+        for model in models:
+            model.countSentence(sentence, delta)
 
 
 # -----------------------------------------------------------------------------
@@ -0,0 +1,359 @@
+import random
+from nGramModel import *
+
+# letters that start the rhyme of a word; y only counts when it is not the
+# first letter, so that 'you' rhymes on 'ou' and 'fly' on 'y'
+VOWELS = 'aeiouy'
+
+# final rhymes whose sound depends on whether they follow another syllable:
+# alone they sound like the i of 'my' ('my', 'I', 'lie', 'lies'), after one
+# like the e of 'me' ('baby', 'taxi', 'movie', 'babies'); spelling -> its
+# key in either case
+LONG_I_ENDINGS = {'y': ('ie', 'ee'), 'i': ('ie', 'ee'), 'ie': ('ie', 'ee'),
+                  'ies': ('ies', 'ees')}
+
+# other spellings of the same final rhymes, such as the e of 'me' and 'she',
+# the ea of 'sea' and the eye of 'eye' -> the key they share
+RHYME_SPELLINGS = {'e': 'ee', 'ea': 'ee', 'eas': 'ees', 'eye': 'ie',
+                   'eyes': 'ies', 'igh': 'ie', 'ighs': 'ies'}
+
+# the most sampling tables a RhymeIndex keeps before it starts over, since
+# every context, rhyme class and excluded word can need a table of its own
+MAX_RHYME_TABLES = 50000
+
+
+def hasVowel(letters):
+    """
+    Requires: letters is a string of lowercase letters
+    Modifies: nothing
+    Effects:  returns True if letters has a vowel, not counting a y it
+              starts with (see VOWELS).
+    """
+    for i in range(len(letters)):
+        if letters[i] in VOWELS and (i > 0 or letters[i] != 'y'):
+            return True
+    return False
+
+def getRhymeKey(word):
+    """
+    Requires: word is a string
+    Modifies: nothing
+    Effects:  returns the suffix class of word: its letters from the start
+              of its last group of vowels to the end, taking a final
+              silent e along with them, so 'love' and 'above' both give
+              'ove', and 'day' and 'away' both give 'ay'. The e of a word
+              like 'she' is its only vowel, so it is not silent. Endings
+              spelled differently that sound the same share the key of
+              LONG_I_ENDINGS or RHYME_SPELLINGS, so that 'me', 'see' and
+              'baby' all give 'ee', and 'my', 'eye' and 'high' all give
+              'ie'; a y that is the vowel of the rhyme counts as an i.
+              Words with the same key rhyme by spelling, which is all the
+              lyrics can tell; words without vowels are their own class.
+    """
+    letters = ''.join([c for c in word.lower() if c.isalpha()])
+    end = len(letters)
+    if end > 2 and letters[-1] == 'e' and letters[-2] not in VOWELS and \
+            hasVowel(letters[:-2]):
+        end -= 1
+    start = end - 1
+    while start >= 0 and letters[start] not in VOWELS:
+        start -= 1
+    if start < 0:
+        return letters
+    while start > 1 and letters[start - 1] in VOWELS:
+        start -= 1
+    if start == 1 and letters[0] in VOWELS and letters[0] != 'y':
+        start = 0
+    key = letters[start:]
+    if len(key) > 1 and key[0] == 'y' and key[1] not in VOWELS:
+        # a y that is the vowel of the rhyme sounds like an i: 'rhyme'
+        key = 'i' + key[1:]
+    if key in LONG_I_ENDINGS:
+        return LONG_I_ENDINGS[key][hasVowel(letters[:start])]
+    return RHYME_SPELLINGS.get(key, key)
+
+
+# -----------------------------------------------------------------------------
+# RhymeIndex class ------------------------------------------------------------
+
+class RhymeIndex(object):
+
+    def __init__(self, models):
+        """
+        Requires: models is a list of trained models sorted by descending
+                  priority, as for generateSentence, trained on lists of
+                  words or on the word ids of a Vocabulary
+        Modifies: self (this instance of the RhymeIndex object)
+        Effects:  this is the RhymeIndex constructor. It indexes the words
+                  that end a line somewhere in the training data (the
+                  words followed by the end symbol) by their rhyme key
+                  (see getRhymeKey), and, for every context of every
+                  model, the counts of just those line-final words among
+                  its candidates. A context missing from that index cannot
+                  end a line at all, and a rhyme class it has no candidate
+                  of cannot be reached from it, so the last word of a line
+                  can be drawn from a rhyme class without generating and
+                  rejecting whole lines.
+                  The index is built from the counts the models have now:
+                  build a new one after training or updating them.
+        """
+        self.models = models
+        endSymbol = models[0].endSymbol
+        symbols = set(models[0].startSymbols + [endSymbol])
+
+        finalTokens = set()
+        for model in models:
+            for context, counts in model.iterContextCounts():
+                if context and endSymbol in counts and \
+                        context[-1] not in symbols:
+                    finalTokens.add(context[-1])
+
+        self.rhymeKeys = {}     # line-final token -> its rhyme key
+        self.classes = {}       # rhyme key -> set of line-final tokens
+        for token in finalTokens:
+            key = getRhymeKey(str(models[0].decodeToken(token)))
+            self.rhymeKeys[token] = key
+            self.classes.setdefault(key, set()).add(token)
+
+        # the line-final tokens with another token to rhyme with, which is
+        # where the first line of a couplet has to end
+        self.rhymable = set(token for token in finalTokens
+                            if len(self.classes[self.rhymeKeys[token]]) > 1)
+
+        # per model: context tuple -> {line-final token: count}, and the
+        # lengths of those contexts, longest first
+        self.finalCounts = []
+        self.contextLengths = []
+        for model in models:
+            contexts = {}
+            for context, counts in model.iterContextCounts():
+                finals = dict((token, count)
+                              for token, count in counts.iteritems()
+                              if token in finalTokens)
+                if finals:
+                    contexts[tuple(context)] = finals
+            self.finalCounts.append(contexts)
+            self.contextLengths.append(
+                sorted(set(len(context) for context in contexts),
+                       reverse=True))
+
+        # rhyme key -> set of the tokens some line-final token of the class
+        # follows (any token with a rhyme for None), the only tokens that
+        # can leave a sentence able to reach the class (see getStepToken)
+        self.predecessors = {None: set()}
+        for contexts in self.finalCounts:
+            for context, finals in contexts.iteritems():
+                if not context:
+                    continue
+                for token in finals:
+                    self.predecessors.setdefault(self.rhymeKeys[token],
+                                                 set()).add(context[-1])
+                    if token in self.rhymable:
+                        self.predecessors[None].add(context[-1])
+
+        # the most tokens at the end of a sentence any model looks at
+        self.maxContextLength = max(model.getContextLength()
+                                    for model in models)
+
+        # (model index, context, rhyme key, excluded token) -> sampling
+        # table, or None if the context cannot reach the class, and the
+        # same with 'step' in front for getStepToken; emptied whenever it
+        # reaches MAX_RHYME_TABLES
+        self.tables = {}
+
+        # (model index, context length) -> number of final tokens drawn
+        # there, with None for the ones chosen uniformly (see
+        # getFinalToken)
+        self.finalLevels = {}
+
+    def getTokenRhymeKey(self, token):
+        """
+        Requires: token is a token of the models
+        Modifies: nothing
+        Effects:  returns the rhyme key of token, or None if token never
+                  ends a line in the training data.
+        """
+        return self.rhymeKeys.get(token)
+
+    def getAllowedTokens(self, rhymeKey, exclude):
+        """
+        Requires: rhymeKey is None or a rhyme key, exclude is None or a
+                  token
+        Modifies: nothing
+        Effects:  returns the set of line-final tokens of the class
+                  rhymeKey (the tokens that have a rhyme if rhymeKey is
+                  None), without exclude unless it is the only one.
+        """
+        if rhymeKey is None:
+            allowed = self.rhymable
+        else:
+            allowed = self.classes.get(rhymeKey, set())
+        if exclude in allowed and len(allowed) > 1:
+            allowed = allowed - set([exclude])
+        return allowed
+
+    def getRhymeSamplingTable(self, index, context, rhymeKey, exclude):
+        """
+        Requires: index is the position of a model in self.models, context
+                  is a tuple of tokens, rhymeKey and exclude are as for
+                  getAllowedTokens
+        Modifies: self.tables
+        Effects:  returns the sampling table of the line-final candidates
+                  after context of the model at index that are in the
+                  class rhymeKey (other than exclude), or None if the
+                  model cannot reach the class from context. Each table is
+                  built the first time it comes up and reused after that,
+                  until self.tables holds MAX_RHYME_TABLES of them and is
+                  emptied.
+        """
+        cacheKey = (index, context, rhymeKey, exclude)
+        try:
+            return self.tables[cacheKey]
+        except KeyError:
+            pass
+        if len(self.tables) >= MAX_RHYME_TABLES:
+            self.tables.clear()
+        table = None
+        finals = self.finalCounts[index].get(context)
+        if finals is not None:
+            allowed = self.getAllowedTokens(rhymeKey, exclude)
+            candidates = dict((token, count)
+                              for token, count in finals.iteritems()
+                              if token in allowed)
+            if candidates:
+                table = self.models[index].makeSamplingTable(candidates)
+        self.tables[cacheKey] = table
+        return table
+
+    def findFinalTable(self, sentence, rhymeKey, exclude):
+        """
+        Requires: sentence is a list of tokens, rhymeKey and exclude are
+                  as for getAllowedTokens
+        Modifies: self.tables
+        Effects:  returns a (model index, context length, sampling table)
+                  tuple for the longest context of sentence the first
+                  model can reach the class rhymeKey from, backing off to
+                  shorter contexts and then to the next model, or None if
+                  no context reaches it (see getRhymeSamplingTable).
+        """
+        for index in range(len(self.models)):
+            for length in self.contextLengths[index]:
+                if length > len(sentence):
+                    continue
+                context = tuple(sentence[len(sentence) - length:])
+                table = self.getRhymeSamplingTable(index, context, rhymeKey,
+                                                   exclude)
+                if table is not None:
+                    return index, length, table
+        return None
+
+    def canReachClass(self, sentence, rhymeKey, exclude):
+        """
+        Requires: as for findFinalTable
+        Modifies: self.tables
+        Effects:  returns True if a context of at least one word at the
+                  end of sentence can reach the class rhymeKey, so that
+                  the last word drawn after it follows from the line.
+        """
+        found = self.findFinalTable(sentence, rhymeKey, exclude)
+        return found is not None and found[1] > 0
+
+    def getStepToken(self, sentence, rhymeKey=None, exclude=None, rng=None):
+        """
+        Requires: sentence is a list of tokens, rhymeKey and exclude are
+                  as for getAllowedTokens, rng is None or a random.Random
+        Modifies: self.tables, rng (the random module if rng is None)
+        Effects:  returns a token to add to sentence before its last word
+                  when the end of sentence cannot reach the class rhymeKey
+                  (see canReachClass), drawn with their counts as weights
+                  from the candidates that can reach the class once added.
+                  The candidates come from the model generation would pick
+                  (see generate.selectNGramModel), or, if none of its
+                  candidates can reach the class, from the next model that
+                  knows the context of sentence. Returns None if no
+                  candidate of any model can. The tables of these draws
+                  are kept in self.tables along with the others.
+        """
+        if rng is None:
+            rng = random
+        tail = sentence[max(0, len(sentence) - self.maxContextLength):]
+        for index, model in enumerate(self.models):
+            if index < len(self.models) - 1 and \
+                    not model.trainingDataHasNGram(sentence):
+                continue
+            cacheKey = ('step', index, tuple(tail), rhymeKey, exclude)
+            try:
+                table = self.tables[cacheKey]
+            except KeyError:
+                if len(self.tables) >= MAX_RHYME_TABLES:
+                    self.tables.clear()
+                candidates = {}
+                reachable = self.predecessors.get(rhymeKey, ())
+                for token, count in model.getCandidateItems(sentence):
+                    if token in reachable and self.canReachClass(
+                            tail + [token], rhymeKey, exclude):
+                        candidates[token] = count
+                table = None
+                if candidates:
+                    table = model.makeSamplingTable(candidates)
+                self.tables[cacheKey] = table
+            if table is not None:
+                return model.sampleTable(table, rng)
+        return None
+
+    def getFinalToken(self, sentence, rhymeKey=None, exclude=None, rng=None):
+        """
+        Requires: sentence is a list of tokens, rhymeKey and exclude are
+                  as for getAllowedTokens, rng is None or a random.Random
+        Modifies: self.tables, self.finalLevels, rng (the random module if
+                  rng is None)
+        Effects:  returns a token to end sentence with that is in the
+                  class rhymeKey (any token with a rhyme if rhymeKey is
+                  None) and is not exclude, if the class has another
+                  token. It is drawn from the longest context of sentence
+                  the first model can reach the class from, backing off to
+                  shorter contexts and then to the next model, so the
+                  draw never has to be repeated. If no context reaches the
+                  class (every such n-gram was pruned, say), a token of
+                  the class is chosen uniformly. Returns None if the class
+                  has no tokens at all.
+                  The draw is counted in self.finalLevels under the model
+                  and context length it came from: a token drawn after a
+                  short context, or uniformly, owes little to the rest of
+                  the line.
+        """
+        if rng is None:
+            rng = random
+        found = self.findFinalTable(sentence, rhymeKey, exclude)
+        if found is not None:
+            index, length, table = found
+            self.finalLevels[index, length] = \
+                self.finalLevels.get((index, length), 0) + 1
+            return self.models[index].sampleTable(table, rng)
+        allowed = self.getAllowedTokens(rhymeKey, exclude)
+        if not allowed:
+            return None
+        self.finalLevels[None] = self.finalLevels.get(None, 0) + 1
+        return rng.choice(sorted(allowed))
+
+
+# -----------------------------------------------------------------------------
+# Testing code ----------------------------------------------------------------
+
+if __name__ == '__main__':
+    rhymes = [('love', 'above'), ('day', 'away'), ('me', 'see'),
+              ('she', 'free'), ('the', 'me'), ('sea', 'baby'),
+              ('eyes', 'lies'), ('my', 'by'), ('fly', 'eye'), ('i', 'high'),
+              ('cries', 'sighs'), ('babies', 'trees'), ('time', 'rhyme'),
+              ('him', 'gym')]
+    nonRhymes = [('baby', 'my'), ('me', 'my'), ('eyes', 'ease'),
+                 ('love', 'live'), ('day', 'die'), ('you', 'yeah')]
+    for first, second in rhymes:
+        if getRhymeKey(first) != getRhymeKey(second):
+            print 'should rhyme:', first, getRhymeKey(first), \
+                second, getRhymeKey(second)
+    for first, second in nonRhymes:
+        if getRhymeKey(first) == getRhymeKey(second):
+            print 'should not rhyme:', first, second, getRhymeKey(first)
+    print '%d rhyming and %d non-rhyming pairs checked' % (len(rhymes),
+                                                          len(nonRhymes))
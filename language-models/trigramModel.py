@@ -9,55 +9,47 @@ from nGramModel import *
 
 class TrigramModel(NGramModel):
 
-    def __init__(self):
+    order = 3
+
+    def __init__(self, vocabulary=None):
         """
-        Requires: nothing
+        Requires: vocabulary is None or a Vocabulary (see NGramModel)
         Modifies: self (this instance of the NGramModel object)
         Effects:  this is the TrigramModel constructor, which is done
                   for you. It allows TrigramModel to access the data
                   from the NGramModel class.
         """
-        super(TrigramModel, self).__init__()
+        super(TrigramModel, self).__init__(vocabulary)
 
-    def trainModel(self, text):
+    def countSentence(self, sentence, delta=1):
         """
-        Requires: text is a list of lists of strings
-        Modifies: self.nGramCounts, a three-dimensional dictionary. For
-                  examples and pictures of the TrigramModel's version of
-                  self.nGramCounts, see the spec.
-        Effects:  this function populates the self.nGramCounts dictionary,
-                  which has strings as keys and dictionaries as values,
-                  where those inner dictionaries have strings as keys
-                  and dictionaries of {string: integer} pairs as values.
-                  Note: make sure to use the return value of prepData to
-                  populate the dictionary, which will allow the special
-                  symbols to be included as their own tokens in
-                  self.nGramCounts. For more details, see the spec.
+        Requires: sentence is a list of tokens that starts with
+                  self.startSymbols and ends with self.endSymbol; if delta
+                  is negative, sentence was counted before
+        Modifies: self.nGramCounts
+        Effects:  counts every run of three adjacent tokens in sentence,
+                  exactly as trainModel does for each sentence. With a
+                  delta of -1 the sentence is uncounted instead, and
+                  trigrams whose count drops to zero are removed, along
+                  with any dictionaries that are left empty. The sampling
+                  tables of the contexts counted are dropped.
         """
-        self.nGramCounts = {}
-        lyrics = TrigramModel.prepData(self, text)
-        for words in lyrics:
-            for i in range(len(words) - 2):
-                self.nGramCounts[words[i]] = {}
-
-        for words in lyrics:
-            for i in range(len(words) - 2):
-                if self.nGramCounts.get(words[i], False):
-                    self.nGramCounts[words[i]].update({words[i +1] : {}})
-                else:
-                    self.nGramCounts[words[i]] = {words[i + 1] : {}}
-
-        for words in lyrics:
-            for i in range(len(words) - 2 ):
-                if self.nGramCounts[words[i]].get(words[i +1], False):
-                    count = self.nGramCounts[words[i]][words[i+1]].get(words[i + 2], 0)
-                    self.nGramCounts[words[i]][words[i+1]].update({words[i+2] : count +1})
-                else:
-                    self.nGramCounts[words[i]][words[i + 1]] = {words[i+2] : 1}
-
-
-
-
+        counts = self.nGramCounts
+        invalidate = self.samplingTables or self.keyTables
+        for i in range(len(sentence) - 2):
+            if invalidate:
+                self.invalidateContext((sentence[i], sentence[i + 1]))
+            middle = counts.setdefault(sentence[i], {})
+            following = middle.setdefault(sentence[i + 1], {})
+            count = following.get(sentence[i + 2], 0) + delta
+            if count > 0:
+                following[sentence[i + 2]] = count
+            else:
+                following.pop(sentence[i + 2], None)
+                if not following:
+                    del middle[sentence[i + 1]]
+                    if not middle:
+                        del counts[sentence[i]]
 
     def trainingDataHasNGram(self, sentence):
         """
@@ -91,6 +83,55 @@ class TrigramModel(NGramModel):
 
         return dict
 
+    def getContext(self, sentence):
+        """
+        Requires: sentence is a list of strings, and len(sentence) >= 2
+        Modifies: nothing
+        Effects:  returns the tuple of the last two tokens of sentence,
+                  which the candidates depend on.
+        """
+        return (sentence[-2], sentence[-1])
+
+    def getContextCounts(self, context):
+        """
+        Requires: context is a pair of tokens in self.nGramCounts
+        Modifies: nothing
+        Effects:  returns the candidate dictionary of the tokens following
+                  the two tokens of context.
+        """
+        return self.nGramCounts[context[0]][context[1]]
+
+    def iterContexts(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns every pair of tokens that has candidates after
+                  it.
+        """
+        return ((first, second) for first in self.nGramCounts
+                for second in self.nGramCounts[first])
+
+    def removeContext(self, context):
+        """
+        Requires: context is a pair of tokens whose candidate dictionary is
+                  empty
+        Modifies: self.nGramCounts
+        Effects:  removes the empty dictionary of context, and the
+                  dictionary of its first token if that is left empty too.
+        """
+        middle = self.nGramCounts[context[0]]
+        del middle[context[1]]
+        if not middle:
+            del self.nGramCounts[context[0]]
+
+    def getContextTokens(self, context):
+        """
+        Requires: context is a pair of tokens
+        Modifies: nothing
+        Effects:  returns context, which already is a tuple of tokens.
+        """
+        return context
+
 
 # -----------------------------------------------------------------------------
 # Testing code ----------------------------------------------------------------
@@ -9,42 +9,39 @@ from nGramModel import *
 
 class UnigramModel(NGramModel):
 
-    def __init__(self):
+    order = 1
+
+    def __init__(self, vocabulary=None):
         """
-        Requires: nothing
+        Requires: vocabulary is None or a Vocabulary (see NGramModel)
         Modifies: self (this instance of the UnigramModel object)
         Effects:  this is the UnigramModel constructor, which is done
                   for you. It allows UnigramModel to access the data
                   in the NGramModel class by calling the NGramModel
                   constructor.
         """
-        super(UnigramModel, self).__init__()
+        super(UnigramModel, self).__init__(vocabulary)
 
-    def trainModel(self, text):
+    def countSentence(self, sentence, delta=1):
         """
-        Requires: text is a list of lists of strings
+        Requires: sentence is a list of tokens that starts with
+                  self.startSymbols and ends with self.endSymbol; if delta
+                  is negative, sentence was counted before
         Modifies: self.nGramCounts
-        Effects:  this function populates the self.nGramCounts dictionary,
-                  which is a dictionary of {string: integer} pairs.
-                  For further explanation of UnigramModel's version of
-                  self.nGramCounts, see the spec.
-                  Note: make sure to use the return value of prepData to
-                  populate the dictionary, which will allow the special
-                  symbols to be included as their own tokens in
-                  self.nGramCounts. For more details, see the spec.
-        """
-        self.nGramCounts = {}
-        lyrics = UnigramModel.prepData(self, text)
-        for words in lyrics:
-            words.remove("^::^")
-            words.remove('^:::^')
-            for i in range(len(words)):
-                self.nGramCounts[words[i]] = 0
-        for words in lyrics:
-            for i in range(len(words)):
-                self.nGramCounts[words[i]] = self.nGramCounts[words[i]] +1
-
-
+        Effects:  counts every token of sentence except the start symbols,
+                  exactly as trainModel does for each sentence. With a
+                  delta of -1 the sentence is uncounted instead, and tokens
+                  whose count drops to zero are removed. The sampling
+                  tables of the model are dropped.
+        """
+        self.invalidateContext(None)
+        counts = self.nGramCounts
+        for word in sentence[len(self.startSymbols):]:
+            count = counts.get(word, 0) + delta
+            if count > 0:
+                counts[word] = count
+            else:
+                counts.pop(word, None)
 
     def trainingDataHasNGram(self, sentence):
         """
@@ -70,7 +67,40 @@ class UnigramModel(NGramModel):
         """
         return self.nGramCounts
 
+    def getContext(self, sentence):
+        """
+        Requires: sentence is a list of strings
+        Modifies: nothing
+        Effects:  returns None: the UnigramModel draws from the same
+                  candidates whatever the sentence is.
+        """
+        return None
+
+    def getContextCounts(self, context):
+        """
+        Requires: context is None
+        Modifies: nothing
+        Effects:  returns the candidate dictionary, all of self.nGramCounts.
+        """
+        return self.nGramCounts
+
+    def iterContexts(self):
+        """
+        Requires: nothing
+        Modifies: nothing
+        Effects:  returns the single context of the model, if it is trained.
+        """
+        if self.nGramCounts:
+            return [None]
+        return []
 
+    def getContextTokens(self, context):
+        """
+        Requires: context is None
+        Modifies: nothing
+        Effects:  returns the empty tuple: unigrams have no context.
+        """
+        return ()
 
 # -----------------------------------------------------------------------------
 # Testing code ----------------------------------------------------------------